@@ -1,59 +1,376 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from app.schemas.notification import NotificationCreate, NotificationReport
-from app.workers.tasks import send_notification
+from typing import List, Optional
+from urllib.parse import parse_qsl
+from datetime import datetime, timedelta
+import asyncio
+import base64
+import csv
+import io
+import json
+import math
+from app.schemas.notification import (
+    DeliveryStats, NotificationCreate, NotificationBatchCreate, NotificationFilter, NotificationReport, NotificationReportPage
+)
+from app.models.notifications import new_notification_id
+from app.repositories.dedup_filter import content_key, dedup_key, get_dedup_filter
 from app.repositories.notification_repo import NotificationRepo
-from app.db.session import AsyncSession, get_db
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from jose import JWTError, jwt
+from app.repositories.status_buffer import get_status_buffer
+from app.repositories.report_cache import get_report_cache
+from app.repositories.stats_repo import StatsRepo
+from app.services.templates import get_template_registry
+from app.services.tenant_quota import get_tenant_rate_limiter
+from app.services.webhooks import (
+    get_webhook_queue, parse_sendgrid_events, parse_twilio_callback, verify_sendgrid_signature, verify_twilio_signature
+)
+from app.db.session import AsyncSession, get_db, get_session_factory, is_transient
+from jose import JWTError
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from app.core.config import settings
+from app.core.security import JWKSUnavailable, get_token_verifier
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
-limiter = Limiter(key_func=get_remote_address)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")  # Placeholder; implement auth properly
 
 # Dependency for JWT auth
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        payload = await get_token_verifier().verify(token)
         return payload.get("sub")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    except JWKSUnavailable:
+        raise HTTPException(status_code=503, detail="Signing keys unavailable", headers={"Retry-After": "5"})
 
 class WebhookPayload(BaseModel):
-    event_id: str
+    notification_id: str
     status: str  
 
+async def enforce_rate_limit(user: str, units: int = 1):
+    # Per-tenant quota shared by all API processes; a batch costs one unit per notification
+    limiter = get_tenant_rate_limiter()
+    limit = limiter.limit_for(user)
+    if units > limit:
+        # Would never fit in the window, so retrying after Retry-After can't help
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {units} notifications exceeds the tenant limit of {limit} per {limiter.window}s",
+        )
+    retry_after = await limiter.check(user, units)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+async def resolve_templates(db: AsyncSession, notifications: List[NotificationCreate]):
+    # Pins templated notifications to a version so retries render the same text,
+    # and rejects unknown templates and missing variables before anything is queued
+    registry = get_template_registry()
+    for notification in notifications:
+        if notification.template_id is None:
+            continue
+        template = await registry.get(db, notification.template_id, notification.template_version)
+        if template is None:
+            raise HTTPException(status_code=400, detail=f"Unknown template {notification.template_id}")
+        if template.channel != notification.channel:
+            raise HTTPException(status_code=400, detail=f"Template {template.template_id} is for {template.channel}")
+        missing = template.variables - set(notification.variables or ())
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Missing template variables: {', '.join(sorted(missing))}")
+        notification.template_version = template.version
+
+INSERT_ATTEMPTS = 3
+INSERT_RETRY_DELAY_S = 0.05
+
+async def _retry_transient(db: AsyncSession, exc: DBAPIError, attempt: int):
+    # Concurrent triggers storing the same body can conflict on its row lock;
+    # nothing was committed, so the caller runs the transaction again
+    await db.rollback()
+    if not is_transient(exc) or attempt == INSERT_ATTEMPTS - 1:
+        raise exc
+    logger.warning("Retrying notification insert after transient error: %s", exc.orig)
+    await asyncio.sleep(INSERT_RETRY_DELAY_S * 2 ** attempt)
+
+def _replayed(response: Response, notification_id: str) -> dict:
+    logger.info("Duplicate trigger suppressed, returning notification_id: %s", notification_id)
+    response.headers["Idempotent-Replayed"] = "true"
+    return {"message": "Notification already queued", "notification_id": notification_id}
+
 @router.post("/trigger", status_code=status.HTTP_202_ACCEPTED)
-@limiter.limit("10/minute")  # Rate limit to prevent abuse
-async def trigger_notification(notification: NotificationCreate, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
-    logger.info(f"Triggering notification for event: {notification.event_type}")
+async def trigger_notification(
+    notification: NotificationCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    logger.info("Triggering notification for event: %s", notification.event_type)
+    await enforce_rate_limit(user)
+    await resolve_templates(db, [notification])
+    key = dedup_key(user, idempotency_key)
+    content = None if key else content_key(user, notification)
+    dedup = get_dedup_filter()
+    if key:
+        # Recently accepted duplicates are answered without a database write
+        original = await dedup.get(key)
+        if original:
+            return _replayed(response, original)
+    notification_id = new_notification_id()
+    if content:
+        original = await dedup.claim(content, notification_id, settings.DEDUP_CONTENT_WINDOW_S)
+        if original:
+            return _replayed(response, original)
     try:
-        # Enqueue task via Celery
-        send_notification.delay(notification.model_dump())
-        # Log to DB
-        await NotificationRepo.create(db, notification)
-        return {"message": "Notification queued"}
+        for attempt in range(INSERT_ATTEMPTS):
+            try:
+                # Row and outbox message commit together; the outbox relay enqueues the task
+                db_notification = await NotificationRepo.create(db, notification, notification_id, dedup_key=key)
+                break
+            except IntegrityError:
+                raise
+            except DBAPIError as e:
+                await _retry_transient(db, e, attempt)
+    except IntegrityError:
+        # Lost a race with a concurrent duplicate, or the filter had forgotten the key
+        await db.rollback()
+        original = (await NotificationRepo.get_ids_by_dedup_keys(db, [key])).get(key) if key else None
+        if original is None:
+            logger.error("Error triggering notification: integrity error without a dedup match")
+            if content:
+                await dedup.release(content)
+            raise HTTPException(status_code=500, detail="Internal error")
+        await dedup.remember(key, original)
+        return _replayed(response, original)
     except Exception as e:
-        logger.error(f"Error triggering notification: {str(e)}")
+        logger.error("Error triggering notification: %s", e)
+        if content:
+            await dedup.release(content)
         raise HTTPException(status_code=500, detail="Internal error")
+    if key:
+        await dedup.remember(key, db_notification.notification_id)
+    return {"message": "Notification queued", "notification_id": db_notification.notification_id}
+
+@router.post("/trigger/batch", status_code=status.HTTP_202_ACCEPTED)
+async def trigger_notification_batch(
+    batch: NotificationBatchCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    logger.info("Triggering batch of %s notifications", len(batch.notifications))
+    await enforce_rate_limit(user, len(batch.notifications))
+    await resolve_templates(db, batch.notifications)
+    # One key per item: retrying a partially applied batch only inserts what is missing
+    keys = [dedup_key(user, idempotency_key, i) for i in range(len(batch.notifications))]
+    dedup = get_dedup_filter()
+    claimed, replayed = {}, {}  # item index -> content key claimed by this batch / first notification_id
+    ids = [new_notification_id() for _ in keys]
+    try:
+        known = {}
+        for key in filter(None, keys):
+            original = await dedup.get(key)
+            if original:
+                known[key] = original
+        for i, (notification, key) in enumerate(zip(batch.notifications, keys)):
+            content = None if key else content_key(user, notification)
+            if content:
+                # Repeats within the batch find the earlier item's claim
+                original = await dedup.claim(content, ids[i], settings.DEDUP_CONTENT_WINDOW_S)
+                if original:
+                    replayed[i] = original
+                else:
+                    claimed[i] = content
+        for attempt in range(INSERT_ATTEMPTS):
+            unknown = [key for key in keys if key and key not in known]
+            if unknown:
+                known.update(await NotificationRepo.get_ids_by_dedup_keys(db, unknown))
+
+            new, new_keys, new_ids, seen = [], [], [], set()
+            for i, (notification, key) in enumerate(zip(batch.notifications, keys)):
+                if i in replayed or key and (key in known or key in seen):
+                    continue  # already accepted, or repeated within this batch
+                if key:
+                    seen.add(key)
+                new.append(notification)
+                new_keys.append(key)
+                new_ids.append(ids[i])
+
+            try:
+                # Rows and outbox messages commit together; the outbox relay enqueues the tasks
+                created = await NotificationRepo.create_many(db, new, new_keys, new_ids) if new else []
+                break
+            except IntegrityError:
+                # A concurrent request inserted some of the keys first: nothing from
+                # this attempt was committed, so re-read the keys and insert the rest
+                await db.rollback()
+                if not any(new_keys) or attempt == INSERT_ATTEMPTS - 1:
+                    raise
+            except DBAPIError as e:
+                await _retry_transient(db, e, attempt)
+        for key, row in zip(new_keys, created):
+            if key:
+                known[key] = row.notification_id
+                await dedup.remember(key, row.notification_id)
+
+        notification_ids = [
+            known[key] if key else replayed.get(i, ids[i]) for i, key in enumerate(keys)
+        ]
+        return {
+            "message": "Notifications queued",
+            "count": len(created),
+            "duplicates": len(keys) - len(created),
+            "notification_ids": notification_ids,
+        }
+    except Exception as e:
+        logger.error("Error triggering notification batch: %s", e)
+        for content in claimed.values():
+            await dedup.release(content)
+        raise HTTPException(status_code=500, detail="Internal error")
+
+EXPORT_FIELDS = list(NotificationReport.model_fields)
 
-@router.get("/reports/{event_id}", response_model=NotificationReport)
-async def get_report(event_id: str, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
-    logger.info(f"Fetching report for event_id: {event_id}")
-    report = await NotificationRepo.get_by_event_id(db, event_id)
+def _encode_cursor(row) -> str:
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+@router.get("/reports", response_model=NotificationReportPage)
+async def list_reports(
+    filters: NotificationFilter = Depends(),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=settings.REPORT_PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    after = _decode_cursor(cursor) if cursor else None
+    # One extra row tells us whether there is a next page
+    rows = await NotificationRepo.list_page(db, filters, limit + 1, after)
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+@router.get("/reports/export")
+async def export_reports(
+    filters: NotificationFilter = Depends(),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    session_factory = Depends(get_session_factory),
+    user = Depends(get_current_user),
+):
+    logger.info("Exporting reports as %s", format)
+
+    async def generate():
+        # Own session: the request-scoped one is closed before the body streams
+        async with session_factory() as db:
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(EXPORT_FIELDS)
+                yield buffer.getvalue()
+            async for chunk in NotificationRepo.stream(db, filters, settings.EXPORT_CHUNK_SIZE):
+                if format == "csv":
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows([[_export_value(row[field]) for field in EXPORT_FIELDS] for row in chunk])
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        json.dumps({field: _export_value(row[field]) for field in EXPORT_FIELDS}) + "\n"
+                        for row in chunk
+                    )
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=notifications.{format}"},
+    )
+
+@router.get("/stats", response_model=List[DeliveryStats])
+async def get_stats(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: str = Query("minute", pattern="^(minute|hour|day)$"),
+    channel: Optional[str] = None,
+    event_type: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    # Reads the rollup table only; defaults to the last hour
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=1)
+    return await StatsRepo.summary(db, start, end, bucket, channel, event_type)
+
+@router.get("/reports/{notification_id}", response_model=NotificationReport)
+async def get_report(notification_id: str, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
+    logger.info("Fetching report for notification_id: %s", notification_id)
+    cache = get_report_cache()
+    cached = await cache.get(notification_id)
+    if cached is not None:
+        return cached
+    version = await cache.version(notification_id)
+    report = await NotificationRepo.get_report(db, notification_id)
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
-    return report
+    data = NotificationReport.model_validate(report).model_dump(mode="json")
+    await cache.set(notification_id, data, version)
+    return data
+
+@router.post("/webhook", status_code=status.HTTP_202_ACCEPTED)
+async def handle_webhook(payload: WebhookPayload):
+    logger.info("Webhook received for notification_id: %s, status: %s", payload.notification_id, payload.status)
+    # Applied by the status buffer's next bulk flush
+    await get_status_buffer().add(payload.notification_id, payload.status)
+    return {"message": "Status update accepted"}
+
+@router.post("/webhook/sendgrid", status_code=status.HTTP_202_ACCEPTED)
+async def handle_sendgrid_webhook(request: Request):
+    # SendGrid posts arrays of events; they are verified, staged and applied in bulk
+    payload = await request.body()
+    if not verify_sendgrid_signature(
+        settings.SENDGRID_WEBHOOK_PUBLIC_KEY,
+        payload,
+        request.headers.get("X-Twilio-Email-Event-Webhook-Signature"),
+        request.headers.get("X-Twilio-Email-Event-Webhook-Timestamp"),
+    ):
+        logger.warning("Rejected SendGrid webhook with a missing or invalid signature")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    try:
+        events = json.loads(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="Expected an array of events")
+    if not get_webhook_queue().put_many(parse_sendgrid_events(events)):
+        raise HTTPException(status_code=503, detail="Webhook queue full")
+    return {"message": "Events accepted", "count": len(events)}
 
-@router.post("/webhook")
-async def handle_webhook(payload: WebhookPayload, db: AsyncSession = Depends(get_db)):
-    logger.info(f"Webhook received for event_id: {payload.event_id}, status: {payload.status}")
-    await NotificationRepo.update_status(db, payload.event_id, payload.status)
-    return {"message": "Status updated"}
\ No newline at end of file
+@router.post("/webhook/twilio", status_code=status.HTTP_202_ACCEPTED)
+async def handle_twilio_webhook(request: Request, notification_id: Optional[str] = None):
+    form = dict(parse_qsl((await request.body()).decode()))
+    # Twilio signs the URL it was given: the configured public URL plus our query string
+    url = str(request.url)
+    if settings.TWILIO_STATUS_CALLBACK_URL:
+        url = settings.TWILIO_STATUS_CALLBACK_URL + (f"?{request.url.query}" if request.url.query else "")
+    tokens = (settings.TWILIO_AUTH_TOKEN, settings.TWILIO_SECONDARY_AUTH_TOKEN)
+    if not verify_twilio_signature(tokens, url, form, request.headers.get("X-Twilio-Signature")):
+        logger.warning("Rejected Twilio callback with a missing or invalid signature")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    if not get_webhook_queue().put_many(parse_twilio_callback(form, notification_id)):
+        raise HTTPException(status_code=503, detail="Webhook queue full")
+    return {"message": "Event accepted"}
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from app.schemas.notification import TemplateCreate, TemplateOut
+from app.repositories.template_repo import TemplateRepo
+from app.services.templates import get_template_registry
+from app.db.session import AsyncSession, get_db
+from app.api.v1.notifications import get_current_user
+from sqlalchemy.exc import IntegrityError
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/templates", tags=["templates"])
+
+@router.post("", response_model=TemplateOut, status_code=status.HTTP_201_CREATED)
+async def register_template(template: TemplateCreate, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
+    logger.info("Registering template %s", template.template_id)
+    try:
+        db_template = await TemplateRepo.create(db, template.template_id, template.channel, template.body, template.subject)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Template was registered concurrently, retry")
+    registry = get_template_registry()
+    registry.add(db_template)
+    registry.forget_latest(template.template_id)
+    return db_template
+
+@router.get("/{template_id}", response_model=TemplateOut)
+async def get_template(template_id: str, version: Optional[int] = None, db: AsyncSession = Depends(get_db), user = Depends(get_current_user)):
+    db_template = await TemplateRepo.get(db, template_id, version)
+    if not db_template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return db_template
@@ -1,3 +1,4 @@
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 import logging
 
@@ -10,10 +11,143 @@ class Settings(BaseSettings):
     SENDGRID_API_KEY: str
     TWILIO_ACCOUNT_SID: str
     TWILIO_AUTH_TOKEN: str
+    TWILIO_PHONE_NUMBER: str
     FIREBASE_CREDENTIALS_PATH: str
     DEFAULT_FROM_EMAIL: str
     SECRET_KEY: str
+
+    # JWT verification
+    JWT_ALGORITHMS: List[str] = ["HS256"]  # e.g. ["RS256"] with JWT_JWKS_URL
+    JWT_JWKS_URL: str = ""  # Verify with keys from this JWKS endpoint instead of SECRET_KEY
+    JWT_JWKS_REFRESH_S: float = 300.0  # Minimum interval between refetches for unknown key ids
+    JWT_CACHE_MAX_ENTRIES: int = 10000  # Verified tokens kept in memory
+    JWT_CACHE_TTL_S: float = 300.0  # Capped by each token's exp
     LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "app.log"  # Empty disables the file handler
+    LOG_QUEUE_SIZE: int = 10000  # Records buffered for the writer thread; overflow is dropped
+    LOG_INFO_SAMPLE_RATE: float = 1.0  # Fraction of INFO/DEBUG records kept
+    DB_ECHO: bool = False  # Log every SQL statement
+
+    # Database pool
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+
+    # Celery workers
+    CELERY_WORKER_POOL: str = "threads"
+    CELERY_WORKER_CONCURRENCY: int = 64  # In-flight tasks per worker process
+    CELERY_METRICS_PORT: int = 9100  # Worker Prometheus exporter; 0 disables
+
+    # Per-priority worker pools; each channel has a transactional and a bulk queue
+    CELERY_TRANSACTIONAL_CONCURRENCY: int = 64
+    CELERY_TRANSACTIONAL_PREFETCH: int = 1  # Low prefetch keeps queued mail visible to idle workers
+    CELERY_TRANSACTIONAL_TIME_LIMIT_S: float = 30.0  # Per-send deadline before the task is retried
+    CELERY_BULK_CONCURRENCY: int = 64
+    CELERY_BULK_PREFETCH: int = 16
+    CELERY_BULK_TIME_LIMIT_S: float = 300.0
+
+    # Provider HTTP clients (base URLs can point at local stub servers)
+    PROVIDER_CONNECT_TIMEOUT: float = 3.0
+    SENDGRID_BASE_URL: str = "https://api.sendgrid.com"
+    SENDGRID_POOL_SIZE: int = 50
+    SENDGRID_TIMEOUT: float = 10.0
+    TWILIO_BASE_URL: str = "https://api.twilio.com"
+    TWILIO_POOL_SIZE: int = 50
+    TWILIO_TIMEOUT: float = 10.0
+    FCM_BASE_URL: str = "https://fcm.googleapis.com"
+    FCM_POOL_SIZE: int = 100
+    FCM_TIMEOUT: float = 10.0
+    FCM_HTTP2: bool = True
+    PROVIDER_CALL_DEADLINE_S: float = 10.0  # Hard limit on one provider call, including connect and retries inside httpx
+
+    # Circuit breakers per provider, per process
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5  # Consecutive failures that open the circuit; 0 disables
+    CIRCUIT_BREAKER_OPEN_S: float = 30.0  # Fail fast this long before probing
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = 1  # Probe calls allowed while half-open
+
+    # Optional secondary accounts; used only when the primary's circuit is open or it can't be reached
+    SENDGRID_SECONDARY_API_KEY: str = ""
+    SENDGRID_SECONDARY_BASE_URL: str = "https://api.sendgrid.com"
+    TWILIO_SECONDARY_ACCOUNT_SID: str = ""
+    TWILIO_SECONDARY_AUTH_TOKEN: str = ""
+    TWILIO_SECONDARY_PHONE_NUMBER: str = ""
+    TWILIO_SECONDARY_BASE_URL: str = "https://api.twilio.com"
+
+    # Outbound provider rate limits, shared by all workers; 0 disables a limit
+    RATE_LIMIT_BACKEND: str = "redis"  # "redis", or "local" for per-process limiter state
+    SENDGRID_RATE_LIMIT_PER_S: float = 100.0  # API requests, not recipients
+    TWILIO_RATE_LIMIT_PER_S: float = 100.0  # Messages per account
+    FCM_RATE_LIMIT_PER_S: float = 5000.0  # Sends (one per device token)
+    RATE_LIMIT_BURST_S: float = 1.0  # Bucket capacity in seconds of rate
+    RATE_LIMIT_LEASE_SIZE: int = 10  # Tokens leased from Redis per round trip
+    RATE_LIMIT_LEASE_TTL_S: float = 0.5  # Unused leased tokens are dropped after this
+    RATE_LIMIT_MAX_WAIT_S: float = 2.0  # Longer waits reschedule the task instead
+
+    # Inbound API quotas per tenant (JWT sub), one unit per notification
+    TENANT_RATE_LIMIT_DEFAULT: int = 600  # Units per sliding window
+    TENANT_RATE_LIMITS: Dict[str, int] = {}  # Per-tenant overrides, JSON: {"tenant": units}
+    TENANT_RATE_LIMIT_WINDOW_S: int = 60
+    TENANT_RATE_LIMIT_LEASE_SIZE: int = 10  # Units leased from Redis per round trip
+    TENANT_RATE_LIMIT_LEASE_TTL_S: float = 1.0  # Unused leased units are dropped after this
+
+    # Email personalization batching
+    EMAIL_BATCH_WINDOW_MS: int = 50  # 0 disables batching
+    EMAIL_BATCH_MAX_RECIPIENTS: int = 1000  # SendGrid personalizations limit
+
+    # Push micro-batching
+    PUSH_BATCH_WINDOW_MS: int = 50  # 0 disables batching
+    PUSH_BATCH_MAX_TOKENS: int = 500
+
+    # Status update write-behind buffer
+    STATUS_BUFFER_MAX_SIZE: int = 500  # Updates per bulk UPDATE
+    STATUS_BUFFER_FLUSH_MS: int = 200
+    STATS_FLUSH_MS: int = 1000  # Rollup deltas summed in memory between upserts
+
+    # Report read cache
+    REPORT_CACHE_MAX_ENTRIES: int = 10000
+    REPORT_CACHE_TTL_S: float = 30.0  # Local tier
+    REPORT_CACHE_REDIS_ENABLED: bool = False
+    REPORT_CACHE_REDIS_TTL_S: int = 300
+
+    # Duplicate-send suppression at ingest
+    DEDUP_CONTENT_WINDOW_S: int = 0  # Drop identical notifications for this long after one is accepted; 0 disables
+    DEDUP_FILTER_MAX_ENTRIES: int = 100000  # Recent dedup keys kept in memory
+    DEDUP_FILTER_TTL_S: float = 86400.0
+    DEDUP_REDIS_ENABLED: bool = False
+
+    # Digests: event_type -> window in seconds (JSON). Notifications of these
+    # types for the same recipient and channel within one window are sent once, combined
+    DIGEST_POLICIES: Dict[str, int] = {}
+
+    # Notification templates
+    TEMPLATE_CACHE_MAX_ENTRIES: int = 1000  # Compiled template versions kept per process
+    TEMPLATE_LATEST_TTL_S: float = 30.0  # How long "latest version" lookups are cached
+    TEMPLATE_VARIABLES_MAX_BYTES: int = 4096  # Per-notification variables, as JSON
+
+    # Content-addressed notification bodies
+    BODY_CACHE_MAX_ENTRIES: int = 1024  # Decompressed bodies kept per process
+
+    # Report listing and export
+    REPORT_PAGE_MAX_SIZE: int = 1000
+    EXPORT_CHUNK_SIZE: int = 5000  # Rows fetched per server-side cursor round trip
+
+    # Provider webhooks
+    WEBHOOK_QUEUE_MAX_SIZE: int = 100000  # Staged events before callbacks get 503
+    WEBHOOK_BATCH_SIZE: int = 1000
+    TWILIO_STATUS_CALLBACK_URL: str = ""  # Public URL of /notifications/webhook/twilio
+    SENDGRID_WEBHOOK_PUBLIC_KEY: str = ""  # Signed Event Webhook verification key (base64); unsigned events are rejected
+    WEBHOOK_SIGNATURE_MAX_AGE_S: int = 600  # Older signed SendGrid timestamps are rejected as replays
+
+    # Batch ingest
+    BATCH_MAX_SIZE: int = 5000  # Max notifications accepted per batch request
+
+    # Outbox relay
+    OUTBOX_RELAY_BATCH_SIZE: int = 1000  # Messages claimed and published per transaction
+    OUTBOX_RELAY_POLL_INTERVAL_MS: int = 200
+
+    # Scheduled notifications
+    SCHEDULER_BATCH_SIZE: int = 1000  # Due rows claimed and released per transaction
+    SCHEDULER_POLL_INTERVAL_MS: int = 1000
+    CELERY_CONFIRM_PUBLISH: bool = True  # Broker must accept a relay batch (AMQP transaction) before its outbox rows are deleted
 
     class Config:
         env_file = ".env"
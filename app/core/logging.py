@@ -1,30 +1,97 @@
+import atexit
+import copy
 import logging
+import queue
+import random
 import sys
 from logging import Formatter
-import json
+from logging.handlers import QueueHandler, QueueListener
 from app.core.config import settings
+from app.metrics.prometheus import log_records_dropped
+
+try:
+    import orjson
+
+    def _dumps(data: dict) -> str:
+        return orjson.dumps(data, default=str).decode()
+except ImportError:  # pragma: no cover - stdlib fallback
+    import json
+
+    def _dumps(data: dict) -> str:
+        return json.dumps(data, default=str)
 
 class JsonFormatter(Formatter):
     def format(self, record):
         data = {
             "timestamp": self.formatTime(record, self.datefmt),
             "level": record.levelname,
-            "message": record.msg,
+            "message": record.getMessage(),
             "module": record.module,
             "function": record.funcName,
         }
-        return json.dumps(data)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return _dumps(data)
+
+class SamplingFilter(logging.Filter):
+    # Keeps a fraction of INFO and DEBUG records; warnings and errors always pass
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+class NonBlockingQueueHandler(QueueHandler):
+    # Drops records instead of blocking the caller when the writer falls behind
+    dropped = 0
+
+    def prepare(self, record):
+        # The message is interpolated now, so arguments mutated after the call
+        # are logged as they were; JSON formatting happens in the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+            log_records_dropped.inc()
+
+_listener = None
 
 def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
     logger = logging.getLogger()
     logger.setLevel(settings.LOG_LEVEL)
-    
+
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(JsonFormatter())
-    logger.addHandler(console_handler)
-    
+    handlers = [console_handler]
+
     # File handler for persistence
-    file_handler = logging.FileHandler("app.log")
-    file_handler.setFormatter(JsonFormatter())
-    logger.addHandler(file_handler)
\ No newline at end of file
+    if settings.LOG_FILE:
+        file_handler = logging.FileHandler(settings.LOG_FILE)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    # Callers only enqueue; a background thread formats and writes
+    queue_handler = NonBlockingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(settings.LOG_INFO_SAMPLE_RATE))
+    logger.addHandler(queue_handler)
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    # Flushes queued records; safe to call more than once
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
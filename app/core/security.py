@@ -0,0 +1,116 @@
+# JWT verification with a cache of verified tokens
+#
+# Callers reuse the same service tokens for many requests, so the claims of
+# a verified token are cached under its SHA-256 hash until the token's exp
+# (or the cache TTL, whichever is first). Tokens are signed either with
+# SECRET_KEY or with asymmetric keys from a JWKS endpoint, fetched once and
+# refetched only when a token names an unknown key id. If the JWKS endpoint
+# can't be reached, tokens are checked against the last key set fetched;
+# with none fetched yet, verification raises JWKSUnavailable.
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+import httpx
+from jose import JWTError, jwt
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class JWKSUnavailable(Exception):
+    pass
+
+class TokenVerifier:
+    def __init__(
+        self,
+        secret_key: str = None,
+        jwks_url: str = None,
+        algorithms: list = None,
+        max_entries: int = None,
+        ttl_s: float = None,
+        jwks_fetcher=None,
+    ):
+        self.secret_key = settings.SECRET_KEY if secret_key is None else secret_key
+        self.jwks_url = settings.JWT_JWKS_URL if jwks_url is None else jwks_url
+        self.algorithms = settings.JWT_ALGORITHMS if algorithms is None else algorithms
+        self.max_entries = settings.JWT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl = settings.JWT_CACHE_TTL_S if ttl_s is None else ttl_s
+        self._jwks_fetcher = jwks_fetcher or self._fetch_jwks
+        self._cache = OrderedDict()  # token hash -> (valid_until, claims)
+        self._keys = None  # kid -> JWK
+        self._keys_fetched_at = 0.0
+        self._keys_lock = None
+
+    async def verify(self, token: str) -> dict:
+        # Raises JWTError for invalid, expired or not-yet-valid tokens and
+        # JWKSUnavailable when no signing keys could be loaded
+        digest = hashlib.sha256(token.encode()).digest()
+        entry = self._cache.get(digest)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._cache.move_to_end(digest)
+                return entry[1]
+            del self._cache[digest]
+
+        claims = jwt.decode(token, await self._key_for(token), algorithms=self.algorithms)
+        valid_until = time.time() + self.ttl
+        if "exp" in claims:
+            valid_until = min(valid_until, float(claims["exp"]))
+        self._cache[digest] = (valid_until, claims)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return claims
+
+    async def _key_for(self, token: str):
+        if not self.jwks_url:
+            return self.secret_key
+        kid = jwt.get_unverified_header(token).get("kid")
+        keys = await self._jwks()
+        if kid not in keys and time.monotonic() - self._keys_fetched_at >= settings.JWT_JWKS_REFRESH_S:
+            # Key rotation: refetch, but not more often than JWT_JWKS_REFRESH_S
+            keys = await self._jwks(refresh=True)
+        if kid not in keys:
+            raise JWTError(f"Unknown signing key: {kid}")
+        return keys[kid]
+
+    async def _jwks(self, refresh: bool = False) -> dict:
+        if self._keys_lock is None:
+            self._keys_lock = asyncio.Lock()
+        async with self._keys_lock:
+            if self._keys is None or refresh:
+                try:
+                    jwks = await self._jwks_fetcher(self.jwks_url)
+                except (httpx.HTTPError, ValueError) as e:
+                    if self._keys is None:
+                        logger.error("JWKS fetch from %s failed: %s", self.jwks_url, e)
+                        raise JWKSUnavailable(str(e))
+                    # Keep the stale keys, and don't retry before JWT_JWKS_REFRESH_S
+                    logger.warning("JWKS refresh from %s failed, keeping cached keys: %s", self.jwks_url, e)
+                    self._keys_fetched_at = time.monotonic()
+                    return self._keys
+                self._keys = {key.get("kid"): key for key in jwks.get("keys", [])}
+                self._keys_fetched_at = time.monotonic()
+                logger.info("Loaded %s signing keys from JWKS", len(self._keys))
+            return self._keys
+
+    @staticmethod
+    async def _fetch_jwks(url: str) -> dict:
+        async with httpx.AsyncClient(timeout=settings.PROVIDER_CONNECT_TIMEOUT) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+            return response.json()
+
+_verifier = None
+
+def get_token_verifier() -> TokenVerifier:
+    global _verifier
+    if _verifier is None:
+        _verifier = TokenVerifier()
+    return _verifier
+
+def reset_token_verifier():
+    global _verifier
+    _verifier = None
@@ -0,0 +1,38 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "002"
+down_revision = "001"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 50000
+
+def upgrade():
+    op.add_column('notifications', sa.Column('notification_id', sa.String(36), nullable=True))
+
+    # Backfill and build indexes outside the migration transaction so large
+    # tables are not locked for the whole run
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        while True:
+            result = conn.execute(sa.text(
+                "UPDATE notifications SET notification_id = gen_random_uuid()::text "
+                "WHERE id IN (SELECT id FROM notifications WHERE notification_id IS NULL LIMIT :limit)"
+            ), {"limit": BACKFILL_BATCH_SIZE})
+            if result.rowcount == 0:
+                break
+
+        op.create_index('ix_notifications_notification_id', 'notifications', ['notification_id'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_notifications_event_type_created_at', 'notifications', ['event_type', 'created_at'], postgresql_concurrently=True)
+        op.create_index('ix_notifications_status_created_at', 'notifications', ['status', 'created_at'], postgresql_concurrently=True)
+        op.create_index('ix_notifications_recipient', 'notifications', ['recipient'], postgresql_concurrently=True)
+
+    op.alter_column('notifications', 'notification_id', nullable=False)
+
+def downgrade():
+    op.drop_index('ix_notifications_recipient', table_name='notifications')
+    op.drop_index('ix_notifications_status_created_at', table_name='notifications')
+    op.drop_index('ix_notifications_event_type_created_at', table_name='notifications')
+    op.drop_index('ix_notifications_notification_id', table_name='notifications')
+    op.drop_column('notifications', 'notification_id')
@@ -0,0 +1,19 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "003"
+down_revision = "002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('task_name', sa.String, nullable=False),
+        sa.Column('payload', sa.JSON, nullable=False),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+    )
+
+def downgrade():
+    op.drop_table('outbox')
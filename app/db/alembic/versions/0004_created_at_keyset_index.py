@@ -0,0 +1,14 @@
+from alembic import op
+
+revision = "004"
+down_revision = "003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Serves keyset pagination and exports ordered by (created_at, id)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_notifications_created_at_id', 'notifications', ['created_at', 'id'], postgresql_concurrently=True)
+
+def downgrade():
+    op.drop_index('ix_notifications_created_at_id', table_name='notifications')
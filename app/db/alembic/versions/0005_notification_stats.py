@@ -0,0 +1,26 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "005"
+down_revision = "004"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'notification_stats',
+        sa.Column('bucket_start', sa.DateTime, primary_key=True),
+        sa.Column('channel', sa.String, primary_key=True),
+        sa.Column('event_type', sa.String, primary_key=True),
+        sa.Column('status', sa.String, primary_key=True),
+        sa.Column('count', sa.BigInteger, nullable=False, server_default='0'),
+    )
+    # Seed from existing rows so the rollup starts consistent
+    op.execute(
+        "INSERT INTO notification_stats (bucket_start, channel, event_type, status, count) "
+        "SELECT date_trunc('minute', created_at), channel, event_type, COALESCE(status, 'pending'), count(*) "
+        "FROM notifications GROUP BY 1, 2, 3, 4"
+    )
+
+def downgrade():
+    op.drop_table('notification_stats')
@@ -0,0 +1,14 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "006"
+down_revision = "005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Constant server default: no table rewrite on PostgreSQL 11+
+    op.add_column('notifications', sa.Column('priority', sa.String(), nullable=False, server_default='transactional'))
+
+def downgrade():
+    op.drop_column('notifications', 'priority')
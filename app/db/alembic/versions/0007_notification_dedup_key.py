@@ -0,0 +1,19 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "007"
+down_revision = "006"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('notifications', sa.Column('dedup_key', sa.String(length=64), nullable=True))
+    # NULLs are distinct, so only deduplicated requests take part in the unique check
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_notifications_dedup_key', 'notifications', ['dedup_key'], unique=True, postgresql_concurrently=True
+        )
+
+def downgrade():
+    op.drop_index('ix_notifications_dedup_key', table_name='notifications')
+    op.drop_column('notifications', 'dedup_key')
@@ -0,0 +1,32 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "008"
+down_revision = "007"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'notification_templates',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('template_id', sa.String(length=100), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('channel', sa.String(), nullable=False),
+        sa.Column('subject', sa.String(), nullable=True),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        sa.UniqueConstraint('template_id', 'version', name='uq_notification_templates_template_id_version'),
+    )
+    # Templated notifications store a reference and variables instead of the rendered body
+    op.alter_column('notifications', 'content', existing_type=sa.Text(), nullable=True)
+    op.add_column('notifications', sa.Column('template_id', sa.String(length=100), nullable=True))
+    op.add_column('notifications', sa.Column('template_version', sa.Integer(), nullable=True))
+    op.add_column('notifications', sa.Column('variables', sa.JSON(), nullable=True))
+
+def downgrade():
+    op.drop_column('notifications', 'variables')
+    op.drop_column('notifications', 'template_version')
+    op.drop_column('notifications', 'template_id')
+    op.alter_column('notifications', 'content', existing_type=sa.Text(), nullable=False)
+    op.drop_table('notification_templates')
@@ -0,0 +1,113 @@
+import hashlib
+import zlib
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "009"
+down_revision = "008"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+# Must match app.models.bodies
+def _hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def _compress(content: str) -> bytes:
+    return zlib.compress(content.encode(), 6)
+
+bodies = sa.table(
+    'notification_bodies',
+    sa.column('content_hash', sa.String),
+    sa.column('data', sa.LargeBinary),
+    sa.column('size', sa.Integer),
+)
+
+def _backfill(bind):
+    # In id order, one batch at a time, storing each distinct body once.
+    # Only unconverted rows are read, so an interrupted run can be resumed.
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, content FROM notifications "
+                "WHERE id > :last_id AND content_hash IS NULL AND content IS NOT NULL "
+                "ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        hashes = {row.id: _hash(row.content) for row in rows}
+        distinct = {hashes[row.id]: row.content for row in rows}
+        bind.execute(
+            postgresql.insert(bodies).on_conflict_do_nothing(index_elements=['content_hash']),
+            [
+                {"content_hash": content_hash, "data": _compress(content), "size": len(content.encode())}
+                for content_hash, content in sorted(distinct.items())
+            ],
+        )
+        bind.execute(
+            sa.text("UPDATE notifications SET content_hash = :content_hash WHERE id = :id"),
+            [{"id": id, "content_hash": content_hash} for id, content_hash in hashes.items()],
+        )
+        last_id = rows[-1].id
+
+def upgrade():
+    op.create_table(
+        'notification_bodies',
+        sa.Column('content_hash', sa.String(length=64), primary_key=True),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.add_column('notifications', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # Backfill, then add and validate the foreign key, outside the migration
+    # transaction: every batch commits on its own, so large tables are not
+    # locked for the whole run
+    with op.get_context().autocommit_block():
+        _backfill(op.get_bind())
+        op.create_foreign_key(
+            'fk_notifications_content_hash', 'notifications', 'notification_bodies',
+            ['content_hash'], ['content_hash'], postgresql_not_valid=True,
+        )
+        op.execute("ALTER TABLE notifications VALIDATE CONSTRAINT fk_notifications_content_hash")
+
+    # Rows written by the previous release while the backfill ran
+    _backfill(op.get_bind())
+    op.drop_column('notifications', 'content')
+
+def downgrade():
+    op.add_column('notifications', sa.Column('content', sa.Text(), nullable=True))
+    bind = op.get_bind()
+    # Bodies are decompressed in Python into a temporary table, then copied
+    # with one UPDATE ... FROM join instead of an unindexed UPDATE per body
+    bind.execute(sa.text(
+        "CREATE TEMPORARY TABLE restored_bodies (content_hash VARCHAR(64) PRIMARY KEY, content TEXT) ON COMMIT DROP"
+    ))
+    last_hash = ""
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT content_hash, data FROM notification_bodies "
+                "WHERE content_hash > :last_hash ORDER BY content_hash LIMIT :limit"
+            ),
+            {"last_hash": last_hash, "limit": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            sa.text("INSERT INTO restored_bodies (content_hash, content) VALUES (:content_hash, :content)"),
+            [{"content_hash": row.content_hash, "content": zlib.decompress(row.data).decode()} for row in rows],
+        )
+        last_hash = rows[-1].content_hash
+    bind.execute(sa.text(
+        "UPDATE notifications SET content = restored_bodies.content FROM restored_bodies "
+        "WHERE notifications.content_hash = restored_bodies.content_hash"
+    ))
+    op.drop_constraint('fk_notifications_content_hash', 'notifications', type_='foreignkey')
+    op.drop_column('notifications', 'content_hash')
+    op.drop_table('notification_bodies')
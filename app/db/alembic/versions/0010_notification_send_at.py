@@ -0,0 +1,20 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "010"
+down_revision = "009"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('notifications', sa.Column('send_at', sa.DateTime(), nullable=True))
+    # Partial: only rows waiting for the scheduler are indexed
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_notifications_scheduled_send_at', 'notifications', ['send_at'],
+            postgresql_where=sa.text("status = 'scheduled'"), postgresql_concurrently=True,
+        )
+
+def downgrade():
+    op.drop_index('ix_notifications_scheduled_send_at', table_name='notifications')
+    op.drop_column('notifications', 'send_at')
@@ -0,0 +1,25 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "011"
+down_revision = "010"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('notifications', sa.Column('digest_id', sa.Integer(), nullable=True))
+    with op.get_context().autocommit_block():
+        # Added NOT VALID so only the brief ALTER holds the lock; VALIDATE
+        # then scans the table without blocking writes, as in 009
+        op.create_foreign_key(
+            'fk_notifications_digest_id', 'notifications', 'notifications', ['digest_id'], ['id'],
+            postgresql_not_valid=True,
+        )
+        op.execute("ALTER TABLE notifications VALIDATE CONSTRAINT fk_notifications_digest_id")
+        # Members are looked up by digest when the digest is released
+        op.create_index('ix_notifications_digest_id', 'notifications', ['digest_id'], postgresql_concurrently=True)
+
+def downgrade():
+    op.drop_index('ix_notifications_digest_id', table_name='notifications')
+    op.drop_constraint('fk_notifications_digest_id', 'notifications', type_='foreignkey')
+    op.drop_column('notifications', 'digest_id')
@@ -1,11 +1,62 @@
+import contextvars
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from app.core.config import settings
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
+def _pool_options(url: str) -> dict:
+    # Only queue pools take a size; SQLite (tests, benchmarks) uses SQLAlchemy's default pool
+    pool_class = make_url(url).get_dialect().get_pool_class(make_url(url))
+    if not issubclass(pool_class, QueuePool):
+        return {}
+    return {"pool_size": settings.DB_POOL_SIZE, "max_overflow": settings.DB_MAX_OVERFLOW}
+
+engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DB_ECHO,
+    pool_pre_ping=True,
+    **_pool_options(settings.DATABASE_URL),
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 
 async def get_db() -> AsyncSession:
     async with SessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+# Postgres serialization failure and deadlock: the whole transaction can be retried
+TRANSIENT_SQLSTATES = {"40001", "40P01"}
+
+def is_transient(exc: Exception) -> bool:
+    # Lock and serialization conflicts with concurrent transactions, e.g. on a shared body row
+    orig = getattr(exc, "orig", None)
+    if getattr(orig, "sqlstate", None) in TRANSIENT_SQLSTATES or getattr(orig, "pgcode", None) in TRANSIENT_SQLSTATES:
+        return True
+    return "database is locked" in str(orig)  # SQLite writer conflict
+
+def get_session_factory():
+    # For handlers that outlive the request-scoped session, e.g. streamed responses
+    return SessionLocal
+
+# SQL time of the current API request, accumulated by cursor events on every engine
+_request_db_time = contextvars.ContextVar("request_db_time", default=None)
+
+def track_db_time() -> list:
+    # Returns a one-item list that holds the seconds spent in SQL so far
+    timer = [0.0]
+    _request_db_time.set(timer)
+    return timer
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    timer = _request_db_time.get()
+    if timer is not None:
+        timer[0] += elapsed
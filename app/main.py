@@ -1,20 +1,53 @@
 import logging
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncEngine
 from app.api.v1.notifications import router as notifications_router
+from app.api.v1.templates import router as templates_router
 from app.core.config import settings
 from app.core.logging import setup_logging
-from app.db.session import engine, SessionLocal
+from app.db.session import engine, SessionLocal, track_db_time
 from app.workers.celery_app import celery_app
-from app.metrics.prometheus import instrumentator
+from app.metrics.prometheus import db_request_time, instrumentator
+from app.services.clients import close_clients
+from app.repositories.stats_repo import get_stats_buffer
+from app.repositories.status_buffer import get_status_buffer
+from app.services.webhooks import get_webhook_queue
+from app.repositories.report_cache import get_report_cache
+from app.repositories.dedup_filter import get_dedup_filter
+from app.services.tenant_quota import get_tenant_rate_limiter
+import asyncio
 
 setup_logging()
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Notification Service API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Starting Notification Service...")
+
+    async with engine.begin() as conn:
+        pass
+
+    # Evict local report cache entries invalidated by other processes
+    invalidation_listener = asyncio.create_task(get_report_cache().listen_invalidations())
+
+    yield 
+
+    invalidation_listener.cancel()
+    logger.info("Shutting down Notification Service...")
+    await get_webhook_queue().close()
+    await get_status_buffer().close()
+    await get_stats_buffer().close()
+    await close_clients()
+    await get_report_cache().aclose()
+    await get_tenant_rate_limiter().aclose()
+    await get_dedup_filter().aclose()
+    await engine.dispose()
+
+
+app = FastAPI(title="Notification Service API", version="1.0.0", lifespan=lifespan)
 
 # CORS Middleware for cross-origin requests
 app.add_middleware(
@@ -27,27 +60,23 @@ app.add_middleware(
 
 instrumentator.instrument(app).expose(app)
 
+@app.middleware("http")
+async def record_db_time(request: Request, call_next):
+    timer = track_db_time()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    db_request_time.labels(route=route.path if route else "unmatched").observe(timer[0])
+    return response
+
 
 app.include_router(notifications_router, prefix="/api/v1")
+app.include_router(templates_router, prefix="/api/v1")
 
 # Dependency for DB session
 async def get_db():
     async with SessionLocal() as session:
         yield session
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Starting Notification Service...")
-
-    async with engine.begin() as conn:
-        pass
-
-    yield 
-
-    logger.info("Shutting down Notification Service...")
-    await engine.dispose()
-
-
 # Root endpoint for health check
 @app.get("/")
 async def root():
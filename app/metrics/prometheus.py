@@ -1,10 +1,96 @@
 # Prometheus instrumentation for observability.
 
+# Set PROMETHEUS_MULTIPROC_DIR (an empty directory shared by the processes of
+# one host) before start-up to aggregate metrics across uvicorn and Celery
+# worker processes; /metrics and the worker exporter then read all of them.
+
+import os
 from prometheus_fastapi_instrumentator import Instrumentator
-from prometheus_client import Counter
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess, start_http_server
 
 # Custom counters
 notification_sent = Counter("notification_sent_total", "Total notifications sent", ["channel"])
 notification_failed = Counter("notification_failed_total", "Total failed notifications", ["channel"])
+notification_retries = Counter(
+    "notification_retries_total", "Send tasks retried or rescheduled", ["channel", "reason"]
+)
+
+# Provider calls
+provider_latency = Histogram(
+    "provider_request_duration_seconds", "Provider API call latency", ["provider", "outcome"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+provider_throttle_wait = Histogram(
+    "provider_throttle_wait_seconds", "Time spent waiting for an outbound rate limit token", ["provider"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2),
+)
+provider_circuit_state = Gauge(
+    "provider_circuit_state", "Provider circuit breaker state: 0 closed, 1 half-open, 2 open", ["provider"],
+    multiprocess_mode="max",
+)
+provider_circuit_opened = Counter(
+    "provider_circuit_opened_total", "Times a provider circuit breaker tripped open", ["provider"]
+)
+provider_failovers = Counter(
+    "provider_failovers_total", "Sends moved to the secondary provider", ["provider"]
+)
+provider_batch_size = Histogram(
+    "provider_batch_size", "Recipients per batched provider send", ["channel"],
+    buckets=(1, 2, 5, 10, 50, 100, 250, 500, 1000),
+)
+
+# Database and broker
+db_request_time = Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL per API request", ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+task_queue_wait = Histogram(
+    "task_queue_wait_seconds", "Time between publishing a task and a worker starting it", ["queue"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+outbox_relay_batch_size = Histogram(
+    "outbox_relay_batch_size", "Outbox messages published per relay batch",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+scheduler_batch_size = Histogram(
+    "scheduler_batch_size", "Scheduled notifications released per scheduler batch",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+scheduler_lag = Histogram(
+    "scheduler_lag_seconds", "Delay between send_at and release to the outbox",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+webhook_queue_depth = Gauge(
+    "webhook_queue_depth", "Provider webhook events waiting to be applied", multiprocess_mode="livesum"
+)
+
+# Status write-behind buffer
+status_flush_latency = Histogram("status_flush_duration_seconds", "Time to flush buffered status updates")
+status_flush_batch_size = Histogram(
+    "status_flush_batch_size", "Status updates written per flush",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+status_flush_errors = Counter("status_flush_errors_total", "Failed status buffer flushes")
+stats_flush_errors = Counter("stats_flush_errors_total", "Failed delivery stats rollup flushes")
+
+# Report read cache
+report_cache_hits = Counter("report_cache_hits_total", "Report cache hits", ["tier"])
+report_cache_misses = Counter("report_cache_misses_total", "Report cache misses")
+
+# Logging
+log_records_dropped = Counter("log_records_dropped_total", "Log records dropped because the writer queue was full")
+
+instrumentator = Instrumentator()
+
+def start_metrics_server(port: int):
+    # Standalone exporter for processes without an HTTP app (Celery workers)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
 
-instrumentator = Instrumentator()
\ No newline at end of file
+def mark_process_dead(pid: int):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
\ No newline at end of file
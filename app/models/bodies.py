@@ -0,0 +1,64 @@
+import hashlib
+import zlib
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.db.base import Base
+
+COMPRESSION_LEVEL = 6
+
+def body_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def compress(content: str) -> bytes:
+    return zlib.compress(content.encode(), COMPRESSION_LEVEL)
+
+def decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode()
+
+class NotificationBody(Base):
+    # Notification bodies stored once per distinct content, zlib-compressed
+    __tablename__ = "notification_bodies"
+
+    content_hash = Column(String(64), primary_key=True) # sha256 of the UTF-8 body
+    data = Column(LargeBinary, nullable = False)
+    size = Column(Integer, nullable = False) # Uncompressed size in bytes
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
+
+def insert_bodies(dialect_name: str, contents):
+    # INSERT ... ON CONFLICT DO NOTHING for each distinct body; returns (statement, rows)
+    rows = {}
+    for content in contents:
+        if content is not None:
+            content_hash = body_hash(content)
+            if content_hash not in rows:
+                rows[content_hash] = {
+                    "content_hash": content_hash, "data": compress(content), "size": len(content.encode())
+                }
+    dialect = sqlite if dialect_name == "sqlite" else postgresql
+    stmt = dialect.insert(NotificationBody).on_conflict_do_nothing(index_elements=["content_hash"])
+    # Sorted so concurrent inserts take row locks in the same order
+    return stmt, [rows[key] for key in sorted(rows)]
+
+class HasBody:
+    # Mixin: `content` is stored in notification_bodies and referenced by content_hash
+    _content = None
+
+    @property
+    def content(self):
+        # Set on new objects; loaded rows are filled in by NotificationRepo reads
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self.content_hash = body_hash(value) if value is not None else None
+
+@event.listens_for(Session, "before_flush")
+def _store_new_bodies(session, flush_context, instances):
+    # Bodies of Notifications added through the ORM are written before the rows that reference them
+    contents = [obj._content for obj in session.new if isinstance(obj, HasBody)]
+    if any(content is not None for content in contents):
+        stmt, rows = insert_bodies(session.get_bind().dialect.name, contents)
+        session.execute(stmt, rows)
@@ -1,14 +1,49 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, func
+import uuid
+from datetime import datetime
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Index, JSON, func, select, text
+from sqlalchemy.orm import aliased, column_property, synonym
 from app.db.base import Base
+from app.models.bodies import HasBody
 
-class Notification(Base):
+def new_notification_id() -> str:
+    return str(uuid.uuid4())
+
+class Notification(HasBody, Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_event_type_created_at", "event_type", "created_at"),
+        Index("ix_notifications_status_created_at", "status", "created_at"),
+        Index("ix_notifications_created_at_id", "created_at", "id"),
+        Index("ix_notifications_dedup_key", "dedup_key", unique=True),
+        # Only rows still waiting for the scheduler, so the index stays small
+        Index(
+            "ix_notifications_scheduled_send_at", "send_at",
+            postgresql_where=text("status = 'scheduled'"), sqlite_where=text("status = 'scheduled'"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    notification_id = Column(String(36), unique=True, index=True, nullable = False, default=new_notification_id) # External ID returned to callers and providers
     event_type = Column(String, nullable = False) # e.g., 'user_signup', 'password_reset'
     channel = Column(String, nullable = False) # e.g., 'email', 'sms', 'push'
-    recipient = Column(String, nullable = False) # e.g., email address or phone number
-    content = Column(Text, nullable = False)
-    status = Column(String, default='pending')  # e.g., 'pending', 'sent', 'failed' 
+    recipient = Column(String, nullable = False, index=True) # e.g., email address or phone number
+    content_hash = Column(String(64), ForeignKey("notification_bodies.content_hash"), nullable = True) # Body in notification_bodies; NULL for templated notifications
+    template_id = Column(String(100), nullable = True) # Rendered by the worker from template_id/template_version and variables
+    template_version = Column(Integer, nullable = True)
+    variables = Column(JSON, nullable = True)
+    priority = Column(String, nullable = False, default='transactional', server_default='transactional') # 'transactional' or 'bulk'; selects the worker queue
+    status = Column(String, default='pending')  # e.g., 'scheduled', 'pending', 'sent', 'failed', 'digested' 
     attempt = Column(Integer, default=0)  # Number of send attempts
-    created_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
+    digest_id = Column(Integer, ForeignKey("notifications.id"), nullable = True, index=True) # Digest row this notification was merged into
+    send_at = Column(DateTime, nullable = True) # Scheduled rows are released to the outbox by app.workers.scheduler
+    dedup_key = Column(String(64), nullable=True) # Idempotency or content hash, see app.repositories.dedup_filter
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now()) # Set client-side so stats rollups see the same value
+
+    attempts = synonym("attempt")
+
+# External id of the digest a member was merged into; loaded only when asked for
+_digest = aliased(Notification)
+Notification.digest_notification_id = column_property(
+    select(_digest.notification_id).where(_digest.id == Notification.digest_id).scalar_subquery(),
+    deferred=True,
+)
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, BigInteger, Integer, String, JSON, DateTime, func
+from app.db.base import Base
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+
+    # Integer on SQLite so the primary key autoincrements
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True) # Relay publishes in id order
+    task_name = Column(String, nullable = False) # e.g., 'app.workers.tasks.send_notification'
+    payload = Column(JSON, nullable = False) # Task args
+    created_at = Column(DateTime, server_default=func.now())
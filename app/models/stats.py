@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime
+from app.db.base import Base
+
+class NotificationStat(Base):
+    # Rollup of notifications by creation minute and current status,
+    # maintained incrementally as rows are created and change status
+    __tablename__ = "notification_stats"
+
+    bucket_start = Column(DateTime, primary_key=True) # Creation time truncated to the minute
+    channel = Column(String, primary_key=True)
+    event_type = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(BigInteger().with_variant(Integer, "sqlite"), nullable = False, default=0)
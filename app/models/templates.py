@@ -0,0 +1,18 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, UniqueConstraint, func
+from app.db.base import Base
+
+class NotificationTemplate(Base):
+    # Versions are immutable: registering a template again adds a new version
+    __tablename__ = "notification_templates"
+    __table_args__ = (
+        UniqueConstraint("template_id", "version", name="uq_notification_templates_template_id_version"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    template_id = Column(String(100), nullable = False) # Caller-chosen name, e.g. 'welcome_email'
+    version = Column(Integer, nullable = False)
+    channel = Column(String, nullable = False) # Channel the template renders for
+    subject = Column(String, nullable = True) # Email subject or push title; may contain placeholders
+    body = Column(Text, nullable = False)
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
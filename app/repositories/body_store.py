@@ -0,0 +1,78 @@
+# Content-addressed notification bodies
+#
+# Bodies are stored once per distinct content in notification_bodies, keyed
+# by sha256 and zlib-compressed; notification rows only carry the hash. Reads
+# go through a small in-process LRU of decompressed bodies, so a fan-out of
+# the same body is fetched and decompressed once per process.
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.models.bodies import NotificationBody, body_hash, decompress, insert_bodies
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BodyCache:
+    def __init__(self, max_entries: int = None):
+        self.max_entries = settings.BODY_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self._local = OrderedDict()  # content_hash -> body
+
+    def get(self, content_hash: str) -> Optional[str]:
+        body = self._local.get(content_hash)
+        if body is not None:
+            self._local.move_to_end(content_hash)
+        return body
+
+    def set(self, content_hash: str, body: str):
+        # Bodies never change for a hash, so entries need no TTL
+        self._local[content_hash] = body
+        self._local.move_to_end(content_hash)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+_cache = None
+
+def get_body_cache() -> BodyCache:
+    global _cache
+    if _cache is None:
+        _cache = BodyCache()
+    return _cache
+
+def reset_body_cache():
+    global _cache
+    _cache = None
+
+class BodyRepo:
+    @staticmethod
+    async def put_many(db: AsyncSession, contents: List[Optional[str]]) -> List[Optional[str]]:
+        # Stores each distinct body once, in the caller's transaction; returns the hashes in input order
+        stmt, rows = insert_bodies(db.bind.dialect.name, contents)
+        if rows:
+            await db.execute(stmt, rows)
+        return [body_hash(content) if content is not None else None for content in contents]
+
+    @staticmethod
+    async def get_many(db: AsyncSession, hashes: Iterable[Optional[str]]) -> Dict[str, str]:
+        cache = get_body_cache()
+        bodies, missing = {}, set()
+        for content_hash in hashes:
+            if content_hash is None or content_hash in bodies:
+                continue
+            body = cache.get(content_hash)
+            if body is None:
+                missing.add(content_hash)
+            else:
+                bodies[content_hash] = body
+        if missing:
+            result = await db.execute(
+                select(NotificationBody.content_hash, NotificationBody.data)
+                .where(NotificationBody.content_hash.in_(sorted(missing)))
+            )
+            for content_hash, data in result.all():
+                body = decompress(data)
+                cache.set(content_hash, body)
+                bodies[content_hash] = body
+        return bodies
@@ -0,0 +1,134 @@
+# Duplicate-send filter for trigger requests
+#
+# Each notification triggered with an Idempotency-Key carries a dedup key, a
+# hash of the tenant and the key. The unique index on notifications.dedup_key
+# is the source of truth; this filter keeps recent keys in a bounded
+# in-process LRU and optionally in Redis so most duplicates are answered
+# without touching the database.
+#
+# Content deduplication hashes the tenant and the notification content and
+# claims the hash with SET NX EX for DEDUP_CONTENT_WINDOW_S, so the window
+# slides from each accepted send rather than resetting at fixed epoch
+# boundaries. It is not stored on the row; across API processes it needs
+# the Redis tier.
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+from app.core.config import settings
+from app.schemas.notification import NotificationCreate
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _hash(parts) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+def dedup_key(tenant: str, idempotency_key: str = None, index: int = None) -> Optional[str]:
+    if not idempotency_key:
+        return None
+    parts = [tenant, "key", idempotency_key]
+    if index is not None:
+        parts.append(str(index))  # one key per item of a batch
+    return _hash(parts)
+
+def content_key(tenant: str, notification: NotificationCreate) -> Optional[str]:
+    if settings.DEDUP_CONTENT_WINDOW_S <= 0:
+        return None
+    return _hash([
+        tenant, "content", notification.event_type, notification.channel,
+        notification.recipient, notification.priority, notification.content or "",
+        notification.template_id or "", str(notification.template_version),
+        json.dumps(notification.variables, sort_keys=True, default=str), str(notification.send_at),
+    ])
+
+def _redis_key(key: str) -> str:
+    return f"dedup:{key}"
+
+class DedupFilter:
+    def __init__(self, max_entries: int = None, ttl_s: float = None, redis=None):
+        self.max_entries = settings.DEDUP_FILTER_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl = settings.DEDUP_FILTER_TTL_S if ttl_s is None else ttl_s
+        self._redis = redis
+        self._local = OrderedDict()  # dedup key -> (expires_at, notification_id)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._local.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                return entry[1]
+            del self._local[key]
+        if self._redis is not None:
+            try:
+                notification_id = await self._redis.get(_redis_key(key))
+            except Exception as e:
+                logger.warning("Dedup filter Redis read failed: %s", e)
+                return None
+            if notification_id is not None:
+                notification_id = notification_id.decode() if isinstance(notification_id, bytes) else notification_id
+                self._set_local(key, notification_id)
+                return notification_id
+        return None
+
+    async def remember(self, key: str, notification_id: str):
+        self._set_local(key, notification_id)
+        if self._redis is not None:
+            try:
+                await self._redis.set(_redis_key(key), notification_id, ex=int(self.ttl))
+            except Exception as e:
+                logger.warning("Dedup filter Redis write failed: %s", e)
+
+    async def claim(self, key: str, notification_id: str, ttl_s: int) -> Optional[str]:
+        # SET NX EX: None when the caller now holds the key for ttl_s, otherwise
+        # the notification_id that claimed it first
+        if self._redis is not None:
+            try:
+                # SET ... NX GET (Redis 7) sets and returns the old value in one round trip
+                original = await self._redis.set(_redis_key(key), notification_id, ex=ttl_s, nx=True, get=True)
+                return original.decode() if isinstance(original, bytes) else original
+            except Exception as e:
+                logger.warning("Dedup filter Redis claim failed, claiming locally: %s", e)
+        entry = self._local.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        self._set_local(key, notification_id, ttl_s)
+        return None
+
+    async def release(self, key: str):
+        # Undoes a claim whose notification was not stored
+        self._local.pop(key, None)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(_redis_key(key))
+            except Exception as e:
+                logger.warning("Dedup filter Redis release failed: %s", e)
+
+    def _set_local(self, key: str, notification_id: str, ttl_s: float = None):
+        self._local[key] = (time.monotonic() + (self.ttl if ttl_s is None else ttl_s), notification_id)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def aclose(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+
+_filter = None
+
+def get_dedup_filter() -> DedupFilter:
+    global _filter
+    if _filter is None:
+        client = None
+        if settings.DEDUP_REDIS_ENABLED:
+            import redis.asyncio as aioredis
+
+            client = aioredis.from_url(settings.REDIS_URL)
+        _filter = DedupFilter(redis=client)
+    return _filter
+
+def reset_dedup_filter():
+    global _filter
+    _filter = None
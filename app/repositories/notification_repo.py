@@ -1,34 +1,360 @@
 # Async DB operations for notifications
 
-from app.models.notifications import Notification
-from app.schemas.notification import NotificationCreate
+import hashlib
+from collections import Counter
+from app.core.config import settings
+from app.models.notifications import Notification, new_notification_id
+from app.repositories.body_store import BodyRepo
+from app.repositories.outbox_repo import OutboxRepo
+from app.repositories.report_cache import get_report_cache
+from app.repositories.stats_repo import StatsRepo, transition
+from app.schemas.notification import NotificationCreate, NotificationFilter
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import undefer
+from sqlalchemy import insert, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+REPORT_COLUMNS = (
+    Notification.id,
+    Notification.notification_id,
+    Notification.event_type,
+    Notification.channel,
+    Notification.recipient,
+    Notification.content_hash,
+    Notification.template_id,
+    Notification.template_version,
+    Notification.status,
+    Notification.attempt.label("attempts"),
+    Notification.send_at,
+    Notification.digest_notification_id.label("digest_notification_id"),
+    Notification.created_at,
+)
+
+def _apply_filter(query, filters: NotificationFilter):
+    if filters.event_type is not None:
+        query = query.where(Notification.event_type == filters.event_type)
+    if filters.channel is not None:
+        query = query.where(Notification.channel == filters.channel)
+    if filters.status is not None:
+        query = query.where(Notification.status == filters.status)
+    if filters.created_from is not None:
+        query = query.where(Notification.created_at >= filters.created_from)
+    if filters.created_to is not None:
+        query = query.where(Notification.created_at < filters.created_to)
+    return query
+
+OUTBOX_EXCLUDED = {"dedup_key", "send_at", "status", "digest_id"}
+
+def _outbox_payload(row: dict) -> dict:
+    return {key: value for key, value in row.items() if key not in OUTBOX_EXCLUDED}
+
+def _is_scheduled(send_at: Optional[datetime]) -> bool:
+    # Future rows wait for the scheduler instead of going to the outbox
+    return send_at is not None and send_at > datetime.utcnow()
+
+DIGEST_SEPARATORS = {"email": "<hr>"}  # others are joined with blank lines
+
+def _digest_window(notification: NotificationCreate) -> int:
+    # Digest window in seconds, or 0 when this notification is sent on its own.
+    # Scheduled and templated notifications are never digested.
+    if notification.send_at is not None or notification.content is None:
+        return 0
+    return settings.DIGEST_POLICIES.get(notification.event_type, 0)
+
+def _digest_row(notification: NotificationCreate, now: datetime) -> dict:
+    # Windows are aligned to the epoch, so every API process maps a recipient to
+    # the same digest row for the window; its dedup_key makes creation race-free
+    window = _digest_window(notification)
+    index = int((now - datetime(1970, 1, 1)).total_seconds() // window)
+    key = hashlib.sha256(
+        "\x1f".join(["digest", notification.event_type, notification.channel, notification.recipient, str(index)]).encode()
+    ).hexdigest()
+    return {
+        "notification_id": new_notification_id(),
+        "event_type": notification.event_type,
+        "channel": notification.channel,
+        "recipient": notification.recipient,
+        "priority": notification.priority,
+        "status": "scheduled",
+        "send_at": datetime(1970, 1, 1) + timedelta(seconds=(index + 1) * window),
+        "dedup_key": key,
+        "created_at": now,
+    }
+
+async def _join_digests(db: AsyncSession, notifications: List[NotificationCreate], deltas: Counter) -> List[Optional[Notification]]:
+    # Digest row for each notification, in input order: None when it is sent on
+    # its own, either because its event type isn't digested or because the
+    # scheduler has already released the window's digest. Digests are created
+    # with one INSERT and locked until commit with one SELECT, both in key
+    # order, so concurrent batches sharing recipients can't deadlock.
+    now = datetime.utcnow()
+    wanted = [_digest_row(notification, now) if _digest_window(notification) else None for notification in notifications]
+    rows = {row["dedup_key"]: row for row in wanted if row is not None}
+    if not rows:
+        return [None] * len(notifications)
+    dialect = sqlite if db.bind.dialect.name == "sqlite" else postgresql
+    result = await db.execute(
+        dialect.insert(Notification)
+        .on_conflict_do_nothing(index_elements=["dedup_key"])
+        .returning(Notification.dedup_key),
+        [rows[key] for key in sorted(rows)],
+    )
+    for key in result.scalars():
+        transition(deltas, now, rows[key]["channel"], rows[key]["event_type"], None, "scheduled")
+    result = await db.execute(
+        select(Notification).where(Notification.dedup_key.in_(rows)).order_by(Notification.dedup_key).with_for_update()
+    )
+    digests = {digest.dedup_key: digest for digest in result.scalars() if digest.status == "scheduled"}
+    return [digests.get(row["dedup_key"]) if row is not None else None for row in wanted]
+
+async def _combine_digests(db: AsyncSession, due: List[Notification]):
+    # Digest rows get the combined content of their members, oldest first
+    result = await db.execute(
+        select(Notification.digest_id, Notification.content_hash)
+        .where(Notification.digest_id.in_([notification.id for notification in due]))
+        .order_by(Notification.created_at, Notification.id)
+    )
+    members = result.all()
+    if not members:
+        return
+    bodies = await BodyRepo.get_many(db, (content_hash for _, content_hash in members))
+    contents = {}
+    for digest_id, content_hash in members:
+        contents.setdefault(digest_id, []).append(bodies.get(content_hash) or "")
+    digests = [notification for notification in due if notification.id in contents]
+    combined = [
+        DIGEST_SEPARATORS.get(digest.channel, "\n\n").join(contents[digest.id]) for digest in digests
+    ]
+    hashes = await BodyRepo.put_many(db, combined)
+    for digest, content_hash in zip(digests, hashes):
+        digest.content_hash = content_hash
+
+def _dispatch_payload(notification: Notification, content: Optional[str]) -> dict:
+    # Same shape as the payload staged at ingest
+    return {
+        "event_type": notification.event_type,
+        "channel": notification.channel,
+        "recipient": notification.recipient,
+        "content": content,
+        "template_id": notification.template_id,
+        "template_version": notification.template_version,
+        "priority": notification.priority,
+        "variables": notification.variables,
+        "id": notification.id,
+        "notification_id": notification.notification_id,
+    }
+
+def _row_values(row: dict, content_hash: Optional[str]) -> dict:
+    values = {key: value for key, value in row.items() if key != "content"}
+    values["content_hash"] = content_hash
+    return values
+
+async def _with_content(db: AsyncSession, rows) -> List[dict]:
+    # Report rows carry content_hash; bodies come from the body cache or one IN query
+    bodies = await BodyRepo.get_many(db, (row["content_hash"] for row in rows))
+    reports = []
+    for row in rows:
+        report = dict(row)
+        report["content"] = bodies.get(report.pop("content_hash"))
+        reports.append(report)
+    return reports
+
 class NotificationRepo:
     @staticmethod
-    async def create(db: AsyncSession, notification: NotificationCreate):
-        db_notification = Notification(**notification.model_dump())
+    async def create(db: AsyncSession, notification: NotificationCreate, notification_id: str = None, dedup_key: str = None):
+        # Raises IntegrityError when dedup_key already exists
+        deltas = Counter()
+        digest = (await _join_digests(db, [notification], deltas))[0]
+        if digest is not None:
+            status = "digested"  # sent as part of the digest row
+        else:
+            status = "scheduled" if _is_scheduled(notification.send_at) else "pending"
+        db_notification = Notification(
+            **notification.model_dump(), notification_id=notification_id or new_notification_id(), dedup_key=dedup_key,
+            status=status, digest_id=digest.id if digest is not None else None,
+        )
         db.add(db_notification)
+        await db.flush()
+        if status == "pending":
+            # Outbox message commits atomically with the row; the relay publishes it
+            await OutboxRepo.add_many(db, [
+                {**_outbox_payload(notification.model_dump()), "id": db_notification.id, "notification_id": db_notification.notification_id}
+            ])
+        transition(deltas, db_notification.created_at, db_notification.channel, db_notification.event_type, None, status)
+        StatsRepo.record(db, deltas)
         await db.commit()
         await db.refresh(db_notification)
-        logger.info(f"Created notification ID: {db_notification.id}")
+        logger.info("Created notification ID: %s", db_notification.id)
         return db_notification
-    
+
     @staticmethod
-    async def get_by_event_id(db: AsyncSession, event_id: str):
-        result = await db.execute(select(Notification).where(Notification.event_type == event_id))
+    async def create_many(
+        db: AsyncSession, notifications: List[NotificationCreate], dedup_keys: List[Optional[str]] = None,
+        notification_ids: List[Optional[str]] = None,
+    ):
+        # Single multi-row INSERT ... RETURNING, rows come back in input order
+        notification_ids = notification_ids or [None] * len(notifications)
+        rows = [
+            {
+                **notification.model_dump(),
+                "notification_id": notification_id or new_notification_id(),
+                "status": "scheduled" if _is_scheduled(notification.send_at) else "pending",
+            }
+            for notification, notification_id in zip(notifications, notification_ids)
+        ]
+        if dedup_keys:
+            for row, key in zip(rows, dedup_keys):
+                row["dedup_key"] = key
+        deltas = Counter()
+        for row, digest in zip(rows, await _join_digests(db, notifications, deltas)):
+            if digest is not None:
+                row["status"], row["digest_id"] = "digested", digest.id
+        # Each distinct body is stored once; rows reference it by hash
+        hashes = await BodyRepo.put_many(db, [row["content"] for row in rows])
+        result = await db.execute(
+            insert(Notification).returning(
+                Notification.id, Notification.notification_id, Notification.created_at, sort_by_parameter_order=True
+            ),
+            [_row_values(row, content_hash) for row, content_hash in zip(rows, hashes)],
+        )
+        created = result.all()
+        outbox = [
+            {**_outbox_payload(row), "id": created_row.id, "notification_id": created_row.notification_id}
+            for row, created_row in zip(rows, created)
+            if row["status"] == "pending"
+        ]
+        if outbox:
+            await OutboxRepo.add_many(db, outbox)
+        for row, created_row in zip(rows, created):
+            transition(deltas, created_row.created_at, row["channel"], row["event_type"], None, row["status"])
+        StatsRepo.record(db, deltas)
+        await db.commit()
+        logger.info("Created %s notifications in bulk", len(created))
+        return created
+
+    @staticmethod
+    async def release_due(db: AsyncSession, limit: int, now: datetime = None) -> List[Notification]:
+        # Claims due scheduled rows, oldest send_at first, and stages their outbox
+        # messages; rows stay locked until the caller commits, so other
+        # schedulers skip them (served by the partial send_at index)
+        now = now or datetime.utcnow()
+        result = await db.execute(
+            select(Notification)
+            .where(Notification.status == "scheduled", Notification.send_at <= now)
+            .order_by(Notification.send_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        due = list(result.scalars())
+        if not due:
+            return due
+        await _combine_digests(db, due)
+        bodies = await BodyRepo.get_many(db, (notification.content_hash for notification in due))
+        deltas = Counter()
+        for notification in due:
+            transition(deltas, notification.created_at, notification.channel, notification.event_type, notification.status, "pending")
+            notification.status = "pending"
+        await OutboxRepo.add_many(db, [
+            _dispatch_payload(notification, bodies.get(notification.content_hash)) for notification in due
+        ])
+        StatsRepo.record(db, deltas)
+        return due
+
+    @staticmethod
+    async def get_ids_by_dedup_keys(db: AsyncSession, keys: List[str]) -> dict:
+        result = await db.execute(
+            select(Notification.dedup_key, Notification.notification_id).where(Notification.dedup_key.in_(keys))
+        )
+        return dict(result.all())
+
+    @staticmethod
+    async def get_by_id(db: AsyncSession, id: int):
+        result = await db.execute(select(Notification).where(Notification.id == id))
         return result.scalar_one_or_none()
-    
+
+    @staticmethod
+    async def get_by_notification_id(db: AsyncSession, notification_id: str):
+        result = await db.execute(select(Notification).where(Notification.notification_id == notification_id))
+        return result.scalar_one_or_none()
+
     @staticmethod
-    async def update_status(db: AsyncSession, event_id: str, status: str ):
-        result = await db.execute(select(Notification).where(Notification.event_type == event_id))
+    async def get_status(db: AsyncSession, notification_id: str) -> Optional[str]:
+        result = await db.execute(select(Notification.status).where(Notification.notification_id == notification_id))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def get_report(db: AsyncSession, notification_id: str):
+        # Like get_by_notification_id, with content loaded from the body store
+        result = await db.execute(
+            select(Notification)
+            .where(Notification.notification_id == notification_id)
+            .options(undefer(Notification.digest_notification_id))
+        )
         notification = result.scalar_one_or_none()
+        if notification is not None and notification.content_hash is not None:
+            bodies = await BodyRepo.get_many(db, [notification.content_hash])
+            notification._content = bodies.get(notification.content_hash)
+        return notification
+
+    @staticmethod
+    async def get_by_event_id(db: AsyncSession, event_id: str):
+        # Latest notification for an event type, served by (event_type, created_at)
+        result = await db.execute(
+            select(Notification)
+            .where(Notification.event_type == event_id)
+            .order_by(Notification.created_at.desc(), Notification.id.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def update_status(db: AsyncSession, notification_id: str, status: str):
+        notification = await NotificationRepo.get_by_notification_id(db, notification_id)
         if notification:
+            deltas = Counter()
+            transition(deltas, notification.created_at, notification.channel, notification.event_type, notification.status, status)
             notification.status = status
+            StatsRepo.record(db, deltas)
+            await db.commit()
+            await get_report_cache().invalidate([notification_id])
+            logger.info("Updated status for notification_id: %s to %s", notification_id, status)
+        return notification
+
+    @staticmethod
+    async def increment_attempt(db: AsyncSession, notification_id: str):
+        notification = await NotificationRepo.get_by_notification_id(db, notification_id)
+        if notification:
+            notification.attempt += 1
             await db.commit()
-            logger.info(f"Updated status for event_id: {event_id} to {status}")
-               
\ No newline at end of file
+        return notification
+
+    @staticmethod
+    async def list_page(
+        db: AsyncSession,
+        filters: NotificationFilter,
+        limit: int,
+        after: Optional[Tuple[datetime, int]] = None,
+    ):
+        # Keyset pagination, newest first, on (created_at, id)
+        query = _apply_filter(select(*REPORT_COLUMNS), filters)
+        if after is not None:
+            query = query.where(tuple_(Notification.created_at, Notification.id) < tuple_(*after))
+        query = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit)
+        result = await db.execute(query)
+        return await _with_content(db, result.mappings().all())
+
+    @staticmethod
+    async def stream(db: AsyncSession, filters: NotificationFilter, chunk_size: int) -> AsyncIterator[list]:
+        # Server-side cursor; yields chunks of rows without materializing the result
+        query = _apply_filter(select(*REPORT_COLUMNS), filters).order_by(
+            Notification.created_at, Notification.id
+        )
+        result = await db.stream(query.execution_options(yield_per=chunk_size))
+        async for partition in result.mappings().partitions():
+            yield await _with_content(db, partition)
@@ -0,0 +1,33 @@
+# Async DB operations for the transactional outbox
+
+from app.models.outbox import OutboxMessage
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import delete, insert
+from typing import List
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEND_NOTIFICATION_TASK = "app.workers.tasks.send_notification"
+
+class OutboxRepo:
+    @staticmethod
+    async def add_many(db: AsyncSession, payloads: List[dict], task_name: str = SEND_NOTIFICATION_TASK):
+        # Caller commits, so the messages land in the same transaction as their rows
+        await db.execute(insert(OutboxMessage), [{"task_name": task_name, "payload": payload} for payload in payloads])
+
+    @staticmethod
+    async def claim_batch(db: AsyncSession, limit: int) -> List[OutboxMessage]:
+        # Rows stay locked until the caller commits; other relays skip them
+        result = await db.execute(
+            select(OutboxMessage)
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return list(result.scalars())
+
+    @staticmethod
+    async def delete_many(db: AsyncSession, ids: List[int]):
+        await db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(ids)))
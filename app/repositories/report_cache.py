@@ -0,0 +1,182 @@
+# Read-through cache for notification reports
+#
+# A bounded in-process LRU tier in front of an optional Redis tier. Entries
+# are invalidated whenever a notification's status is written; with Redis
+# enabled, invalidations are also broadcast so other API processes evict
+# their local copies. Without Redis, status changes written by workers and
+# other processes would never reach the local tier, so it is disabled.
+#
+# Readers take a version() before loading from the DB and pass it to set().
+# Every invalidation bumps the version (a local counter, and a per-key
+# counter in Redis), so a value loaded before an invalidation is never
+# written back after it.
+
+import json
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+from app.core.config import settings
+from app.metrics.prometheus import report_cache_hits, report_cache_misses
+import logging
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "report-cache-invalidate"
+
+def _key(notification_id: str) -> str:
+    return f"report:{notification_id}"
+
+def _version_key(notification_id: str) -> str:
+    return f"report-version:{notification_id}"
+
+# Writes ARGV[2] only if the key's version is still ARGV[1]
+_SET_IF_VERSION_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+class ReportCache:
+    def __init__(self, max_entries: int = None, ttl_s: float = None, redis=None, redis_ttl_s: int = None):
+        self.max_entries = settings.REPORT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl = settings.REPORT_CACHE_TTL_S if ttl_s is None else ttl_s
+        self.redis_ttl = settings.REPORT_CACHE_REDIS_TTL_S if redis_ttl_s is None else redis_ttl_s
+        self._redis = redis
+        self._local = OrderedDict()  # notification_id -> (expires_at, report)
+        self._invalidations = 0
+        self._invalidated = OrderedDict()  # notification_id -> _invalidations when last invalidated
+        self._forgotten = 0  # highest counter dropped from _invalidated
+        self._set_script = redis.register_script(_SET_IF_VERSION_SCRIPT) if redis is not None else None
+
+    def _get_local(self, notification_id: str) -> Optional[dict]:
+        entry = self._local.get(notification_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._local[notification_id]
+            return None
+        self._local.move_to_end(notification_id)
+        return entry[1]
+
+    def _set_local(self, notification_id: str, report: dict):
+        self._local[notification_id] = (time.monotonic() + self.ttl, report)
+        self._local.move_to_end(notification_id)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def _stale_local(self, notification_id: str, version: int) -> bool:
+        return version < self._forgotten or self._invalidated.get(notification_id, 0) > version
+
+    def evict_local(self, notification_ids: Iterable[str]):
+        for notification_id in notification_ids:
+            self._local.pop(notification_id, None)
+            self._invalidations += 1
+            self._invalidated[notification_id] = self._invalidations
+            self._invalidated.move_to_end(notification_id)
+        while len(self._invalidated) > self.max_entries:
+            _, self._forgotten = self._invalidated.popitem(last=False)
+
+    async def get(self, notification_id: str) -> Optional[dict]:
+        report = self._get_local(notification_id)
+        if report is not None:
+            report_cache_hits.labels(tier="local").inc()
+            return report
+        if self._redis is not None:
+            try:
+                cached = await self._redis.get(_key(notification_id))
+            except Exception as e:
+                logger.warning("Report cache Redis read failed: %s", e)
+                cached = None
+            if cached is not None:
+                report = json.loads(cached)
+                self._set_local(notification_id, report)
+                report_cache_hits.labels(tier="redis").inc()
+                return report
+        report_cache_misses.inc()
+        return None
+
+    async def version(self, notification_id: str) -> Tuple[int, Optional[str]]:
+        # Take before loading the report from the DB; pass the result to set()
+        redis_version = None
+        if self._redis is not None:
+            try:
+                redis_version = await self._redis.get(_version_key(notification_id))
+                redis_version = redis_version.decode() if redis_version is not None else ""
+            except Exception as e:
+                logger.warning("Report cache Redis read failed: %s", e)
+        return self._invalidations, redis_version
+
+    async def set(self, notification_id: str, report: dict, version: Tuple[int, Optional[str]] = None):
+        # Without a version the write is unconditional
+        if version is not None and self._stale_local(notification_id, version[0]):
+            return
+        if self._redis is not None:
+            try:
+                if version is None:
+                    await self._redis.set(_key(notification_id), json.dumps(report), ex=self.redis_ttl)
+                elif version[1] is not None:
+                    written = await self._set_script(
+                        keys=[_key(notification_id), _version_key(notification_id)],
+                        args=[version[1], json.dumps(report), self.redis_ttl],
+                    )
+                    if not written:
+                        return
+            except Exception as e:
+                logger.warning("Report cache Redis write failed: %s", e)
+            if version is not None and self._stale_local(notification_id, version[0]):
+                return
+        self._set_local(notification_id, report)
+
+    async def invalidate(self, notification_ids: Iterable[str]):
+        notification_ids = list(notification_ids)
+        if not notification_ids:
+            return
+        self.evict_local(notification_ids)
+        if self._redis is not None:
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.delete(*(_key(notification_id) for notification_id in notification_ids))
+                    for notification_id in notification_ids:
+                        # Outlives any report cached under the old version
+                        pipe.incr(_version_key(notification_id))
+                        pipe.expire(_version_key(notification_id), self.redis_ttl * 2)
+                    pipe.publish(INVALIDATION_CHANNEL, json.dumps(notification_ids))
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("Report cache Redis invalidation failed: %s", e)
+
+    async def listen_invalidations(self):
+        # Evicts local entries invalidated by other processes; runs until cancelled
+        if self._redis is None:
+            return
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    self.evict_local(json.loads(message["data"]))
+        finally:
+            await pubsub.aclose()
+
+    async def aclose(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+
+_cache = None
+
+def get_report_cache() -> ReportCache:
+    global _cache
+    if _cache is None:
+        client = None
+        if settings.REPORT_CACHE_REDIS_ENABLED:
+            import redis.asyncio as aioredis
+
+            client = aioredis.from_url(settings.REDIS_URL)
+        _cache = ReportCache(redis=client, max_entries=None if client is not None else 0)
+    return _cache
+
+def reset_report_cache():
+    global _cache
+    _cache = None
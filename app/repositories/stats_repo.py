@@ -0,0 +1,185 @@
+# Incrementally maintained delivery statistics
+#
+# Ingest and status transactions record their rollup deltas on the session
+# instead of upserting notification_stats themselves, which made every
+# transaction wait on the same per-minute row. Deltas of committed
+# transactions are summed in memory per process and upserted in one
+# transaction every STATS_FLUSH_MS; rolled back transactions drop theirs.
+
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import List, Optional
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.metrics.prometheus import stats_flush_errors
+from app.models.stats import NotificationStat
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+import logging
+
+logger = logging.getLogger(__name__)
+
+SENT_STATUSES = {"sent", "delivered", "opened", "clicked"}
+FAILED_STATUSES = {"failed", "bounced", "spam"}
+BUCKET_SIZES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+def bucket_of(created_at: Optional[datetime]) -> datetime:
+    return (created_at or datetime.utcnow()).replace(second=0, microsecond=0)
+
+def transition(deltas: Counter, created_at, channel: str, event_type: str, old_status: Optional[str], new_status: str):
+    if old_status == new_status:
+        return
+    bucket = bucket_of(created_at)
+    if old_status is not None:
+        deltas[(bucket, channel, event_type, old_status)] -= 1
+    deltas[(bucket, channel, event_type, new_status)] += 1
+
+def _floor(bucket_start: datetime, size: timedelta) -> datetime:
+    epoch = datetime(1970, 1, 1)
+    return epoch + ((bucket_start - epoch) // size) * size
+
+class StatsRepo:
+    @staticmethod
+    def record(db: AsyncSession, deltas: Counter):
+        # Counted once the caller's transaction commits; see StatsBuffer
+        if deltas:
+            db.info.setdefault("stats_deltas", Counter()).update(deltas)
+
+    @staticmethod
+    async def apply(db: AsyncSession, deltas: Counter):
+        # deltas: (bucket_start, channel, event_type, status) -> count change
+        # Upserts run in the caller's transaction, in key order so concurrent
+        # flushes lock rollup rows in the same order
+        rows = [
+            {"bucket_start": key[0], "channel": key[1], "event_type": key[2], "status": key[3], "count": delta}
+            for key, delta in sorted(deltas.items())
+            if delta
+        ]
+        if not rows:
+            return
+        dialect = sqlite if db.bind.dialect.name == "sqlite" else postgresql
+        stmt = dialect.insert(NotificationStat)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["bucket_start", "channel", "event_type", "status"],
+            set_={"count": NotificationStat.count + stmt.excluded.count},
+        )
+        await db.execute(stmt, rows)
+
+    @staticmethod
+    async def summary(
+        db: AsyncSession,
+        start: datetime,
+        end: datetime,
+        bucket: str = "minute",
+        channel: Optional[str] = None,
+        event_type: Optional[str] = None,
+    ) -> List[dict]:
+        query = select(NotificationStat).where(
+            NotificationStat.bucket_start >= start, NotificationStat.bucket_start < end
+        )
+        if channel is not None:
+            query = query.where(NotificationStat.channel == channel)
+        if event_type is not None:
+            query = query.where(NotificationStat.event_type == event_type)
+        result = await db.execute(query)
+
+        size = BUCKET_SIZES[bucket]
+        grouped = defaultdict(Counter)
+        for stat in result.scalars():
+            grouped[(_floor(stat.bucket_start, size), stat.channel, stat.event_type)][stat.status] += stat.count
+
+        summary = []
+        for (bucket_start, channel, event_type), counts in sorted(grouped.items()):
+            sent = sum(count for status, count in counts.items() if status in SENT_STATUSES)
+            failed = sum(count for status, count in counts.items() if status in FAILED_STATUSES)
+            summary.append({
+                "bucket_start": bucket_start,
+                "channel": channel,
+                "event_type": event_type,
+                "sent": sent,
+                "failed": failed,
+                "pending": counts.get("pending", 0),
+                "success_rate": sent / (sent + failed) if sent + failed else None,
+                "counts": dict(counts),
+            })
+        return summary
+
+class StatsBuffer:
+    def __init__(self, session_factory=SessionLocal, flush_interval_ms: int = None):
+        self._session_factory = session_factory
+        self.flush_interval = (settings.STATS_FLUSH_MS if flush_interval_ms is None else flush_interval_ms) / 1000
+        self._pending = Counter()
+        self._lock = None
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, deltas: Counter):
+        # Called from the commit hook, so synchronous
+        self._pending.update(deltas)
+        if self._flusher is None and self._pending:
+            try:
+                self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+            except RuntimeError:
+                pass  # no loop; flushed on close
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # already logged and requeued; retry on the next tick
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            deltas, self._pending = self._pending, Counter()
+            try:
+                async with self._session_factory() as db:
+                    await StatsRepo.apply(db, deltas)
+                    await db.commit()
+            except Exception as e:
+                stats_flush_errors.inc()
+                logger.error("Stats flush of %s rollup deltas failed: %s", len(deltas), e)
+                self._pending.update(deltas)
+                raise
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.error("Dropping %s buffered rollup deltas on shutdown", len(self._pending))
+
+_buffer = None
+
+def get_stats_buffer() -> StatsBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = StatsBuffer()
+    return _buffer
+
+def reset_stats_buffer():
+    global _buffer
+    _buffer = None
+
+@event.listens_for(Session, "after_commit")
+def _buffer_committed_deltas(session):
+    deltas = session.info.pop("stats_deltas", None)
+    if deltas:
+        get_stats_buffer().add(deltas)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back_deltas(session):
+    session.info.pop("stats_deltas", None)
@@ -0,0 +1,180 @@
+# Write-behind buffer for delivery status updates
+#
+# Status and attempt changes are merged in memory per notification and
+# written as one bulk UPDATE when the buffer reaches its size limit or its
+# flush interval elapses, instead of a SELECT + UPDATE + commit per change.
+# A status never moves back down STATUS_RANK, so a late "sent" can't
+# overwrite a provider's "delivered".
+
+import asyncio
+import time
+from collections import Counter
+from sqlalchemy import Integer, and_, bindparam, case, func, or_, select, update
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.metrics.prometheus import status_flush_batch_size, status_flush_errors, status_flush_latency
+from app.models.notifications import Notification
+from app.repositories.report_cache import get_report_cache
+from app.repositories.stats_repo import StatsRepo, transition
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Delivery progress; statuses not listed (e.g. set through the generic
+# webhook) are always written
+STATUS_RANK = {
+    "scheduled": 0, "pending": 0, "sent": 1,
+    "delivered": 2, "failed": 2, "bounced": 2, "opened": 3, "clicked": 4, "spam": 5,
+}
+
+def advances(old: str, new: str) -> bool:
+    if new is None:
+        return False
+    if old is None or old not in STATUS_RANK or new not in STATUS_RANK:
+        return True
+    return STATUS_RANK[new] > STATUS_RANK[old]
+
+# Core table statement so a list of params runs as one executemany rather
+# than the ORM's bulk-update-by-primary-key path
+_notifications = Notification.__table__
+_current_rank = case(STATUS_RANK, value=_notifications.c.status, else_=None)
+_new_rank = bindparam("b_rank", type_=Integer)
+_bulk_update = (
+    update(_notifications)
+    .where(_notifications.c.notification_id == bindparam("b_notification_id"))
+    .values(
+        status=case(
+            (
+                and_(
+                    bindparam("b_status").is_not(None),
+                    or_(_new_rank.is_(None), _current_rank.is_(None), _new_rank > _current_rank),
+                ),
+                bindparam("b_status"),
+            ),
+            else_=_notifications.c.status,
+        ),
+        attempt=func.coalesce(_notifications.c.attempt, 0) + bindparam("b_attempts"),
+    )
+)
+
+class StatusUpdateBuffer:
+    def __init__(self, session_factory=SessionLocal, max_size: int = None, flush_interval_ms: int = None):
+        self._session_factory = session_factory
+        self.max_size = settings.STATUS_BUFFER_MAX_SIZE if max_size is None else max_size
+        self.flush_interval = (
+            settings.STATUS_BUFFER_FLUSH_MS if flush_interval_ms is None else flush_interval_ms
+        ) / 1000
+        self._pending = {}  # notification_id -> [status, attempts]
+        self._lock = None
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def status(self, notification_id: str):
+        # Status waiting to be flushed, if any
+        entry = self._pending.get(notification_id)
+        return entry[0] if entry else None
+
+    async def add(self, notification_id: str, status: str = None, attempts: int = 0):
+        entry = self._pending.setdefault(notification_id, [None, 0])
+        if advances(entry[0], status):
+            entry[0] = status
+        entry[1] += attempts
+        if len(self._pending) >= self.max_size:
+            try:
+                await self.flush()
+            except Exception:
+                pass  # requeued; the background flusher retries
+        if self._flusher is None and self._pending:
+            self._flusher = asyncio.ensure_future(self._run_flusher())
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # already logged and requeued; retry on the next tick
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            params = [
+                {
+                    "b_notification_id": notification_id, "b_status": status,
+                    "b_rank": STATUS_RANK.get(status), "b_attempts": attempts,
+                }
+                for notification_id, (status, attempts) in batch.items()
+            ]
+            start = time.perf_counter()
+            try:
+                async with self._session_factory() as db:
+                    deltas = await self._status_deltas(db, batch)
+                    await db.execute(_bulk_update, params)
+                    StatsRepo.record(db, deltas)
+                    await db.commit()
+            except Exception as e:
+                status_flush_errors.inc()
+                logger.error("Status flush of %s updates failed: %s", len(params), e)
+                self._requeue(batch)
+                raise
+            await get_report_cache().invalidate(batch.keys())
+            status_flush_latency.observe(time.perf_counter() - start)
+            status_flush_batch_size.observe(len(params))
+            logger.debug("Flushed %s status updates", len(params))
+
+    async def _status_deltas(self, db, batch: dict) -> Counter:
+        # One locked read per flush gives the old statuses for the stats rollup
+        changed = [notification_id for notification_id, (status, _) in batch.items() if status is not None]
+        deltas = Counter()
+        if not changed:
+            return deltas
+        result = await db.execute(
+            select(
+                _notifications.c.notification_id,
+                _notifications.c.status,
+                _notifications.c.channel,
+                _notifications.c.event_type,
+                _notifications.c.created_at,
+            )
+            .where(_notifications.c.notification_id.in_(changed))
+            .with_for_update()
+        )
+        for row in result:
+            new_status = batch[row.notification_id][0]
+            if advances(row.status, new_status):
+                transition(deltas, row.created_at, row.channel, row.event_type, row.status, new_status)
+        return deltas
+
+    def _requeue(self, batch: dict):
+        for notification_id, (status, attempts) in batch.items():
+            entry = self._pending.setdefault(notification_id, [None, 0])
+            if advances(entry[0], status):
+                entry[0] = status
+            entry[1] += attempts
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.error("Dropping %s buffered status updates on shutdown", len(self._pending))
+
+_buffer = None
+
+def get_status_buffer() -> StatusUpdateBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = StatusUpdateBuffer()
+    return _buffer
+
+def reset_status_buffer():
+    global _buffer
+    _buffer = None
@@ -0,0 +1,39 @@
+# Async DB operations for notification templates
+
+from typing import Optional
+from app.models.templates import NotificationTemplate
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TemplateRepo:
+    @staticmethod
+    async def create(db: AsyncSession, template_id: str, channel: str, body: str, subject: Optional[str] = None):
+        # Next version number; a concurrent registration of the same template
+        # fails on the unique constraint instead of sharing a version
+        result = await db.execute(
+            select(func.max(NotificationTemplate.version)).where(NotificationTemplate.template_id == template_id)
+        )
+        version = (result.scalar() or 0) + 1
+        db_template = NotificationTemplate(
+            template_id=template_id, version=version, channel=channel, subject=subject, body=body
+        )
+        db.add(db_template)
+        await db.commit()
+        await db.refresh(db_template)
+        logger.info("Registered template %s version %s", template_id, version)
+        return db_template
+
+    @staticmethod
+    async def get(db: AsyncSession, template_id: str, version: Optional[int] = None):
+        # Latest version when none is given
+        query = select(NotificationTemplate).where(NotificationTemplate.template_id == template_id)
+        if version is None:
+            query = query.order_by(NotificationTemplate.version.desc()).limit(1)
+        else:
+            query = query.where(NotificationTemplate.version == version)
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
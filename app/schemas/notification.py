@@ -1,16 +1,45 @@
 # For API input/output validation
 
-from pydantic import BaseModel
-from datetime import datetime
+import json
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Literal, Optional
+from app.core.config import settings
 
 class NotificationBase(BaseModel):
     event_type: str
     channel: str
     recipient: str
-    content: str
+    content: Optional[str] = None
+    template_id: Optional[str] = None
+    template_version: Optional[int] = None
 
 class NotificationCreate(NotificationBase):
-    pass
+    channel: Literal["email", "sms", "push"]
+    priority: Literal["transactional", "bulk"] = "transactional"  # Selects the worker queue
+    variables: Optional[Dict[str, Any]] = None  # Rendered into the template by the worker
+    send_at: Optional[datetime] = None  # Held by the scheduler until then; naive times are UTC
+
+    @field_validator("send_at")
+    @classmethod
+    def send_at_utc(cls, value):
+        # Stored as naive UTC, like created_at
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @model_validator(mode="after")
+    def check_content_or_template(self):
+        if (self.content is None) == (self.template_id is None):
+            raise ValueError("Provide exactly one of content or template_id")
+        if self.template_id is None and (self.variables or self.template_version is not None):
+            raise ValueError("variables and template_version require template_id")
+        if self.variables and len(json.dumps(self.variables, default=str)) > settings.TEMPLATE_VARIABLES_MAX_BYTES:
+            raise ValueError("variables too large")
+        return self
+
+class NotificationBatchCreate(BaseModel):
+    notifications: List[NotificationCreate] = Field(..., min_length=1, max_length=settings.BATCH_MAX_SIZE)
 
 class NotificationUpdate(BaseModel):
     id: int
@@ -19,10 +48,47 @@ class NotificationUpdate(BaseModel):
     created_at: datetime
 
 class NotificationReport(NotificationBase):
+    model_config = ConfigDict(from_attributes=True) # for ORM mode
+
     id: int
+    notification_id: str
     status: str
     attempts: int
-    created_at: datetime    
+    send_at: Optional[datetime] = None
+    # notification_id of the digest this one was merged into. Members keep
+    # status "digested"; the digest's report carries the delivery status.
+    digest_notification_id: Optional[str] = None
+    created_at: datetime
+
+class NotificationFilter(BaseModel):
+    event_type: Optional[str] = None
+    channel: Optional[str] = None
+    status: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+
+class NotificationReportPage(BaseModel):
+    items: List[NotificationReport]
+    next_cursor: Optional[str] = None
 
-class Config:
-    from_attributes = True # for ORM mode
\ No newline at end of file
+class DeliveryStats(BaseModel):
+    bucket_start: datetime
+    channel: str
+    event_type: str
+    sent: int
+    failed: int
+    pending: int
+    success_rate: Optional[float] = None
+    counts: Dict[str, int]
+
+class TemplateCreate(BaseModel):
+    template_id: str = Field(..., min_length=1, max_length=100)
+    channel: Literal["email", "sms", "push"]
+    subject: Optional[str] = None  # Email subject or push title
+    body: str
+
+class TemplateOut(TemplateCreate):
+    model_config = ConfigDict(from_attributes=True)
+
+    version: int
+    created_at: datetime
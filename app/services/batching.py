@@ -0,0 +1,76 @@
+# Worker-side micro-batching for provider sends.
+#
+# Concurrent tasks on the worker loop submit sends that are grouped by an
+# identical-payload key. A group is sent when it reaches max_size or when its
+# window expires, and each caller gets back its own recipient's result.
+
+import asyncio
+from app.metrics.prometheus import provider_batch_size
+from app.services.rate_limit import RateLimited
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    name = "batch"
+
+    def __init__(self, window_ms: int, max_size: int):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._groups = {}  # key -> [(recipient, future)]
+        self._timers = {}
+        self._inflight = set()
+
+    async def _send_group(self, key, recipients: list) -> list:
+        # Returns one result per recipient, in order: True/False or an exception
+        raise NotImplementedError
+
+    async def submit(self, key, recipient: str) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self._groups.setdefault(key, [])
+        group.append((recipient, future))
+        if len(group) >= self.max_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._groups.pop(key, [])
+        if items:
+            task = asyncio.ensure_future(self._dispatch(key, items))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def flush_all(self):
+        for key in list(self._groups):
+            self._flush(key)
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _dispatch(self, key, items: list):
+        recipients = [recipient for recipient, _ in items]
+        provider_batch_size.labels(channel=self.name.lower()).observe(len(recipients))
+        try:
+            results = await self._send_group(key, recipients)
+        except Exception as e:
+            results = [e] * len(items)
+        failures = 0
+        for (recipient, future), result in zip(items, results):
+            if isinstance(result, RateLimited):
+                # Nothing was sent; let the caller's task reschedule itself
+                failures += 1
+                if not future.done():
+                    future.set_exception(result)
+                continue
+            ok = result is True or (result is not False and not isinstance(result, Exception))
+            if not ok:
+                failures += 1
+                logger.error("%s send failed for %s: %s", self.name, recipient, result)
+            if not future.done():
+                future.set_result(ok)
+        logger.info("%s batch sent to %s recipients, failures: %s", self.name, len(recipients), failures)
@@ -0,0 +1,93 @@
+# Circuit breakers for provider calls
+#
+# One breaker per provider per process. After CIRCUIT_BREAKER_FAILURE_THRESHOLD
+# consecutive failures (timeouts, connection errors, 5xx) the circuit opens
+# and calls fail fast with CircuitOpen for CIRCUIT_BREAKER_OPEN_S. Then up to
+# CIRCUIT_BREAKER_HALF_OPEN_CALLS probe calls are let through: a success
+# closes the circuit, a failure opens it again. CircuitOpen is a RateLimited,
+# so the send task is rescheduled without spending a retry.
+
+import time
+from typing import Optional
+from app.core.config import settings
+from app.metrics.prometheus import provider_circuit_opened, provider_circuit_state
+from app.services.rate_limit import RateLimited
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+class CircuitOpen(RateLimited):
+    def __str__(self):
+        return f"{self.provider} circuit open, retry in {self.retry_after:.2f}s"
+
+class CircuitBreaker:
+    def __init__(
+        self, name: str, failure_threshold: int = None, open_s: float = None, half_open_calls: int = None,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD if failure_threshold is None else failure_threshold
+        self.open_s = settings.CIRCUIT_BREAKER_OPEN_S if open_s is None else open_s
+        self.half_open_calls = settings.CIRCUIT_BREAKER_HALF_OPEN_CALLS if half_open_calls is None else half_open_calls
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0  # half-open calls in flight
+        self._set_state("closed")
+
+    def _set_state(self, state: str):
+        self._state = state
+        provider_circuit_state.labels(provider=self.name).set(STATE_VALUES[state])
+
+    @property
+    def state(self) -> str:
+        if self._state == "open" and self._clock() - self._opened_at >= self.open_s:
+            self._set_state("half_open")
+            self._probes = 0
+        return self._state
+
+    def allow(self):
+        # Raises CircuitOpen, otherwise the caller must report the outcome
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and self._probes < self.half_open_calls:
+            self._probes += 1
+            return
+        remaining = self.open_s - (self._clock() - self._opened_at) if state == "open" else self.open_s / 10
+        raise CircuitOpen(self.name, max(remaining, 0.1))
+
+    def record_success(self):
+        if self._state == "half_open":
+            logger.info("%s circuit closed", self.name)
+            self._set_state("closed")
+        self._failures = 0
+        self._probes = max(self._probes - 1, 0)
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+            logger.warning("%s circuit opened after %s failures", self.name, self._failures)
+            provider_circuit_opened.labels(provider=self.name).inc()
+            self._opened_at = self._clock()
+            self._probes = 0
+            self._set_state("open")
+
+    def release(self):
+        # The call ended before reaching the provider (e.g. throttled locally)
+        if self._state == "half_open":
+            self._probes = max(self._probes - 1, 0)
+
+_breakers = {}
+
+def get_circuit_breaker(provider: str) -> Optional[CircuitBreaker]:
+    if settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD <= 0:
+        return None
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+def reset_circuit_breakers():
+    _breakers.clear()
@@ -0,0 +1,287 @@
+# Long-lived, pooled async HTTP clients for the notification providers.
+#
+# One client per provider per process keeps TLS connections alive between
+# sends. Base URLs are configurable so the clients can be pointed at local
+# stub servers. Every call runs under a hard deadline and the provider's
+# circuit breaker, so a degraded provider frees worker slots quickly instead
+# of holding them for the full httpx timeouts.
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+import httpx
+from app.core.config import settings
+from app.metrics.prometheus import provider_failovers, provider_latency, provider_throttle_wait
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpen, get_circuit_breaker
+from app.services.rate_limit import RateLimited, RateLimiter, get_rate_limiter
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return max(float(response.headers.get("Retry-After", 1)), 0)
+    except ValueError:
+        return 1.0
+
+class ProviderClient:
+    name = "provider"
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int,
+        timeout: float,
+        connect_timeout: float,
+        keepalive_expiry: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        deadline: Optional[float] = None,
+        name: Optional[str] = None,
+        **client_kwargs,
+    ):
+        if name:
+            self.name = name  # e.g. a secondary account of the same provider
+        self._limiter = limiter
+        self._breaker = breaker
+        self.deadline = settings.PROVIDER_CALL_DEADLINE_S if deadline is None else deadline
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            transport=transport,
+            **client_kwargs,
+        )
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self._breaker is not None:
+            self._breaker.allow()
+        healthy = None  # None: the provider was never reached
+        try:
+            # One token per provider API call
+            if self._limiter is not None:
+                start = time.perf_counter()
+                await self._limiter.acquire()
+                provider_throttle_wait.labels(provider=self.name).observe(time.perf_counter() - start)
+            start = time.perf_counter()
+            outcome = "error"
+            healthy = False
+            try:
+                try:
+                    response = await asyncio.wait_for(self._client.request(method, url, **kwargs), self.deadline)
+                except asyncio.TimeoutError:
+                    outcome = "timeout"
+                    raise httpx.TimeoutException(f"{self.name} call exceeded its {self.deadline}s deadline") from None
+                # Any answer below 500, including 4xx and 429, means the provider is up
+                healthy = response.status_code < 500
+                if response.status_code == 429:
+                    outcome = "throttled"
+                    raise RateLimited(self.name, _retry_after(response))
+                response.raise_for_status()
+                outcome = "success"
+                return response
+            finally:
+                provider_latency.labels(provider=self.name, outcome=outcome).observe(time.perf_counter() - start)
+        finally:
+            if self._breaker is not None:
+                if healthy is None:
+                    self._breaker.release()
+                elif healthy:
+                    self._breaker.record_success()
+                else:
+                    self._breaker.record_failure()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+class SendGridClient(ProviderClient):
+    name = "sendgrid"
+
+    def __init__(self, api_key: str, base_url: str = "https://api.sendgrid.com", **kwargs):
+        kwargs.setdefault("pool_size", settings.SENDGRID_POOL_SIZE)
+        kwargs.setdefault("timeout", settings.SENDGRID_TIMEOUT)
+        kwargs.setdefault("connect_timeout", settings.PROVIDER_CONNECT_TIMEOUT)
+        super().__init__(base_url, headers={"Authorization": f"Bearer {api_key}"}, **kwargs)
+
+    async def send_mail(self, payload: dict) -> httpx.Response:
+        return await self.request("POST", "/v3/mail/send", json=payload)
+
+class TwilioClient(ProviderClient):
+    name = "twilio"
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        base_url: str = "https://api.twilio.com",
+        phone_number: str = None,
+        **kwargs,
+    ):
+        kwargs.setdefault("pool_size", settings.TWILIO_POOL_SIZE)
+        kwargs.setdefault("timeout", settings.TWILIO_TIMEOUT)
+        kwargs.setdefault("connect_timeout", settings.PROVIDER_CONNECT_TIMEOUT)
+        super().__init__(base_url, auth=(account_sid, auth_token), **kwargs)
+        self.account_sid = account_sid
+        self.phone_number = phone_number  # Default sender; each account has its own numbers
+
+    async def create_message(self, to: str, body: str, from_: str = None, status_callback: str = None) -> dict:
+        data = {"To": to, "From": from_ or self.phone_number, "Body": body}
+        if status_callback:
+            data["StatusCallback"] = status_callback
+        response = await self.request(
+            "POST",
+            f"/2010-04-01/Accounts/{self.account_sid}/Messages.json",
+            data=data,
+        )
+        return response.json()
+
+class FirebaseClient(ProviderClient):
+    name = "firebase"
+
+    def __init__(
+        self,
+        project_id: str,
+        token_provider: Callable[[], tuple],
+        base_url: str = "https://fcm.googleapis.com",
+        **kwargs,
+    ):
+        kwargs.setdefault("pool_size", settings.FCM_POOL_SIZE)
+        kwargs.setdefault("timeout", settings.FCM_TIMEOUT)
+        kwargs.setdefault("connect_timeout", settings.PROVIDER_CONNECT_TIMEOUT)
+        kwargs.setdefault("http2", settings.FCM_HTTP2)
+        super().__init__(base_url, **kwargs)
+        self.project_id = project_id
+        # Returns (access_token, expiry); called off the event loop since it may block
+        self._token_provider = token_provider
+        self._token = None
+        self._token_expiry = None
+        self._token_lock = asyncio.Lock()
+
+    async def _access_token(self) -> str:
+        async with self._token_lock:
+            if self._token is None or (
+                self._token_expiry is not None
+                and self._token_expiry - timedelta(minutes=5) <= datetime.utcnow()
+            ):
+                self._token, self._token_expiry = await asyncio.to_thread(self._token_provider)
+            return self._token
+
+    async def send_message(self, message: dict) -> dict:
+        token = await self._access_token()
+        response = await self.request(
+            "POST",
+            f"/v1/projects/{self.project_id}/messages:send",
+            json={"message": message},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        return response.json()
+
+    async def send_multicast(self, message: dict, tokens: List[str]) -> list:
+        # FCM v1 has no multi-token endpoint; fan out over the shared HTTP/2
+        # connection. Returns one response dict or exception per token, in order.
+        return await asyncio.gather(
+            *(self.send_message({**message, "token": token}) for token in tokens),
+            return_exceptions=True,
+        )
+
+class FailoverClient:
+    # Calls the primary client and falls back to the secondary only when the
+    # request certainly never reached the primary: its circuit is open or the
+    # connection failed. Timeouts and errors are not failed over, so a send the
+    # primary may have accepted is never duplicated.
+    FAILOVER_ERRORS = (CircuitOpen, httpx.ConnectError, httpx.ConnectTimeout)
+
+    def __init__(self, primary: ProviderClient, secondary: ProviderClient):
+        self.name = primary.name
+        self.primary = primary
+        self.secondary = secondary
+
+    def __getattr__(self, method: str):
+        async def call(*args, **kwargs):
+            try:
+                return await getattr(self.primary, method)(*args, **kwargs)
+            except self.FAILOVER_ERRORS as e:
+                logger.warning("%s unavailable, failing over to %s: %s", self.primary.name, self.secondary.name, e)
+                provider_failovers.labels(provider=self.primary.name).inc()
+                return await getattr(self.secondary, method)(*args, **kwargs)
+        return call
+
+    async def aclose(self):
+        await self.primary.aclose()
+        await self.secondary.aclose()
+
+def _with_provider_guards(name: str) -> dict:
+    return {"limiter": get_rate_limiter(name), "breaker": get_circuit_breaker(name)}
+
+_clients = {}
+
+def get_sendgrid_client() -> SendGridClient:
+    if "sendgrid" not in _clients:
+        client = SendGridClient(
+            settings.SENDGRID_API_KEY, base_url=settings.SENDGRID_BASE_URL, **_with_provider_guards("sendgrid")
+        )
+        if settings.SENDGRID_SECONDARY_API_KEY:
+            secondary = SendGridClient(
+                settings.SENDGRID_SECONDARY_API_KEY,
+                base_url=settings.SENDGRID_SECONDARY_BASE_URL,
+                name="sendgrid_secondary",
+                **_with_provider_guards("sendgrid_secondary"),
+            )
+            client = FailoverClient(client, secondary)
+        _clients["sendgrid"] = client
+    return _clients["sendgrid"]
+
+def get_twilio_client() -> TwilioClient:
+    if "twilio" not in _clients:
+        client = TwilioClient(
+            settings.TWILIO_ACCOUNT_SID,
+            settings.TWILIO_AUTH_TOKEN,
+            base_url=settings.TWILIO_BASE_URL,
+            phone_number=settings.TWILIO_PHONE_NUMBER,
+            **_with_provider_guards("twilio"),
+        )
+        if settings.TWILIO_SECONDARY_ACCOUNT_SID:
+            secondary = TwilioClient(
+                settings.TWILIO_SECONDARY_ACCOUNT_SID,
+                settings.TWILIO_SECONDARY_AUTH_TOKEN,
+                base_url=settings.TWILIO_SECONDARY_BASE_URL,
+                phone_number=settings.TWILIO_SECONDARY_PHONE_NUMBER,
+                name="twilio_secondary",
+                **_with_provider_guards("twilio_secondary"),
+            )
+            client = FailoverClient(client, secondary)
+        _clients["twilio"] = client
+    return _clients["twilio"]
+
+def get_firebase_client() -> FirebaseClient:
+    if "firebase" not in _clients:
+        import firebase_admin
+
+        credential = firebase_admin.get_app().credential
+
+        def token_provider():
+            info = credential.get_access_token()
+            return info.access_token, info.expiry
+
+        _clients["firebase"] = FirebaseClient(
+            credential.project_id, token_provider, base_url=settings.FCM_BASE_URL, **_with_provider_guards("firebase")
+        )
+    return _clients["firebase"]
+
+def reset_clients():
+    # Drop clients inherited across fork without touching the parent's sockets
+    _clients.clear()
+
+async def close_clients():
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error("Error closing %s client: %s", name, e)
+    _clients.clear()
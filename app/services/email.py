@@ -1,24 +1,85 @@
 # Integrates with SendGrid for sending emails
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import asyncio
+import httpx
+from sendgrid.helpers.mail import CustomArg, Mail, Personalization, To
 from app.core.config import settings
+from app.services.batching import MicroBatcher
+from app.services.clients import get_sendgrid_client
+from app.services.rate_limit import RateLimited
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def send_email(recipient: str, content: str):
+SUBJECT = 'Notification'
+
+def _build_message(subject: str, content: str, recipients: list) -> Mail:
+    # One personalization per (email, notification_id); the ID comes back in
+    # SendGrid event webhooks as a custom arg
     message = Mail(
         from_email = settings.DEFAULT_FROM_EMAIL,
-        to_emails = recipient,
-        subject = 'Notification',
+        subject = subject,
         html_content = content
     )
+    for email, notification_id in recipients:
+        personalization = Personalization()
+        personalization.add_to(To(email))
+        if notification_id:
+            personalization.add_custom_arg(CustomArg("notification_id", notification_id))
+        message.add_personalization(personalization)
+    return message
+
+class EmailBatcher(MicroBatcher):
+    # Coalesces emails with the same subject and content into one SendGrid
+    # request with one personalization per recipient
+    name = "Email"
+
+    def __init__(self, client_factory=get_sendgrid_client, window_ms: int = None, max_recipients: int = None):
+        super().__init__(
+            settings.EMAIL_BATCH_WINDOW_MS if window_ms is None else window_ms,
+            settings.EMAIL_BATCH_MAX_RECIPIENTS if max_recipients is None else max_recipients,
+        )
+        self._client_factory = client_factory
+
+    async def _send_group(self, key: tuple, recipients: list) -> list:
+        subject, content = key
+        message = _build_message(subject, content, recipients)
+        try:
+            await self._client_factory().send_mail(message.get())
+            return [True] * len(recipients)
+        except httpx.HTTPStatusError as e:
+            if len(recipients) == 1 or e.response.status_code != 400:
+                raise
+        # SendGrid rejects the whole request for one bad address; isolate it
+        logger.warning("Email batch of %s rejected, retrying recipients individually", len(recipients))
+        results = await asyncio.gather(
+            *(self._send_group(key, [recipient]) for recipient in recipients),
+            return_exceptions=True,
+        )
+        return [result if isinstance(result, Exception) else result[0] for result in results]
+
+    async def send(self, recipient: str, subject: str, content: str, notification_id: str = None) -> bool:
+        return await self.submit((subject, content), (recipient, notification_id))
+
+_batcher = None
+
+def get_email_batcher() -> EmailBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = EmailBatcher()
+    return _batcher
+
+async def send_email(recipient: str, content: str, notification_id: str = None, subject: str = None):
+    subject = subject or SUBJECT
+    if settings.EMAIL_BATCH_WINDOW_MS > 0:
+        return await get_email_batcher().send(recipient, subject, content, notification_id)
+    message = _build_message(subject, content, [(recipient, notification_id)])
     try:
-        sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-        response = sg.send(message)
-        logger.info(f"Email sent to {recipient}, status:{response.status_code} ")
+        response = await get_sendgrid_client().send_mail(message.get())
+        logger.info("Email sent to %s, status:%s ", recipient, response.status_code)
         return True
+    except RateLimited:
+        raise
     except Exception as e:
-        logger.error(f"Email send failed: {str(e)}")
-        return False
\ No newline at end of file
+        logger.error("Email send failed: %s", e)
+        return False
@@ -1,8 +1,11 @@
 # Integrates with Firebase for push notifications
 
 import firebase_admin
-from firebase_admin import credentials, messaging
+from firebase_admin import credentials
 from app.core.config import settings
+from app.services.batching import MicroBatcher
+from app.services.clients import get_firebase_client
+from app.services.rate_limit import RateLimited
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,18 +14,52 @@ logger = logging.getLogger(__name__)
 cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
 firebase_admin.initialize_app(cred)
 
-async def send_push(device_id: str, content: str):
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title="Notification",
-            body=content
-        ),
-        token=device_id
-    )
+TITLE = "Notification"
+
+def _build_message(content: str, title: str = TITLE) -> dict:
+    return {
+        "notification": {
+            "title": title,
+            "body": content,
+        },
+    }
+
+class PushBatcher(MicroBatcher):
+    # Groups pushes with identical payloads into one FCM multicast
+    name = "Push"
+
+    def __init__(self, client_factory=get_firebase_client, window_ms: int = None, max_tokens: int = None):
+        super().__init__(
+            settings.PUSH_BATCH_WINDOW_MS if window_ms is None else window_ms,
+            settings.PUSH_BATCH_MAX_TOKENS if max_tokens is None else max_tokens,
+        )
+        self._client_factory = client_factory
+
+    async def _send_group(self, key: tuple, tokens: list) -> list:
+        title, content = key
+        return await self._client_factory().send_multicast(_build_message(content, title), tokens)
+
+    async def send(self, device_id: str, content: str, title: str = TITLE) -> bool:
+        return await self.submit((title, content), device_id)
+
+_batcher = None
+
+def get_push_batcher() -> PushBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = PushBatcher()
+    return _batcher
+
+async def send_push(device_id: str, content: str, title: str = None):
+    title = title or TITLE
+    if settings.PUSH_BATCH_WINDOW_MS > 0:
+        return await get_push_batcher().send(device_id, content, title)
     try:
-        response = messaging.send(message)
-        logger.info(f"Push sent to {device_id}, response: {response}")
+        response = await get_firebase_client().send_message({**_build_message(content, title), "token": device_id})
+        logger.info("Push sent to %s, response: %s", device_id, response['name'])
         return True
+    except RateLimited:
+        raise
     except Exception as e:
-        logger.error(f"Push send failed: {str(e)}")
-        return False
\ No newline at end of file
+        logger.error("Push send failed: %s", e)
+        return False
@@ -0,0 +1,144 @@
+# Outbound rate limiting per provider account
+#
+# One token bucket per provider is shared by every worker process through
+# Redis. Each process leases tokens in blocks so most sends take a local
+# token without a Redis round trip; unused leased tokens expire quickly so a
+# process can't sit on quota. Callers wait for a token up to a deadline and
+# get RateLimited beyond it, so the task can be rescheduled instead of
+# sending into a provider 429.
+
+import asyncio
+import time
+from typing import Optional, Tuple
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RateLimited(Exception):
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} rate limit reached, retry in {retry_after:.2f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+# Refills from the Redis clock, grants up to ARGV[3] tokens and returns
+# {granted, seconds until the next token when nothing was granted}
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+local wait = 0
+if granted == 0 then
+    wait = (1 - tokens) / rate
+end
+return {granted, tostring(wait)}
+"""
+
+class LocalTokenBucket:
+    # Single-process stand-in for RedisTokenBucket
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._ts = time.monotonic()
+
+    async def take(self, requested: int) -> Tuple[int, float]:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+        granted = min(requested, int(self._tokens))
+        self._tokens -= granted
+        wait = 0 if granted else (1 - self._tokens) / self.rate
+        return granted, wait
+
+class RedisTokenBucket:
+    def __init__(self, redis, key: str, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._key = key
+        self._script = redis.register_script(_TAKE_SCRIPT)
+
+    async def take(self, requested: int) -> Tuple[int, float]:
+        granted, wait = await self._script(keys=[self._key], args=[self.rate, self.burst, requested])
+        return int(granted), float(wait)
+
+class RateLimiter:
+    def __init__(self, name: str, bucket, lease_size: int = None, lease_ttl_s: float = None, max_wait_s: float = None):
+        self.name = name
+        self.lease_size = settings.RATE_LIMIT_LEASE_SIZE if lease_size is None else lease_size
+        self.lease_ttl = settings.RATE_LIMIT_LEASE_TTL_S if lease_ttl_s is None else lease_ttl_s
+        self.max_wait = settings.RATE_LIMIT_MAX_WAIT_S if max_wait_s is None else max_wait_s
+        self._bucket = bucket
+        self._tokens = 0
+        self._leased_at = 0.0
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            # The lock only covers the lease refill; waiting for a token happens
+            # outside it so every caller is held to its own deadline
+            async with self._lock:
+                now = time.monotonic()
+                if not self._tokens or now - self._leased_at >= self.lease_ttl:
+                    granted, wait = await self._bucket.take(self.lease_size)
+                    self._tokens, self._leased_at = granted, time.monotonic()
+                if self._tokens:
+                    self._tokens -= 1
+                    return
+            if now + wait > deadline:
+                raise RateLimited(self.name, wait)
+            await asyncio.sleep(wait)
+
+_limiters = {}
+_redis = None
+
+def _rate_for(provider: str) -> float:
+    return {
+        "sendgrid": settings.SENDGRID_RATE_LIMIT_PER_S,
+        "sendgrid_secondary": settings.SENDGRID_RATE_LIMIT_PER_S,
+        "twilio": settings.TWILIO_RATE_LIMIT_PER_S,
+        "twilio_secondary": settings.TWILIO_RATE_LIMIT_PER_S,
+        "firebase": settings.FCM_RATE_LIMIT_PER_S,
+    }[provider]
+
+def get_rate_limiter(provider: str) -> Optional[RateLimiter]:
+    global _redis
+    rate = _rate_for(provider)
+    if rate <= 0:
+        return None
+    if provider not in _limiters:
+        burst = max(rate * settings.RATE_LIMIT_BURST_S, 1)
+        if settings.RATE_LIMIT_BACKEND == "local":
+            bucket = LocalTokenBucket(rate, burst)
+        else:
+            if _redis is None:
+                import redis.asyncio as aioredis
+
+                _redis = aioredis.from_url(settings.REDIS_URL)
+            bucket = RedisTokenBucket(_redis, f"ratelimit:{provider}", rate, burst)
+        _limiters[provider] = RateLimiter(provider, bucket)
+    return _limiters[provider]
+
+def reset_rate_limiters():
+    global _redis
+    _limiters.clear()
+    _redis = None
+
+async def close_rate_limiters():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+    reset_rate_limiters()
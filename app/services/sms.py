@@ -1,22 +1,26 @@
 # Integrates with Twilio for sending SMS
 
-from twilio.rest import Client
 from app.core.config import settings
+from app.services.clients import get_twilio_client
+from app.services.rate_limit import RateLimited
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def send_sms(recipient: str, content: str):
-    client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+async def send_sms(recipient: str, content: str, notification_id: str = None):
+    status_callback = None
+    if settings.TWILIO_STATUS_CALLBACK_URL and notification_id:
+        status_callback = f"{settings.TWILIO_STATUS_CALLBACK_URL}?notification_id={notification_id}"
     try:
-        message = client.messages.create(
+        message = await get_twilio_client().create_message(
+            to = recipient,
             body = content,
-            from_ = settings.TWILIO_PHONE_NUMBER,
-            to = recipient
-
+            status_callback = status_callback
         )
-        logger.info(f"SMS sent to {recipient}, SID: {message.sid}")
+        logger.info("SMS sent to %s, SID: %s", recipient, message['sid'])
         return True
+    except RateLimited:
+        raise
     except Exception as e:
-        logger.error(f"SMS send failed: {str(e)}")
-        return False
\ No newline at end of file
+        logger.error("SMS send failed: %s", e)
+        return False
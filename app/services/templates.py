@@ -0,0 +1,99 @@
+# Precompiled, versioned notification templates
+#
+# Templates use {{ name }} placeholders. Each version is parsed once into
+# alternating literal and placeholder parts and kept in a bounded in-process
+# LRU, so rendering is a single join. Versions never change once registered;
+# only the "latest version" lookup expires, after TEMPLATE_LATEST_TTL_S.
+
+import html
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.core.config import settings
+from app.repositories.template_repo import TemplateRepo
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+class TemplateError(ValueError):
+    pass
+
+def _compile(source: str) -> list:
+    # re.split with a group: literals at even indices, variable names at odd ones
+    return PLACEHOLDER.split(source)
+
+def _render(parts: list, variables: dict, escape: bool) -> str:
+    rendered = parts.copy()
+    try:
+        for i in range(1, len(parts), 2):
+            value = str(variables[parts[i]])
+            rendered[i] = html.escape(value) if escape else value
+    except KeyError as e:
+        raise TemplateError(f"Missing template variable {e.args[0]}")
+    return "".join(rendered)
+
+class CompiledTemplate:
+    def __init__(self, template_id: str, version: int, channel: str, body: str, subject: Optional[str] = None):
+        self.template_id = template_id
+        self.version = version
+        self.channel = channel
+        self._subject = _compile(subject) if subject else None
+        self._body = _compile(body)
+        self.variables = set(self._body[1::2]) | set(self._subject[1::2] if self._subject else ())
+
+    def render(self, variables: dict) -> Tuple[Optional[str], str]:
+        # (subject, body); variables are HTML-escaped in email bodies
+        subject = _render(self._subject, variables, escape=False) if self._subject else None
+        return subject, _render(self._body, variables, escape=self.channel == "email")
+
+class TemplateRegistry:
+    def __init__(self, max_entries: int = None, latest_ttl_s: float = None):
+        self.max_entries = settings.TEMPLATE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.latest_ttl = settings.TEMPLATE_LATEST_TTL_S if latest_ttl_s is None else latest_ttl_s
+        self._compiled = OrderedDict()  # (template_id, version) -> CompiledTemplate
+        self._latest = {}  # template_id -> (expires_at, version)
+
+    async def get(self, db: AsyncSession, template_id: str, version: int = None) -> Optional[CompiledTemplate]:
+        if version is None:
+            entry = self._latest.get(template_id)
+            if entry is not None and entry[0] > time.monotonic():
+                version = entry[1]
+        if version is not None:
+            compiled = self._compiled.get((template_id, version))
+            if compiled is not None:
+                self._compiled.move_to_end((template_id, version))
+                return compiled
+        row = await TemplateRepo.get(db, template_id, version)
+        if row is None:
+            return None
+        compiled = self.add(row)
+        if version is None:
+            self._latest[template_id] = (time.monotonic() + self.latest_ttl, row.version)
+        return compiled
+
+    def add(self, row) -> CompiledTemplate:
+        compiled = CompiledTemplate(row.template_id, row.version, row.channel, row.body, row.subject)
+        self._compiled[(row.template_id, row.version)] = compiled
+        self._compiled.move_to_end((row.template_id, row.version))
+        while len(self._compiled) > self.max_entries:
+            self._compiled.popitem(last=False)
+        return compiled
+
+    def forget_latest(self, template_id: str):
+        self._latest.pop(template_id, None)
+
+_registry = None
+
+def get_template_registry() -> TemplateRegistry:
+    global _registry
+    if _registry is None:
+        _registry = TemplateRegistry()
+    return _registry
+
+def reset_template_registry():
+    global _registry
+    _registry = None
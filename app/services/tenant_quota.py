@@ -0,0 +1,137 @@
+# Inbound rate limiting per tenant (JWT subject)
+#
+# A sliding-window counter shared by all API processes through Redis: the
+# previous fixed window is weighted by how much of it still overlaps the
+# sliding window. Each process leases quota units in blocks so most requests
+# are admitted locally without a Redis round trip; unused units expire after
+# a short TTL. A request can cost many units (one per notification in a batch).
+
+import math
+import time
+from typing import Dict, Optional, Tuple
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Grants up to ARGV[4] units, or nothing when fewer than ARGV[5] are left.
+# Returns {granted, units still available}
+_TAKE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local weight = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local minimum = tonumber(ARGV[5])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local available = math.floor(limit - previous * weight - current)
+local granted = math.min(requested, available)
+if granted < minimum then
+    return {0, available}
+end
+redis.call('INCRBY', KEYS[1], granted)
+redis.call('EXPIRE', KEYS[1], window * 2)
+return {granted, available - granted}
+"""
+
+def _window(window_s: int) -> Tuple[int, float]:
+    # (current window index, weight of the previous window)
+    now = time.time()
+    index = int(now // window_s)
+    return index, 1 - (now - index * window_s) / window_s
+
+class LocalSlidingWindow:
+    # Single-process stand-in for RedisSlidingWindow
+    def __init__(self):
+        self._counts: Dict[tuple, int] = {}
+
+    async def take(self, tenant: str, limit: int, window_s: int, requested: int, minimum: int) -> int:
+        index, weight = _window(window_s)
+        current = self._counts.get((tenant, index), 0)
+        previous = self._counts.get((tenant, index - 1), 0)
+        granted = min(requested, math.floor(limit - previous * weight - current))
+        if granted < minimum:
+            return 0
+        for key in [key for key in self._counts if key[0] == tenant and key[1] < index - 1]:
+            del self._counts[key]
+        self._counts[(tenant, index)] = current + granted
+        return granted
+
+class RedisSlidingWindow:
+    def __init__(self, redis):
+        self._redis = redis
+        self._script = redis.register_script(_TAKE_SCRIPT)
+
+    async def take(self, tenant: str, limit: int, window_s: int, requested: int, minimum: int) -> int:
+        index, weight = _window(window_s)
+        granted, _ = await self._script(
+            keys=[f"quota:{tenant}:{index}", f"quota:{tenant}:{index - 1}"],
+            args=[limit, window_s, weight, requested, minimum],
+        )
+        return int(granted)
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+class TenantRateLimiter:
+    def __init__(self, store, window_s: int = None, lease_size: int = None, lease_ttl_s: float = None):
+        self.window = settings.TENANT_RATE_LIMIT_WINDOW_S if window_s is None else window_s
+        self.lease_size = settings.TENANT_RATE_LIMIT_LEASE_SIZE if lease_size is None else lease_size
+        self.lease_ttl = settings.TENANT_RATE_LIMIT_LEASE_TTL_S if lease_ttl_s is None else lease_ttl_s
+        self._store = store
+        self._leases = {}  # tenant -> (units, leased_at)
+
+    def limit_for(self, tenant: str) -> int:
+        return settings.TENANT_RATE_LIMITS.get(tenant, settings.TENANT_RATE_LIMIT_DEFAULT)
+
+    def _put_back(self, tenant: str, units: int, leased_at: float):
+        # Other requests for the tenant may have leased units while this one
+        # awaited Redis; add to their lease rather than replacing it
+        current, current_at = self._leases.get(tenant, (0, 0.0))
+        if time.monotonic() - current_at >= self.lease_ttl:
+            current = 0
+        if current + units:
+            self._leases[tenant] = (current + units, max(leased_at, current_at))
+
+    async def check(self, tenant: str, units: int = 1) -> Optional[float]:
+        # None when admitted, otherwise seconds to wait before retrying
+        held, leased_at = self._leases.pop(tenant, (0, 0.0))
+        if time.monotonic() - leased_at >= self.lease_ttl:
+            held = 0
+        if held >= units:
+            self._leases[tenant] = (held - units, leased_at)
+            return None
+        need = units - held
+        try:
+            granted = await self._store.take(
+                tenant, self.limit_for(tenant), self.window, max(need, self.lease_size), need
+            )
+        except Exception as e:
+            # Fail open: a limiter outage must not stop notifications
+            logger.warning("Tenant rate limit check failed, admitting request: %s", e)
+            self._put_back(tenant, held, leased_at)
+            return None
+        if not granted:
+            self._put_back(tenant, held, leased_at)
+            _, weight = _window(self.window)
+            return max(weight * self.window, 1.0)
+        self._put_back(tenant, held + granted - units, time.monotonic())
+        return None
+
+    async def aclose(self):
+        if hasattr(self._store, "aclose"):
+            await self._store.aclose()
+
+_limiter = None
+
+def get_tenant_rate_limiter() -> TenantRateLimiter:
+    global _limiter
+    if _limiter is None:
+        if settings.RATE_LIMIT_BACKEND == "local":
+            store = LocalSlidingWindow()
+        else:
+            import redis.asyncio as aioredis
+
+            store = RedisSlidingWindow(aioredis.from_url(settings.REDIS_URL))
+        _limiter = TenantRateLimiter(store)
+    return _limiter
@@ -0,0 +1,170 @@
+# Bulk provider webhook ingestion
+#
+# Provider callbacks are verified against the provider's signature, parsed
+# from their native shapes, acknowledged immediately and staged in a bounded in-process queue. A background consumer
+# drains the queue in batches, keeps the latest event per notification and
+# hands the result to the status write-behind buffer, which never moves a
+# status backwards. On close the consumer finishes its batch and the rest of
+# the queue is drained.
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from app.core.config import settings
+from app.metrics.prometheus import webhook_queue_depth
+from app.repositories.status_buffer import get_status_buffer
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Provider event name -> notification status; unlisted events are ignored
+SENDGRID_STATUSES = {
+    "delivered": "delivered",
+    "bounce": "bounced",
+    "dropped": "failed",
+    "spamreport": "spam",
+    "open": "opened",
+    "click": "clicked",
+}
+TWILIO_STATUSES = {
+    "sent": "sent",
+    "delivered": "delivered",
+    "undelivered": "failed",
+    "failed": "failed",
+}
+
+class StatusEvent(NamedTuple):
+    notification_id: str
+    status: str
+    timestamp: float = 0
+
+def parse_sendgrid_events(events: List[dict]) -> List[StatusEvent]:
+    parsed = []
+    for event in events:
+        status = SENDGRID_STATUSES.get(event.get("event"))
+        # custom_args from the send are flattened into each event
+        notification_id = event.get("notification_id")
+        if status and notification_id:
+            parsed.append(StatusEvent(notification_id, status, float(event.get("timestamp") or 0)))
+    return parsed
+
+def parse_twilio_callback(form: dict, notification_id: Optional[str]) -> List[StatusEvent]:
+    status = TWILIO_STATUSES.get(form.get("MessageStatus") or form.get("SmsStatus"))
+    if status and notification_id:
+        return [StatusEvent(notification_id, status)]
+    return []
+
+@lru_cache(maxsize=4)
+def _load_public_key(public_key: str):
+    return serialization.load_der_public_key(base64.b64decode(public_key))
+
+def verify_sendgrid_signature(public_key: str, payload: bytes, signature: str, timestamp: str, max_age_s: int = None) -> bool:
+    # Signed Event Webhook: ECDSA P-256 / SHA-256 over the timestamp header
+    # followed by the raw request body
+    max_age_s = settings.WEBHOOK_SIGNATURE_MAX_AGE_S if max_age_s is None else max_age_s
+    if not (public_key and signature and timestamp):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > max_age_s:
+            return False
+        _load_public_key(public_key).verify(
+            base64.b64decode(signature), timestamp.encode() + payload, ec.ECDSA(hashes.SHA256())
+        )
+    except (InvalidSignature, ValueError, TypeError):
+        return False
+    return True
+
+def twilio_signature(auth_token: str, url: str, params: dict) -> str:
+    # HMAC-SHA1 of the full callback URL followed by the sorted POST params
+    data = url + "".join(f"{key}{params[key]}" for key in sorted(params))
+    return base64.b64encode(hmac.new(auth_token.encode(), data.encode(), hashlib.sha1).digest()).decode()
+
+def verify_twilio_signature(auth_tokens: Iterable[str], url: str, params: dict, signature: Optional[str]) -> bool:
+    # Any configured account may have sent the message (see FailoverClient)
+    if not signature:
+        return False
+    return any(
+        hmac.compare_digest(twilio_signature(token, url, params), signature) for token in auth_tokens if token
+    )
+
+class WebhookQueue:
+    def __init__(self, max_size: int = None, batch_size: int = None, buffer_factory=get_status_buffer):
+        self.batch_size = settings.WEBHOOK_BATCH_SIZE if batch_size is None else batch_size
+        self._queue = asyncio.Queue(settings.WEBHOOK_QUEUE_MAX_SIZE if max_size is None else max_size)
+        self._buffer_factory = buffer_factory
+        self._consumer = None
+        self._applying = False  # the consumer holds a dequeued batch
+        self._stopping = False
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def put_many(self, events: List[StatusEvent]) -> bool:
+        # Never blocks the request; False means the queue is full and the
+        # provider should retry the delivery later
+        if self._queue.maxsize and self._queue.qsize() + len(events) > self._queue.maxsize:
+            return False
+        for event in events:
+            self._queue.put_nowait(event)
+        webhook_queue_depth.inc(len(events))
+        if self._consumer is None:
+            self._consumer = asyncio.ensure_future(self._consume())
+        return True
+
+    async def _consume(self):
+        while not self._stopping:
+            batch = [await self._queue.get()]
+            self._applying = True
+            try:
+                await self._apply(batch)
+            except Exception as e:
+                logger.error("Error applying webhook batch: %s", e)
+            finally:
+                self._applying = False
+
+    async def _apply(self, batch: List[StatusEvent]):
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        webhook_queue_depth.dec(len(batch))
+        latest = {}
+        for event in batch:
+            current = latest.get(event.notification_id)
+            if current is None or event.timestamp >= current.timestamp:
+                latest[event.notification_id] = event
+        buffer = self._buffer_factory()
+        for event in latest.values():
+            await buffer.add(event.notification_id, event.status)
+        logger.debug("Applied %s webhook updates from %s events", len(latest), len(batch))
+
+    async def drain(self):
+        while not self._queue.empty():
+            await self._apply([self._queue.get_nowait()])
+
+    async def close(self):
+        consumer, self._consumer = self._consumer, None
+        if consumer is not None:
+            self._stopping = True
+            if not self._applying:
+                consumer.cancel()  # blocked in get(), nothing dequeued yet
+            try:
+                # A consumer holding a batch applies it, then sees _stopping and returns
+                await consumer
+            except asyncio.CancelledError:
+                pass
+            self._stopping = False
+        await self.drain()
+
+_queue = None
+
+def get_webhook_queue() -> WebhookQueue:
+    global _queue
+    if _queue is None:
+        _queue = WebhookQueue()
+    return _queue
@@ -1,7 +1,9 @@
 # Sets up the app with broker and backend.
 
 from celery import Celery
+from kombu import Queue
 from app.core.config import settings
+import app.workers.instrumentation  # noqa: F401  registers the metrics signal handlers
 
 celery_app = Celery(
     "notification_workers",
@@ -13,4 +15,49 @@ celery_app = Celery(
 # Configure retries with exponential backoff
 celery_app.conf.task_default_retry_delay = 10
 celery_app.conf.task_max_retries = 3
-celery_app.conf.task_retry_backoff = True
\ No newline at end of file
+celery_app.conf.task_retry_backoff = True
+
+# Asyncio execution mode: a thread pool feeds one event loop per process
+# (see app.workers.runtime), so many sends are in flight per worker process
+celery_app.conf.worker_pool = settings.CELERY_WORKER_POOL
+celery_app.conf.worker_concurrency = settings.CELERY_WORKER_CONCURRENCY
+
+# Publisher confirms for tasks sent from workers; the outbox relay commits
+# each batch in an AMQP transaction instead (see app.workers.outbox_relay)
+celery_app.conf.broker_transport_options = {"confirm_publish": settings.CELERY_CONFIRM_PUBLISH}
+
+# Queue per channel and priority, so bulk sends never sit in front of
+# transactional ones: "email.transactional", "push.bulk", ...
+CHANNELS = ("email", "sms", "push")
+PRIORITIES = ("transactional", "bulk")
+DEFAULT_PRIORITY = "transactional"
+QUEUES = [f"{channel}.{priority}" for channel in CHANNELS for priority in PRIORITIES]
+
+# Worker pool settings per priority tier (see app.workers.worker)
+QUEUE_PROFILES = {
+    "transactional": {
+        "concurrency": settings.CELERY_TRANSACTIONAL_CONCURRENCY,
+        "prefetch_multiplier": settings.CELERY_TRANSACTIONAL_PREFETCH,
+        "time_limit": settings.CELERY_TRANSACTIONAL_TIME_LIMIT_S,
+    },
+    "bulk": {
+        "concurrency": settings.CELERY_BULK_CONCURRENCY,
+        "prefetch_multiplier": settings.CELERY_BULK_PREFETCH,
+        "time_limit": settings.CELERY_BULK_TIME_LIMIT_S,
+    },
+}
+
+def queue_for(channel: str, priority: str = None) -> str:
+    return f"{channel}.{priority or DEFAULT_PRIORITY}"
+
+def route_notification(name, args, kwargs, options, task=None, **kw):
+    # Applies to send_task from the outbox relay and to retries alike
+    if name != "app.workers.tasks.send_notification" or not args:
+        return None
+    data = args[0]
+    if data.get("channel") not in CHANNELS:
+        return None
+    return {"queue": queue_for(data["channel"], data.get("priority"))}
+
+celery_app.conf.task_queues = [Queue("celery")] + [Queue(name) for name in QUEUES]
+celery_app.conf.task_routes = (route_notification,)
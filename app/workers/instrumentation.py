@@ -0,0 +1,34 @@
+# Celery metrics: broker wait time and the worker's Prometheus exporter.
+
+import os
+import time
+from celery.signals import before_task_publish, task_prerun, worker_init, worker_process_shutdown
+from app.core.config import settings
+from app.metrics.prometheus import mark_process_dead, start_metrics_server, task_queue_wait
+import logging
+
+logger = logging.getLogger(__name__)
+
+@before_task_publish.connect
+def _stamp_published_at(headers=None, **kwargs):
+    # Retries republish the task, so the wait is measured per delivery
+    if headers is not None:
+        headers["published_at"] = time.time()
+
+@task_prerun.connect
+def _observe_queue_wait(task=None, **kwargs):
+    published_at = getattr(task.request, "published_at", None)
+    if published_at is None:
+        return
+    queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+    task_queue_wait.labels(queue=queue).observe(max(time.time() - published_at, 0))
+
+@worker_init.connect
+def _start_exporter(**kwargs):
+    if settings.CELERY_METRICS_PORT:
+        start_metrics_server(settings.CELERY_METRICS_PORT)
+        logger.info("Serving worker metrics on port %s", settings.CELERY_METRICS_PORT)
+
+@worker_process_shutdown.connect
+def _mark_dead(**kwargs):
+    mark_process_dead(os.getpid())
@@ -0,0 +1,71 @@
+# Relays committed outbox messages to the Celery broker.
+#
+# Run one or more relays with `python -m app.workers.outbox_relay`. Each
+# claims the oldest messages with FOR UPDATE SKIP LOCKED, publishes them over
+# one producer connection and deletes them in the same transaction, so
+# replicas never publish the same batch. Delivery is at-least-once: rows are
+# deleted only after the whole batch is published, so a crash or a database
+# error after publishing republishes the batch. send_notification skips
+# notifications whose status already moved past pending.
+
+import asyncio
+from typing import List
+from app.core.config import settings
+from app.core.logging import setup_logging
+from app.db.session import SessionLocal, engine
+from app.metrics.prometheus import outbox_relay_batch_size
+from app.models.outbox import OutboxMessage
+from app.repositories.outbox_repo import OutboxRepo
+from app.workers.celery_app import celery_app
+import logging
+
+logger = logging.getLogger(__name__)
+
+def publish_batch(messages: List[OutboxMessage]):
+    # Publisher confirms wait for the broker after every message. On AMQP the
+    # batch is published in one transaction instead: one round trip for the
+    # commit, and a failure part-way enqueues none of it
+    with celery_app.connection_for_write(transport_options={"confirm_publish": False}) as connection:
+        channel = connection.default_channel
+        transactional = settings.CELERY_CONFIRM_PUBLISH and hasattr(channel, "tx_select")
+        if transactional:
+            channel.tx_select()
+        producer = celery_app.amqp.Producer(channel)
+        for message in messages:
+            celery_app.send_task(message.task_name, args=(message.payload,), producer=producer)
+        if transactional:
+            channel.tx_commit()
+
+async def relay_once(session_factory=SessionLocal, publish=publish_batch, batch_size: int = None) -> int:
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    async with session_factory() as db:
+        messages = await OutboxRepo.claim_batch(db, batch_size)
+        if not messages:
+            await db.rollback()
+            return 0
+        # Publishing blocks on the broker, keep it off the event loop
+        await asyncio.to_thread(publish, messages)
+        await OutboxRepo.delete_many(db, [message.id for message in messages])
+        await db.commit()
+    outbox_relay_batch_size.observe(len(messages))
+    logger.info("Relayed %s outbox messages", len(messages))
+    return len(messages)
+
+async def run_relay():
+    logger.info("Starting outbox relay...")
+    try:
+        while True:
+            try:
+                relayed = await relay_once()
+            except Exception as e:
+                logger.error("Outbox relay batch failed: %s", e)
+                relayed = 0
+            # Keep draining while batches come back full
+            if relayed < settings.OUTBOX_RELAY_BATCH_SIZE:
+                await asyncio.sleep(settings.OUTBOX_RELAY_POLL_INTERVAL_MS / 1000)
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(run_relay())
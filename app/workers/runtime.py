@@ -0,0 +1,82 @@
+# Per-process asyncio runtime for Celery workers.
+#
+# Celery cannot await coroutine tasks, so each worker process owns one
+# long-lived event loop running in a background thread. Task threads submit
+# coroutines to it and block on the result, which keeps Celery's retry and
+# ack semantics while many sends share the loop and the SessionLocal pool.
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from app.db.session import engine
+from app.repositories.stats_repo import get_stats_buffer, reset_stats_buffer
+from app.repositories.status_buffer import get_status_buffer, reset_status_buffer
+from app.repositories.report_cache import get_report_cache, reset_report_cache
+from app.services.clients import close_clients, reset_clients
+from app.services.email import get_email_batcher
+from app.services.push import get_push_batcher
+from app.services.rate_limit import close_rate_limiters, reset_rate_limiters
+from app.services.circuit_breaker import reset_circuit_breakers
+import logging
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_pid = None
+_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_pid
+    with _lock:
+        # A forked child inherits the parent's loop object but not its thread
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            thread = threading.Thread(target=_loop.run_forever, name="worker-event-loop", daemon=True)
+            thread.start()
+            logger.info("Started worker event loop in process %s", _loop_pid)
+        return _loop
+
+def run_coroutine(coro, timeout: float = None):
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Don't leave the send running on the loop after the caller gave up
+        future.cancel()
+        raise
+
+@worker_process_init.connect
+def _reset_inherited_pool(**kwargs):
+    # Connections opened in the parent must not be reused after fork
+    engine.sync_engine.dispose(close=False)
+    reset_clients()
+    reset_rate_limiters()
+    reset_circuit_breakers()
+    reset_status_buffer()
+    reset_stats_buffer()
+    reset_report_cache()
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def shutdown_loop(**kwargs):
+    global _loop
+    if _loop is None or _loop_pid != os.getpid():
+        return
+    try:
+        run_coroutine(get_email_batcher().flush_all(), timeout=30)
+        run_coroutine(get_push_batcher().flush_all(), timeout=30)
+        run_coroutine(close_clients(), timeout=10)
+        run_coroutine(close_rate_limiters(), timeout=10)
+        # Flush buffered status updates before the pool goes away
+        run_coroutine(get_status_buffer().close(), timeout=30)
+        run_coroutine(get_stats_buffer().close(), timeout=30)
+        run_coroutine(get_report_cache().aclose(), timeout=10)
+        run_coroutine(engine.dispose(), timeout=10)
+    except Exception as e:
+        logger.error("Error releasing worker resources on shutdown: %s", e)
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop = None
+    logger.info("Stopped worker event loop in process %s", os.getpid())
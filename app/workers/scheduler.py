@@ -0,0 +1,60 @@
+# Releases scheduled notifications once their send_at has passed.
+#
+# Run one or more schedulers with `python -m app.workers.scheduler`. Each
+# claims due rows in send_at order with FOR UPDATE SKIP LOCKED, marks them
+# pending and stages their send_notification messages in the outbox in the
+# same transaction, so replicas never release the same row twice and the
+# outbox relay publishes them like any other notification. Scheduled rows
+# stay in Postgres until due instead of being held as broker ETA tasks.
+
+import asyncio
+from datetime import datetime
+from app.core.config import settings
+from app.core.logging import setup_logging
+from app.db.session import SessionLocal, engine
+from app.metrics.prometheus import scheduler_batch_size, scheduler_lag
+from app.repositories.notification_repo import NotificationRepo
+from app.repositories.report_cache import get_report_cache
+from app.repositories.stats_repo import get_stats_buffer
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def schedule_once(session_factory=SessionLocal, batch_size: int = None) -> int:
+    batch_size = batch_size or settings.SCHEDULER_BATCH_SIZE
+    async with session_factory() as db:
+        due = await NotificationRepo.release_due(db, batch_size)
+        if not due:
+            await db.rollback()
+            return 0
+        now = datetime.utcnow()
+        lags = [(now - notification.send_at).total_seconds() for notification in due]
+        notification_ids = [notification.notification_id for notification in due]
+        await db.commit()
+    scheduler_batch_size.observe(len(due))
+    for lag in lags:
+        scheduler_lag.observe(lag)
+    await get_report_cache().invalidate(notification_ids)
+    logger.info("Released %s scheduled notifications", len(due))
+    return len(due)
+
+async def run_scheduler():
+    logger.info("Starting notification scheduler...")
+    try:
+        while True:
+            try:
+                released = await schedule_once()
+            except Exception as e:
+                logger.error("Scheduler batch failed: %s", e)
+                released = 0
+            # Keep draining while batches come back full
+            if released < settings.SCHEDULER_BATCH_SIZE:
+                await asyncio.sleep(settings.SCHEDULER_POLL_INTERVAL_MS / 1000)
+    finally:
+        await get_stats_buffer().close()
+        await get_report_cache().aclose()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(run_scheduler())
@@ -1,42 +1,97 @@
 # Asynchronous notification sending with retries.
 
-from app.workers.celery_app import celery_app
+from app.workers.celery_app import DEFAULT_PRIORITY, QUEUE_PROFILES, celery_app
+from app.workers.runtime import run_coroutine
 from app.services.email import send_email
 from app.services.sms import send_sms
 from app.services.push import send_push
+from app.services.circuit_breaker import CircuitOpen
+from app.services.rate_limit import RateLimited
+from app.services.templates import TemplateError, get_template_registry
 from app.db.session import SessionLocal
 from app.repositories.notification_repo import NotificationRepo
+from app.repositories.status_buffer import get_status_buffer
+from app.metrics.prometheus import notification_failed, notification_retries, notification_sent
 import logging
 
 logger = logging.getLogger(__name__)
 
 @celery_app.task(bind=True, max_retries=3)
-async def send_notification(self, notification_data: dict):
+def send_notification(self, notification_data: dict):
+    # Runs on the worker's shared event loop; retry must be raised from the task thread
+    profile = QUEUE_PROFILES[notification_data.get("priority") or DEFAULT_PRIORITY]
+    try:
+        return run_coroutine(_send_notification(notification_data), timeout=profile["time_limit"])
+    except RateLimited as exc:
+        # Throttled or circuit open before sending: reschedule without spending a retry
+        logger.warning("Rescheduling notification %s: %s", notification_data['notification_id'], exc)
+        reason = "circuit_open" if isinstance(exc, CircuitOpen) else "throttled"
+        notification_retries.labels(channel=notification_data["channel"], reason=reason).inc()
+        self.apply_async((notification_data,), countdown=exc.retry_after, retries=self.request.retries)
+        return False
+    except Exception as exc:
+        notification_retries.labels(channel=notification_data["channel"], reason="error").inc()
+        raise self.retry(exc=exc)  # Retry with backoff
+
+async def render(notification_data: dict):
+    # (subject, content); templated notifications are rendered from the cached compiled version
+    if not notification_data.get("template_id"):
+        return None, notification_data["content"]
+    async with SessionLocal() as db:
+        template = await get_template_registry().get(
+            db, notification_data["template_id"], notification_data.get("template_version")
+        )
+    if template is None:
+        raise TemplateError(f"Unknown template {notification_data['template_id']}")
+    return template.render(notification_data.get("variables") or {})
+
+async def already_sent(notification_id: str) -> bool:
+    # The outbox relay is at-least-once: a redelivered message whose send
+    # already went through (buffered here or flushed) must not send again
+    status = get_status_buffer().status(notification_id)
+    if status is None:
+        async with SessionLocal() as db:
+            status = await NotificationRepo.get_status(db, notification_id)
+    return status not in (None, "pending")
+
+async def _send_notification(notification_data: dict):
     channel = notification_data["channel"]
     recipient = notification_data["recipient"]
-    content = notification_data["content"]
-    event_type = notification_data["event_type"]
+    notification_id = notification_data["notification_id"]
     
     success = False
-    async with SessionLocal() as db:
-        try:
-            if channel == "email":
-                success = await send_email(recipient, content)
-            elif channel == "sms":
-                success = await send_sms(recipient, content)
-            elif channel == "push":
-                success = await send_push(recipient, content)
-            else:
-                raise ValueError("Invalid channel")
-            
-            status = "sent" if success else "failed"
-            await NotificationRepo.update_status(db, event_type, status)
-            logger.info(f"Notification {event_type} {status}")
-        except Exception as exc:
-            logger.error(f"Task failed: {str(exc)}")
-            # Update attempts
-            report = await NotificationRepo.get_by_event_id(db, event_type)
-            if report:
-                report.attempts += 1
-                await db.commit()
-            raise self.retry(exc=exc)  # Retry with backoff
\ No newline at end of file
+    # Status and attempt changes are written behind in bulk
+    buffer = get_status_buffer()
+    if await already_sent(notification_id):
+        logger.info("Notification %s already processed, skipping duplicate", notification_id)
+        return None
+    try:
+        subject, content = await render(notification_data)
+    except TemplateError as exc:
+        # Retrying cannot fix a template error
+        logger.error("Notification %s could not be rendered: %s", notification_id, exc)
+        notification_failed.labels(channel=channel).inc()
+        await buffer.add(notification_id, "failed", attempts=1)
+        return False
+    try:
+        if channel == "email":
+            success = await send_email(recipient, content, notification_id=notification_id, subject=subject)
+        elif channel == "sms":
+            success = await send_sms(recipient, content, notification_id=notification_id)
+        elif channel == "push":
+            success = await send_push(recipient, content, title=subject)
+        else:
+            raise ValueError("Invalid channel")
+        
+        status = "sent" if success else "failed"
+        (notification_sent if success else notification_failed).labels(channel=channel).inc()
+        await buffer.add(notification_id, status, attempts=1)
+        logger.info("Notification %s %s", notification_id, status)
+        return success
+    except RateLimited:
+        raise
+    except Exception as exc:
+        logger.error("Task failed: %s", exc)
+        # Update attempts
+        await buffer.add(notification_id, attempts=1)
+        raise
@@ -0,0 +1,54 @@
+# Starts a Celery worker pool dedicated to selected notification queues.
+#
+#   python -m app.workers.worker transactional
+#   python -m app.workers.worker email.bulk push.bulk
+#
+# Arguments are queue names or priority tiers (all channels of that tier).
+# Concurrency, prefetch and the per-send deadline come from the tier's
+# profile, so transactional and bulk traffic run in separate pools.
+
+import argparse
+from typing import List
+from app.core.logging import setup_logging
+from app.core.config import settings
+from app.workers.celery_app import PRIORITIES, QUEUE_PROFILES, QUEUES, celery_app
+
+def resolve_queues(selected: List[str]) -> List[str]:
+    queues = []
+    for name in selected:
+        if name in PRIORITIES:
+            queues.extend(queue for queue in QUEUES if queue.endswith(f".{name}"))
+        elif name in QUEUES:
+            queues.append(name)
+        else:
+            raise ValueError(f"Unknown queue or priority: {name}")
+    return list(dict.fromkeys(queues))
+
+def worker_argv(queues: List[str], loglevel: str = "info") -> List[str]:
+    tiers = {queue.split(".", 1)[1] for queue in queues}
+    if len(tiers) != 1:
+        raise ValueError("A worker pool serves a single priority tier")
+    profile = QUEUE_PROFILES[tiers.pop()]
+    return [
+        "worker",
+        f"--queues={','.join(queues)}",
+        f"--pool={settings.CELERY_WORKER_POOL}",
+        f"--concurrency={profile['concurrency']}",
+        f"--prefetch-multiplier={profile['prefetch_multiplier']}",
+        f"--loglevel={loglevel}",
+    ]
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run a notification worker pool")
+    parser.add_argument("queues", nargs="+", help=f"Queues ({', '.join(QUEUES)}) or tiers ({', '.join(PRIORITIES)})")
+    parser.add_argument("--loglevel", default="info")
+    options = parser.parse_args(args)
+    try:
+        argv = worker_argv(resolve_queues(options.queues), options.loglevel)
+    except ValueError as e:
+        parser.error(str(e))
+    setup_logging()
+    celery_app.worker_main(argv)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# End-to-end throughput and latency benchmark.
+#
+#   python -m benchmarks.run --notifications 5000 --latency-ms 20 --output bench_results.json
+#
+# Runs the API (in-process over ASGI), the outbox relay and the send path of
+# the workers against local stub providers, on one box with no external
+# services: SQLite by default, the local rate-limiter backends, and workers
+# driven by the relay directly instead of a broker. Any setting can still be
+# overridden through the environment, e.g. EMAIL_BATCH_WINDOW_MS=0.
+#
+# Reports trigger ingest rate, enqueue-to-delivered latency percentiles and
+# SQL statements per notification as JSON.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from benchmarks.stubs import StubProviders
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Notification service end-to-end benchmark")
+    parser.add_argument("--notifications", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=0, help="Use /trigger/batch with this many per request; 0 uses /trigger")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent API clients")
+    parser.add_argument("--workers", type=int, default=64, help="Concurrent sends, like CELERY_WORKER_CONCURRENCY")
+    parser.add_argument("--channels", default="email,sms,push")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mean injected provider latency")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency standard deviation as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of provider calls answered with 503")
+    parser.add_argument("--database-url", default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Give up waiting for deliveries after this many seconds")
+    parser.add_argument("--output", default="bench_results.json")
+    return parser.parse_args(args)
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+
+    return {
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(values[-1] * 1000, 3),
+        "mean": round(sum(values) / len(values) * 1000, 3),
+    }
+
+def _write_firebase_credentials(path: str):
+    # firebase_admin validates a service account at import; the key is never used
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    with open(path, "w") as f:
+        json.dump({
+            "type": "service_account",
+            "project_id": "bench",
+            "private_key_id": "bench",
+            "private_key": pem,
+            "client_email": "bench@bench.iam.gserviceaccount.com",
+            "client_id": "0",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }, f)
+
+def configure_environment(args, stub_url: str, workdir: str):
+    credentials_path = os.path.join(workdir, "firebase.json")
+    _write_firebase_credentials(credentials_path)
+    defaults = {
+        "DATABASE_URL": args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "RABBITMQ_BROKER_URL": "memory://",
+        "REDIS_URL": "redis://127.0.0.1:6379/0",
+        "SENDGRID_API_KEY": "bench",
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_PHONE_NUMBER": "+15550000000",
+        "TWILIO_STATUS_CALLBACK_URL": "http://bench/webhook/twilio",
+        "FIREBASE_CREDENTIALS_PATH": credentials_path,
+        "DEFAULT_FROM_EMAIL": "bench@example.com",
+        "SECRET_KEY": "bench",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": "",
+        "RATE_LIMIT_BACKEND": "local",
+        "TENANT_RATE_LIMIT_DEFAULT": str(10 ** 9),
+        "SENDGRID_RATE_LIMIT_PER_S": "0",
+        "TWILIO_RATE_LIMIT_PER_S": "0",
+        "FCM_RATE_LIMIT_PER_S": "0",
+        "CELERY_METRICS_PORT": "0",
+    }
+    if not args.database_url:
+        # SQLite allows one writer; a single connection queues writes instead of failing them
+        defaults.update({"DB_POOL_SIZE": "1", "DB_MAX_OVERFLOW": "0"})
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # Providers always point at the stubs
+    for name in ("SENDGRID_BASE_URL", "TWILIO_BASE_URL", "FCM_BASE_URL"):
+        os.environ[name] = stub_url
+
+def _payloads(args):
+    channels = args.channels.split(",")
+    recipients = {
+        "email": lambda i: f"user{i}@bench.test",
+        "sms": lambda i: f"+1555{i:07d}",
+        "push": lambda i: f"device-token-{i}",
+    }
+    for i in range(args.notifications):
+        channel = channels[i % len(channels)]
+        yield {
+            "event_type": "benchmark",
+            "channel": channel,
+            "recipient": recipients[channel](i),
+            "content": "Benchmark notification",
+        }
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+async def run(args) -> dict:
+    stubs = StubProviders(args.latency_ms, args.jitter, args.error_rate).start()
+    workdir = tempfile.mkdtemp(prefix="nsvc-bench-")
+    configure_environment(args, stubs.url, workdir)
+
+    # Imported after the environment is set: settings are read at import
+    import httpx
+    from jose import jwt
+    from sqlalchemy import event
+    from app.core.config import settings
+    from app.db.base import Base
+    from app.db.session import SessionLocal, engine
+    from app.main import app
+    from app.repositories.stats_repo import get_stats_buffer
+    from app.repositories.status_buffer import get_status_buffer
+    from app.services import clients
+    from app.services.email import get_email_batcher
+    from app.services.push import get_push_batcher
+    from app.workers.outbox_relay import relay_once
+    from app.workers.tasks import _send_notification
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    # Skip the Google OAuth exchange; the stub accepts any bearer token
+    clients._clients["firebase"] = clients.FirebaseClient(
+        "bench", lambda: ("bench-token", None), base_url=settings.FCM_BASE_URL
+    )
+
+    statements = Counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements[statement.lstrip().split(None, 1)[0].upper()] += 1
+
+    loop = asyncio.get_running_loop()
+    accepted, delivered = {}, {}
+    outcomes = Counter()
+    sends = asyncio.Semaphore(args.workers)
+    in_flight = set()
+    all_delivered = asyncio.Event()
+
+    async def work(payload):
+        async with sends:
+            try:
+                outcomes["sent" if await _send_notification(payload) else "failed"] += 1
+            except Exception:
+                outcomes["error"] += 1
+        delivered[payload["notification_id"]] = time.monotonic()
+        if len(delivered) >= args.notifications:
+            all_delivered.set()
+
+    def spawn(payload):
+        task = loop.create_task(work(payload))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    def publish(messages):
+        # Runs in the relay's publishing thread, like a broker publish
+        for message in messages:
+            loop.call_soon_threadsafe(spawn, message.payload)
+
+    async def relay():
+        while True:
+            relayed = await relay_once(SessionLocal, publish)
+            if relayed < settings.OUTBOX_RELAY_BATCH_SIZE:
+                await asyncio.sleep(settings.OUTBOX_RELAY_POLL_INTERVAL_MS / 1000)
+
+    token = jwt.encode({"sub": "benchmark"}, settings.SECRET_KEY, algorithm="HS256")
+    headers = {"Authorization": f"Bearer {token}"}
+    payloads = _payloads(args)
+    request_latencies = []
+    rejected = Counter()
+
+    async def client(http):
+        while True:
+            if args.batch_size:
+                chunk = list(itertools.islice(payloads, args.batch_size))
+                if not chunk:
+                    return
+                url, body = "/api/v1/notifications/trigger/batch", {"notifications": chunk}
+            else:
+                chunk = list(itertools.islice(payloads, 1))
+                if not chunk:
+                    return
+                url, body = "/api/v1/notifications/trigger", chunk[0]
+            start = time.monotonic()
+            response = await http.post(url, json=body, headers=headers)
+            now = time.monotonic()
+            request_latencies.append(now - start)
+            if response.status_code != 202:
+                rejected[response.status_code] += len(chunk)
+                continue
+            data = response.json()
+            for notification_id in data.get("notification_ids") or [data["notification_id"]]:
+                accepted[notification_id] = now
+
+    relay_task = asyncio.create_task(relay())
+    transport = httpx.ASGITransport(app=app)
+    started = time.monotonic()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        await asyncio.gather(*(client(http) for _ in range(args.clients)))
+    ingest_seconds = time.monotonic() - started
+
+    expected = len(accepted)
+    if expected < args.notifications:
+        args.notifications = expected  # rejected requests are never delivered
+        if len(delivered) >= expected:
+            all_delivered.set()
+    timed_out = False
+    try:
+        await asyncio.wait_for(all_delivered.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    delivery_seconds = time.monotonic() - started
+
+    relay_task.cancel()
+    await get_email_batcher().flush_all()
+    await get_push_batcher().flush_all()
+    if in_flight:
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    await get_status_buffer().close()
+    await get_stats_buffer().close()
+    await clients.close_clients()
+    await engine.dispose()
+    stubs.stop()
+
+    latencies = [delivered[nid] - accepted[nid] for nid in delivered if nid in accepted]
+    total_statements = sum(statements.values())
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "config": vars(args),
+        "ingest": {
+            "accepted": expected,
+            "rejected": dict(rejected),
+            "seconds": round(ingest_seconds, 3),
+            "notifications_per_s": round(expected / ingest_seconds, 1) if ingest_seconds else None,
+            "request_latency_ms": percentiles(request_latencies),
+        },
+        "delivery": {
+            "delivered": len(delivered),
+            "outcomes": dict(outcomes),
+            "timed_out": timed_out,
+            "seconds": round(delivery_seconds, 3),
+            "notifications_per_s": round(len(delivered) / delivery_seconds, 1) if delivery_seconds else None,
+            "enqueue_to_delivered_ms": percentiles(latencies),
+        },
+        "db": {
+            "statements": total_statements,
+            "per_notification": round(total_statements / expected, 3) if expected else None,
+            "by_kind": dict(statements),
+        },
+        "provider_calls": stubs.counts,
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    summary = {key: results[key] for key in ("ingest", "delivery", "db")}
+    json.dump(summary, sys.stdout, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
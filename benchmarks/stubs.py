@@ -0,0 +1,78 @@
+# Local stub SendGrid, Twilio and FCM endpoints for benchmarks.
+#
+# One threaded HTTP server answers all three providers' send endpoints with
+# their success shapes, after an injected latency and with an injected error
+# rate, and counts the calls per provider.
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _StubProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real providers
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        server = self.server
+        if server.latency:
+            time.sleep(max(random.gauss(server.latency, server.latency * server.jitter), 0))
+        if server.error_rate and random.random() < server.error_rate:
+            server.count("errors")
+            return self._reply(503, b"")
+
+        if self.path == "/v3/mail/send":
+            server.count("sendgrid")
+            self._reply(202, b"")
+        elif self.path.endswith("/Messages.json"):
+            server.count("twilio")
+            self._reply(201, json.dumps({"sid": "SM0"}).encode())
+        elif self.path.endswith("/messages:send"):
+            server.count("fcm")
+            self._reply(200, json.dumps({"name": "projects/bench/messages/0"}).encode())
+        else:
+            self._reply(404, b"")
+
+    def _reply(self, code, payload):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+class StubProviders:
+    def __init__(self, latency_ms: float = 0, jitter: float = 0.2, error_rate: float = 0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _StubProviderHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency_ms / 1000
+        self._server.jitter = jitter
+        self._server.error_rate = error_rate
+        self._server.counts = {}
+        lock = threading.Lock()
+
+        def count(name):
+            with lock:
+                self._server.counts[name] = self._server.counts.get(name, 0) + 1
+
+        self._server.count = count
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-providers", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def counts(self) -> dict:
+        return dict(self._server.counts)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -8,9 +8,12 @@ from jose import jwt
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+# Settings are read at import: log to stdout only, not to app.log in the repo
+os.environ["LOG_FILE"] = ""
+
 from app.core.config import settings
 from app.db.base import Base
-from app.db.session import get_db
+from app.db.session import get_db, get_session_factory
 from app.main import app
 from app.workers.celery_app import celery_app
 
@@ -47,11 +50,90 @@ def client_fixture(db_session: AsyncSession) -> Generator[TestClient, None, None
         yield db_session
 
     app.dependency_overrides[get_db] = get_test_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
 
 
+# Status write-behind buffer bound to the testing database
+@pytest.fixture
+def status_buffer(db_session, mocker):
+    from app.repositories.status_buffer import StatusUpdateBuffer
+
+    buffer = StatusUpdateBuffer(
+        session_factory = TestingSessionLocal, max_size = 1000, flush_interval_ms = 60_000
+    )
+    mocker.patch("app.api.v1.notifications.get_status_buffer", return_value = buffer)
+    mocker.patch("app.workers.tasks.get_status_buffer", return_value = buffer)
+    mocker.patch("app.workers.tasks.SessionLocal", TestingSessionLocal)
+    return buffer
+
+
+# Rollup deltas summed per test and written to the testing database on flush
+@pytest.fixture(autouse = True)
+def stats_buffer():
+    from app.repositories import stats_repo
+    from app.repositories.stats_repo import StatsBuffer, reset_stats_buffer
+
+    stats_repo._buffer = StatsBuffer(session_factory = TestingSessionLocal, flush_interval_ms = 60_000)
+    yield stats_repo._buffer
+    reset_stats_buffer()
+
+
+# Fresh report cache per test so cached reads don't leak between tests
+@pytest.fixture(autouse = True)
+def report_cache():
+    from app.repositories import report_cache
+    from app.repositories.report_cache import ReportCache, reset_report_cache
+
+    # Every status write in a test happens in this process, so the local tier
+    # is safe without the Redis invalidation channel
+    report_cache._cache = ReportCache()
+    yield report_cache._cache
+    reset_report_cache()
+
+
+# Fresh decompressed-body cache per test
+@pytest.fixture(autouse = True)
+def body_cache():
+    from app.repositories.body_store import get_body_cache, reset_body_cache
+
+    reset_body_cache()
+    yield get_body_cache()
+    reset_body_cache()
+
+
+# Fresh duplicate-send filter per test
+@pytest.fixture(autouse = True)
+def dedup_filter():
+    from app.repositories.dedup_filter import get_dedup_filter, reset_dedup_filter
+
+    reset_dedup_filter()
+    yield get_dedup_filter()
+    reset_dedup_filter()
+
+
+# Fresh compiled-template cache per test
+@pytest.fixture(autouse = True)
+def template_registry():
+    from app.services.templates import get_template_registry, reset_template_registry
+
+    reset_template_registry()
+    yield get_template_registry()
+    reset_template_registry()
+
+
+# Per-process tenant rate limiter so API tests don't need Redis
+@pytest.fixture(autouse = True)
+def tenant_rate_limiter(mocker):
+    from app.services.tenant_quota import LocalSlidingWindow, TenantRateLimiter
+
+    limiter = TenantRateLimiter(LocalSlidingWindow())
+    mocker.patch("app.api.v1.notifications.get_tenant_rate_limiter", return_value = limiter)
+    return limiter
+
+
 # JWT token for auth-protected endpoints
 @pytest.fixture
 def auth_token() -> str:
@@ -1,28 +1,53 @@
 import json
+from datetime import datetime, timedelta
 from http import HTTPStatus
 
 import pytest
 from fastapi import HTTPException
 
+from app.core.config import settings
 from app.schemas.notification import NotificationCreate
 from app.repositories.notification_repo import NotificationRepo
 from app.models.notifications import Notification
+from app.models.outbox import OutboxMessage
+from sqlalchemy import select
 
 
 # Trigger endpoint
-def test_trigger_notification_success(
-    client, auth_headers, notification_payload, mocker
+@pytest.mark.asyncio
+async def test_trigger_notification_success(
+    client, auth_headers, notification_payload, db_session
 ):
-    # Mock Celery delay so we don't need a real broker
-    mock_delay = mocker.patch("app.workers.tasks.send_notification.delay")
     response = client.post(
         "/api/v1/notifications/trigger",
         json=notification_payload,
         headers=auth_headers,
     )
     assert response.status_code == HTTPStatus.ACCEPTED
-    assert response.json() == {"message": "Notification queued"}
-    mock_delay.assert_called_once_with(notification_payload)
+    body = response.json()
+    assert body["message"] == "Notification queued"
+
+    # Task is staged in the outbox in the same transaction as the row
+    messages = (await db_session.execute(select(OutboxMessage))).scalars().all()
+    assert len(messages) == 1
+    assert messages[0].payload["notification_id"] == body["notification_id"]
+    assert messages[0].payload["recipient"] == notification_payload["recipient"]
+
+
+def test_trigger_records_db_time(client, auth_headers, notification_payload):
+    from prometheus_client import REGISTRY
+
+    def trigger_count():
+        return sum(
+            sample.value
+            for metric in REGISTRY.collect() if metric.name == "db_time_per_request_seconds"
+            for sample in metric.samples
+            if sample.name.endswith("_count") and sample.labels["route"].endswith("/notifications/trigger")
+        )
+
+    before = trigger_count()
+    client.post("/api/v1/notifications/trigger", json=notification_payload, headers=auth_headers)
+    assert trigger_count() == before + 1
 
 
 def test_trigger_missing_auth(client, notification_payload):
@@ -42,8 +67,8 @@ def test_trigger_invalid_channel(client, auth_headers, notification_payload):
 
 
 def test_trigger_rate_limit(client, auth_headers, notification_payload, mocker):
-    mocker.patch("app.workers.tasks.send_notification.delay")
-    # Send 11 requests – limiter is 10/minute
+    mocker.patch.dict(settings.TENANT_RATE_LIMITS, {"test-user": 10})
+    # Send 11 requests – test-user's quota is 10/minute
     for _ in range(10):
         r = client.post(
             "/api/v1/notifications/trigger",
@@ -59,6 +84,246 @@ def test_trigger_rate_limit(client, auth_headers, notification_payload, mocker):
     )
     assert r.status_code == HTTPStatus.TOO_MANY_REQUESTS
     assert "rate limit" in r.json()["detail"].lower()
+    assert int(r.headers["Retry-After"]) >= 1
+
+
+def test_trigger_batch_counts_each_notification(client, auth_headers, notification_payload, mocker):
+    mocker.patch.dict(settings.TENANT_RATE_LIMITS, {"test-user": 5})
+    batch = {"notifications": [notification_payload] * 4}
+    r = client.post("/api/v1/notifications/trigger/batch", json=batch, headers=auth_headers)
+    assert r.status_code == HTTPStatus.ACCEPTED
+    r = client.post("/api/v1/notifications/trigger/batch", json=batch, headers=auth_headers)
+    assert r.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    # One unit left for a single trigger
+    r = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=auth_headers)
+    assert r.status_code == HTTPStatus.ACCEPTED
+
+
+def test_trigger_batch_over_tenant_limit_rejected(client, auth_headers, notification_payload, mocker):
+    mocker.patch.dict(settings.TENANT_RATE_LIMITS, {"test-user": 3})
+    batch = {"notifications": [notification_payload] * 4}
+    r = client.post("/api/v1/notifications/trigger/batch", json=batch, headers=auth_headers)
+    assert r.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert "limit of 3" in r.json()["detail"]
+    assert "Retry-After" not in r.headers
+    # Nothing was charged against the quota
+    batch = {"notifications": [notification_payload] * 3}
+    r = client.post("/api/v1/notifications/trigger/batch", json=batch, headers=auth_headers)
+    assert r.status_code == HTTPStatus.ACCEPTED
+
+
+
+# Batch trigger endpoint
+@pytest.mark.asyncio
+async def test_trigger_batch_success(
+    client, auth_headers, notification_payload, db_session
+):
+    payload = {"notifications": [notification_payload] * 3}
+    response = client.post(
+        "/api/v1/notifications/trigger/batch", json=payload, headers=auth_headers
+    )
+    assert response.status_code == HTTPStatus.ACCEPTED
+    body = response.json()
+    assert body["count"] == 3
+
+    messages = (
+        await db_session.execute(select(OutboxMessage).order_by(OutboxMessage.id))
+    ).scalars().all()
+    assert [m.payload["notification_id"] for m in messages] == body["notification_ids"]
+    assert len(set(body["notification_ids"])) == 3
+
+
+@pytest.mark.asyncio
+async def test_trigger_idempotency_key_replays(
+    client, auth_headers, notification_payload, db_session
+):
+    headers = {**auth_headers, "Idempotency-Key": "order-42"}
+    first = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=headers)
+    second = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=headers)
+    assert first.status_code == second.status_code == HTTPStatus.ACCEPTED
+    assert second.json()["notification_id"] == first.json()["notification_id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+    messages = (await db_session.execute(select(OutboxMessage))).scalars().all()
+    assert len(messages) == 1
+
+
+@pytest.mark.asyncio
+async def test_trigger_retries_transient_lock_error(
+    client, auth_headers, notification_payload, db_session, mocker
+):
+    from sqlalchemy.exc import OperationalError
+    from app.repositories.notification_repo import NotificationRepo
+
+    create = NotificationRepo.create
+    calls = []
+
+    async def locked_once(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OperationalError("INSERT INTO notification_bodies", {}, Exception("database is locked"))
+        return await create(*args, **kwargs)
+
+    mocker.patch.object(NotificationRepo, "create", side_effect=locked_once)
+    response = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=auth_headers)
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert len(calls) == 2
+    assert len((await db_session.execute(select(Notification))).scalars().all()) == 1
+
+
+@pytest.mark.asyncio
+async def test_trigger_idempotency_key_falls_back_to_db(
+    client, auth_headers, notification_payload, db_session
+):
+    from app.repositories.dedup_filter import reset_dedup_filter
+
+    headers = {**auth_headers, "Idempotency-Key": "order-43"}
+    first = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=headers)
+    reset_dedup_filter()  # e.g. a request served by another API process
+    second = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=headers)
+    assert second.status_code == HTTPStatus.ACCEPTED
+    assert second.json()["notification_id"] == first.json()["notification_id"]
+
+    rows = (await db_session.execute(select(Notification))).scalars().all()
+    assert len(rows) == 1
+
+
+@pytest.mark.asyncio
+async def test_trigger_batch_idempotency_key_race(
+    client, auth_headers, notification_payload, db_session, mocker
+):
+    from app.repositories.dedup_filter import reset_dedup_filter
+
+    headers = {**auth_headers, "Idempotency-Key": "batch-7"}
+    payload = {"notifications": [notification_payload, {**notification_payload, "recipient": "b@example.com"}]}
+    first = client.post("/api/v1/notifications/trigger/batch", json=payload, headers=headers)
+    reset_dedup_filter()
+
+    # The first lookup misses, as if a concurrent request committed right after it
+    lookup = NotificationRepo.get_ids_by_dedup_keys
+    calls = []
+
+    async def racing_lookup(db, keys):
+        calls.append(keys)
+        return {} if len(calls) == 1 else await lookup(db, keys)
+
+    mocker.patch.object(NotificationRepo, "get_ids_by_dedup_keys", side_effect=racing_lookup)
+    second = client.post("/api/v1/notifications/trigger/batch", json=payload, headers=headers)
+    assert second.status_code == HTTPStatus.ACCEPTED
+    assert (second.json()["count"], second.json()["duplicates"]) == (0, 2)
+    assert second.json()["notification_ids"] == first.json()["notification_ids"]
+    assert len(calls) == 2
+
+    rows = (await db_session.execute(select(Notification))).scalars().all()
+    assert len(rows) == 2
+
+
+@pytest.mark.asyncio
+async def test_trigger_batch_suppresses_duplicates(
+    client, auth_headers, notification_payload, db_session, mocker
+):
+    mocker.patch.object(settings, "DEDUP_CONTENT_WINDOW_S", 60)
+    other = {**notification_payload, "recipient": "other@example.com"}
+    single = client.post("/api/v1/notifications/trigger", json=notification_payload, headers=auth_headers)
+
+    payload = {"notifications": [notification_payload, other, other]}
+    response = client.post("/api/v1/notifications/trigger/batch", json=payload, headers=auth_headers)
+    body = response.json()
+    assert body["count"] == 1
+    assert body["duplicates"] == 2
+    ids = body["notification_ids"]
+    assert ids[0] == single.json()["notification_id"]
+    assert ids[1] == ids[2] != ids[0]
+
+    messages = (await db_session.execute(select(OutboxMessage))).scalars().all()
+    assert len(messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_trigger_with_template(client, auth_headers, db_session):
+    template = {"template_id": "welcome", "channel": "email", "subject": "Hi {{ name }}", "body": "<p>{{ name }}</p>"}
+    response = client.post("/api/v1/templates", json=template, headers=auth_headers)
+    assert response.status_code == HTTPStatus.CREATED
+    assert response.json()["version"] == 1
+    assert client.post("/api/v1/templates", json=template, headers=auth_headers).json()["version"] == 2
+
+    payload = {
+        "event_type": "signup",
+        "channel": "email",
+        "recipient": "test@example.com",
+        "template_id": "welcome",
+        "variables": {"name": "Ann"},
+    }
+    response = client.post("/api/v1/notifications/trigger", json=payload, headers=auth_headers)
+    assert response.status_code == HTTPStatus.ACCEPTED
+
+    # Only the reference and variables travel through the outbox; the worker renders
+    message = (await db_session.execute(select(OutboxMessage))).scalars().one()
+    assert message.payload["content"] is None
+    assert message.payload["template_version"] == 2
+    assert message.payload["variables"] == {"name": "Ann"}
+
+
+def test_trigger_template_validation(client, auth_headers):
+    template = {"template_id": "sms_code", "channel": "sms", "body": "Code {{ code }}"}
+    client.post("/api/v1/templates", json=template, headers=auth_headers)
+    payload = {"event_type": "otp", "channel": "sms", "recipient": "+15550001111", "template_id": "sms_code"}
+
+    response = client.post("/api/v1/notifications/trigger", json=payload, headers=auth_headers)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert "code" in response.json()["detail"]
+
+    response = client.post(
+        "/api/v1/notifications/trigger", json={**payload, "template_id": "missing"}, headers=auth_headers
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    response = client.post(
+        "/api/v1/notifications/trigger", json={**payload, "content": "Code 1"}, headers=auth_headers
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_trigger_scheduled_notification(
+    client, auth_headers, notification_payload, db_session
+):
+    payload = {**notification_payload, "send_at": "2999-01-01T09:00:00+02:00"}
+    response = client.post("/api/v1/notifications/trigger", json=payload, headers=auth_headers)
+    assert response.status_code == HTTPStatus.ACCEPTED
+
+    report = client.get(
+        f"/api/v1/notifications/reports/{response.json()['notification_id']}", headers=auth_headers
+    ).json()
+    assert report["status"] == "scheduled"
+    assert report["send_at"] == "2999-01-01T07:00:00"
+    assert (await db_session.execute(select(OutboxMessage))).scalars().all() == []
+
+
+@pytest.mark.asyncio
+async def test_stats_reports_rollups(client, auth_headers, notification_payload, stats_buffer):
+    payload = {"notifications": [{**notification_payload, "event_type": "stats_api"}] * 2}
+    client.post("/api/v1/notifications/trigger/batch", json=payload, headers=auth_headers)
+    await stats_buffer.flush()
+
+    response = client.get(
+        "/api/v1/notifications/stats",
+        params={"bucket": "hour", "event_type": "stats_api"},
+        headers=auth_headers,
+    )
+    assert response.status_code == HTTPStatus.OK
+    stats = response.json()
+    assert [(s["event_type"], s["pending"], s["success_rate"]) for s in stats] == [("stats_api", 2, None)]
+
+
+def test_trigger_batch_empty(client, auth_headers):
+    response = client.post(
+        "/api/v1/notifications/trigger/batch",
+        json={"notifications": []},
+        headers=auth_headers,
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
 
 
 
@@ -66,7 +331,7 @@ def test_trigger_rate_limit(client, auth_headers, notification_payload, mocker):
 @pytest.mark.asyncio
 async def test_get_report_not_found(client, auth_headers, db_session):
     response = client.get(
-        "/api/v1/notifications/reports/unknown_event", headers=auth_headers
+        "/api/v1/notifications/reports/unknown-id", headers=auth_headers
     )
     assert response.status_code == HTTPStatus.NOT_FOUND
 
@@ -83,20 +348,124 @@ async def test_get_report_success(
     await db_session.refresh(notif)
 
     response = client.get(
-        f"/api/v1/notifications/reports/{notification_payload['event_type']}",
+        f"/api/v1/notifications/reports/{notif.notification_id}",
         headers=auth_headers,
     )
     assert response.status_code == HTTPStatus.OK
     data = response.json()
+    assert data["notification_id"] == notif.notification_id
     assert data["event_type"] == notification_payload["event_type"]
+    assert data["content"] == notification_payload["content"]
     assert data["status"] == "sent"
 
 
 
+@pytest.mark.asyncio
+async def test_get_report_cached_until_status_change(
+    client, auth_headers, notification_payload, db_session, status_buffer
+):
+    notif = Notification(**notification_payload, status="pending")
+    db_session.add(notif)
+    await db_session.commit()
+    url = f"/api/v1/notifications/reports/{notif.notification_id}"
+
+    assert client.get(url, headers=auth_headers).json()["status"] == "pending"
+
+    # A write that bypasses the status paths is not seen: served from cache
+    notif.status = "sent"
+    await db_session.commit()
+    assert client.get(url, headers=auth_headers).json()["status"] == "pending"
+
+    # Webhook status changes invalidate the entry on flush
+    client.post(
+        "/api/v1/notifications/webhook",
+        json={"notification_id": notif.notification_id, "status": "delivered"},
+    )
+    await status_buffer.flush()
+    db_session.expire_all()
+    assert client.get(url, headers=auth_headers).json()["status"] == "delivered"
+
+
+
+async def _insert_many(db_session, count, **overrides):
+    # Pairs of rows share a timestamp so the id tie-breaker is exercised
+    base = datetime(2026, 1, 1)
+    rows = [
+        Notification(
+            event_type=overrides.get("event_type", "listing"),
+            channel=overrides.get("channel", "email"),
+            recipient=f"user{i}@example.com",
+            content="Listing",
+            status=overrides.get("status", "sent"),
+            created_at=base + timedelta(minutes=i // 2),
+        )
+        for i in range(count)
+    ]
+    db_session.add_all(rows)
+    await db_session.commit()
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_list_reports_keyset_pagination(client, auth_headers, db_session):
+    rows = await _insert_many(db_session, 5)
+    await _insert_many(db_session, 2, channel="sms")
+
+    seen, cursor = [], None
+    for _ in range(10):
+        params = {"channel": "email", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/v1/notifications/reports", params=params, headers=auth_headers)
+        assert response.status_code == HTTPStatus.OK
+        page = response.json()
+        seen.extend(item["notification_id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    # Newest first, every email row exactly once
+    assert seen == [row.notification_id for row in reversed(rows)]
+
+
+def test_list_reports_invalid_cursor(client, auth_headers):
+    response = client.get(
+        "/api/v1/notifications/reports", params={"cursor": "not-a-cursor"}, headers=auth_headers
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_export_reports_ndjson_and_csv(client, auth_headers, db_session):
+    rows = await _insert_many(db_session, 3, status="failed")
+    await _insert_many(db_session, 1, status="sent")
+
+    response = client.get(
+        "/api/v1/notifications/reports/export",
+        params={"status": "failed", "format": "ndjson"},
+        headers=auth_headers,
+    )
+    assert response.status_code == HTTPStatus.OK
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["notification_id"] for line in lines] == [row.notification_id for row in rows]
+
+    response = client.get(
+        "/api/v1/notifications/reports/export",
+        params={"status": "failed", "format": "csv"},
+        headers=auth_headers,
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("text/csv")
+    csv_lines = response.text.strip().splitlines()
+    assert csv_lines[0].startswith("event_type,channel,recipient")
+    assert len(csv_lines) == 4
+
+
+
 # 3. Webhook endpoint
 @pytest.mark.asyncio
 async def test_webhook_updates_status(
-    client, notification_payload, db_session, mocker
+    client, notification_payload, db_session, status_buffer
 ):
 
     # Pre-populate DB
@@ -105,14 +474,108 @@ async def test_webhook_updates_status(
     await db_session.commit()
 
     webhook_payload = {
-        "event_id": notification_payload["event_type"],
+        "notification_id": notif.notification_id,
         "status": "delivered",
     }
     response = client.post("/api/v1/notifications/webhook", json=webhook_payload)
-    assert response.status_code == HTTPStatus.OK
+    assert response.status_code == HTTPStatus.ACCEPTED
+
+    # Applied on the buffer's next flush
+    await status_buffer.flush()
+    await db_session.refresh(notif)
+    assert notif.status == "delivered"
+
+
+# Native provider webhooks
+@pytest.fixture
+def sendgrid_signer(mocker):
+    import base64
+    import time
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_key = private_key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    mocker.patch.object(settings, "SENDGRID_WEBHOOK_PUBLIC_KEY", base64.b64encode(public_key).decode())
+
+    def sign(events) -> dict:
+        body = json.dumps(events).encode()
+        timestamp = str(int(time.time()))
+        signature = private_key.sign(timestamp.encode() + body, ec.ECDSA(hashes.SHA256()))
+        return {
+            "content": body,
+            "headers": {
+                "Content-Type": "application/json",
+                "X-Twilio-Email-Event-Webhook-Signature": base64.b64encode(signature).decode(),
+                "X-Twilio-Email-Event-Webhook-Timestamp": timestamp,
+            },
+        }
+
+    return sign
+
+
+def test_sendgrid_webhook_stages_events(client, mocker, sendgrid_signer):
+    queue = mocker.patch("app.api.v1.notifications.get_webhook_queue").return_value
+    queue.put_many.return_value = True
+    events = [
+        {"event": "delivered", "notification_id": "n1", "timestamp": 10},
+        {"event": "open", "notification_id": "n1", "timestamp": 20},
+    ]
+    response = client.post("/api/v1/notifications/webhook/sendgrid", **sendgrid_signer(events))
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert response.json()["count"] == 2
+    staged = queue.put_many.call_args.args[0]
+    assert [(e.notification_id, e.status) for e in staged] == [("n1", "delivered"), ("n1", "opened")]
+
+
+def test_sendgrid_webhook_rejects_bad_signature(client, mocker, sendgrid_signer):
+    queue = mocker.patch("app.api.v1.notifications.get_webhook_queue").return_value
+    signed = sendgrid_signer([{"event": "delivered", "notification_id": "n1"}])
+    signed["content"] = json.dumps([{"event": "bounce", "notification_id": "n1"}]).encode()
+    response = client.post("/api/v1/notifications/webhook/sendgrid", **signed)
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    response = client.post("/api/v1/notifications/webhook/sendgrid", json=[{"event": "delivered", "notification_id": "n1"}])
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    queue.put_many.assert_not_called()
+
+
+def test_sendgrid_webhook_queue_full(client, mocker, sendgrid_signer):
+    queue = mocker.patch("app.api.v1.notifications.get_webhook_queue").return_value
+    queue.put_many.return_value = False
+    response = client.post(
+        "/api/v1/notifications/webhook/sendgrid",
+        **sendgrid_signer([{"event": "delivered", "notification_id": "n1"}]),
+    )
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+
+def test_twilio_webhook_stages_event(client, mocker):
+    from app.services.webhooks import twilio_signature
+
+    queue = mocker.patch("app.api.v1.notifications.get_webhook_queue").return_value
+    queue.put_many.return_value = True
+    mocker.patch.object(settings, "TWILIO_STATUS_CALLBACK_URL", "https://notify.example.com/webhook/twilio")
+    params = {"MessageSid": "SM1", "MessageStatus": "undelivered"}
+    signature = twilio_signature(
+        settings.TWILIO_AUTH_TOKEN, "https://notify.example.com/webhook/twilio?notification_id=n9", params
+    )
+    headers = {"Content-Type": "application/x-www-form-urlencoded", "X-Twilio-Signature": signature}
+    response = client.post(
+        "/api/v1/notifications/webhook/twilio?notification_id=n9",
+        content="MessageSid=SM1&MessageStatus=undelivered",
+        headers=headers,
+    )
+    assert response.status_code == HTTPStatus.ACCEPTED
+    staged = queue.put_many.call_args.args[0]
+    assert [(e.notification_id, e.status) for e in staged] == [("n9", "failed")]
 
-    # Verify DB update
-    updated = await NotificationRepo.get_by_event_id(
-        db_session, notification_payload["event_type"]
+    # The signature covers the notification_id in the URL
+    response = client.post(
+        "/api/v1/notifications/webhook/twilio?notification_id=n10",
+        content="MessageSid=SM1&MessageStatus=undelivered",
+        headers=headers,
     )
-    assert updated.status == "delivered"
\ No newline at end of file
+    assert response.status_code == HTTPStatus.FORBIDDEN
+    assert queue.put_many.call_count == 1
@@ -1,5 +1,9 @@
 import pytest
 from app.repositories.notification_repo import NotificationRepo
+from app.repositories.status_buffer import StatusUpdateBuffer
+from app.repositories.report_cache import ReportCache
+from app.repositories.stats_repo import StatsRepo
+from app.schemas.notification import NotificationCreate
 from app.models.notifications import Notification
 
 
@@ -33,7 +37,221 @@ async def test_update_status(db_session):
     await db_session.commit()
 
     # Update
-    await NotificationRepo.update_status(db_session, "status_test", "delivered")
+    await NotificationRepo.update_status(db_session, notif.notification_id, "delivered")
 
-    updated = await NotificationRepo.get_by_event_id(db_session, "status_test")
-    assert updated.status == "delivered"
\ No newline at end of file
+    updated = await NotificationRepo.get_by_notification_id(db_session, notif.notification_id)
+    assert updated.status == "delivered"
+
+
+@pytest.mark.asyncio
+async def test_get_by_event_id_returns_latest(db_session):
+    for recipient in ("first@example.com", "second@example.com"):
+        db_session.add(
+            Notification(
+                event_type="shared_event",
+                channel="email",
+                recipient=recipient,
+                content="Same event",
+            )
+        )
+        await db_session.commit()
+
+    latest = await NotificationRepo.get_by_event_id(db_session, "shared_event")
+    assert latest.recipient == "second@example.com"
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_merges_and_bulk_updates(db_session):
+    rows = [
+        Notification(event_type="buffer_test", channel="email", recipient=f"r{i}@example.com",
+                     content="Buffered", status="pending", attempt=0)
+        for i in range(3)
+    ]
+    db_session.add_all(rows)
+    await db_session.commit()
+
+    from tests.conftest import TestingSessionLocal
+    buffer = StatusUpdateBuffer(session_factory=TestingSessionLocal, max_size=100, flush_interval_ms=60_000)
+    await buffer.add(rows[0].notification_id, attempts=1)
+    await buffer.add(rows[0].notification_id, "sent", attempts=1)
+    await buffer.add(rows[1].notification_id, "failed", attempts=1)
+    assert len(buffer) == 2
+
+    await buffer.close()
+    assert len(buffer) == 0
+
+    for row in rows:
+        await db_session.refresh(row)
+    assert (rows[0].status, rows[0].attempt) == ("sent", 2)
+    assert (rows[1].status, rows[1].attempt) == ("failed", 1)
+    assert (rows[2].status, rows[2].attempt) == ("pending", 0)
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_never_moves_status_backwards(db_session):
+    rows = [
+        Notification(event_type="buffer_rank", channel="email", recipient=f"r{i}@example.com",
+                     content="Ranked", status="pending")
+        for i in range(2)
+    ]
+    db_session.add_all(rows)
+    await db_session.commit()
+
+    from tests.conftest import TestingSessionLocal
+    buffer = StatusUpdateBuffer(session_factory=TestingSessionLocal, max_size=100, flush_interval_ms=60_000)
+    await buffer.add(rows[0].notification_id, "delivered")
+    await buffer.flush()
+    await buffer.add(rows[0].notification_id, "sent")  # late worker update, separate flush
+    await buffer.add(rows[1].notification_id, "opened")
+    await buffer.add(rows[1].notification_id, "delivered")  # same flush
+    await buffer.close()
+
+    for row in rows:
+        await db_session.refresh(row)
+    assert [row.status for row in rows] == ["delivered", "opened"]
+
+
+@pytest.mark.asyncio
+async def test_stats_rollup_follows_status_changes(db_session, stats_buffer):
+    from collections import Counter
+    from datetime import datetime, timedelta
+    from sqlalchemy import select
+    from app.models.stats import NotificationStat
+    payload = NotificationCreate(event_type="stats_test", channel="email",
+                                 recipient="stats@example.com", content="Stats")
+    created = await NotificationRepo.create_many(db_session, [payload] * 3)
+    # Nothing is upserted in the ingest transaction
+    assert (await db_session.execute(select(NotificationStat))).scalars().all() == []
+    StatsRepo.record(db_session, Counter({(datetime.utcnow(), "email", "stats_test", "pending"): 5}))
+    await db_session.rollback()  # dropped with the transaction
+
+    from tests.conftest import TestingSessionLocal
+    buffer = StatusUpdateBuffer(session_factory=TestingSessionLocal, max_size=100, flush_interval_ms=60_000)
+    await buffer.add(created[0].notification_id, "sent", attempts=1)
+    await buffer.add(created[1].notification_id, "failed", attempts=1)
+    await buffer.add(created[2].notification_id, attempts=1)  # attempt only, no transition
+    await buffer.close()
+    await NotificationRepo.update_status(db_session, created[0].notification_id, "delivered")
+    await stats_buffer.flush()
+
+    now = datetime.utcnow()
+    stats = await StatsRepo.summary(db_session, now - timedelta(days=1), now + timedelta(days=1),
+                                    bucket="day", event_type="stats_test")
+    assert len(stats) == 1
+    assert (stats[0]["sent"], stats[0]["failed"], stats[0]["pending"]) == (1, 1, 1)
+    assert stats[0]["counts"] == {"pending": 1, "delivered": 1, "failed": 1}  # sent +1 -1 never written
+    assert stats[0]["success_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_flushes_at_max_size(db_session):
+    notif = Notification(event_type="buffer_size", channel="sms", recipient="+1",
+                         content="Size", status="pending")
+    db_session.add(notif)
+    await db_session.commit()
+
+    from tests.conftest import TestingSessionLocal
+    buffer = StatusUpdateBuffer(session_factory=TestingSessionLocal, max_size=1, flush_interval_ms=60_000)
+    await buffer.add(notif.notification_id, "delivered")
+    assert len(buffer) == 0
+
+    await db_session.refresh(notif)
+    assert notif.status == "delivered"
+    await buffer.close()
+
+
+
+@pytest.mark.asyncio
+async def test_report_cache_lru_bound_and_invalidation():
+    cache = ReportCache(max_entries=2, ttl_s=60)
+    await cache.set("a", {"status": "sent"})
+    await cache.set("b", {"status": "sent"})
+    assert await cache.get("a") == {"status": "sent"}  # a is now most recent
+
+    await cache.set("c", {"status": "pending"})
+    assert await cache.get("b") is None  # least recently used evicted
+    assert await cache.get("a") is not None
+
+    await cache.invalidate(["a"])
+    assert await cache.get("a") is None
+    assert await cache.get("c") == {"status": "pending"}
+
+
+@pytest.mark.asyncio
+async def test_report_cache_drops_write_loaded_before_invalidation():
+    cache = ReportCache(max_entries=1, ttl_s=60)
+    version = await cache.version("a")
+    await cache.invalidate(["a"])  # status changed while the report was loading
+    await cache.set("a", {"status": "pending"}, version)
+    assert await cache.get("a") is None
+
+    version = await cache.version("b")
+    await cache.invalidate(["b", "c"])  # "b" falls out of the invalidation log
+    await cache.set("b", {"status": "sent"}, version)
+    assert await cache.get("b") is None  # can't tell, so not cached
+
+    version = await cache.version("b")
+    await cache.set("b", {"status": "sent"}, version)
+    assert await cache.get("b") == {"status": "sent"}
+
+
+@pytest.mark.asyncio
+async def test_report_cache_without_redis_has_no_local_tier(mocker):
+    from app.repositories.report_cache import get_report_cache, reset_report_cache
+
+    mocker.patch("app.repositories.report_cache.settings.REPORT_CACHE_REDIS_ENABLED", False)
+    reset_report_cache()
+    cache = get_report_cache()
+    await cache.set("a", {"status": "sent"})  # another process may change it unseen
+    assert await cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_report_cache_expires_local_entries():
+    cache = ReportCache(max_entries=10, ttl_s=0)
+    await cache.set("a", {"status": "sent"})
+    assert await cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_content_dedup_window_slides_from_each_claim(mocker):
+    from app.repositories.dedup_filter import DedupFilter
+
+    clock = mocker.patch("app.repositories.dedup_filter.time.monotonic", return_value=1000.0)
+    dedup = DedupFilter(max_entries=10)
+    assert await dedup.claim("k", "first", 60) is None
+    clock.return_value = 1059.0  # a fixed 60s bucket would have rolled over at 1020
+    assert await dedup.claim("k", "second", 60) == "first"
+    clock.return_value = 1061.0
+    assert await dedup.claim("k", "third", 60) is None
+    await dedup.release("k")  # e.g. the insert failed
+    assert await dedup.claim("k", "fourth", 60) is None
+
+
+@pytest.mark.asyncio
+async def test_bodies_stored_once_and_read_through_cache(db_session, body_cache, mocker):
+    from sqlalchemy import select
+    from app.models.bodies import NotificationBody
+    from app.schemas.notification import NotificationFilter
+
+    body = "<html>" + "x" * 30_000 + "</html>"
+    notifications = [
+        NotificationCreate(event_type="bodies", channel="email", recipient=f"u{i}@example.com", content=body)
+        for i in range(3)
+    ] + [NotificationCreate(event_type="bodies", channel="sms", recipient="+1", content="short")]
+    await NotificationRepo.create_many(db_session, notifications)
+    db_session.add(Notification(event_type="bodies", channel="email", recipient="orm@example.com", content=body))
+    await db_session.commit()
+
+    stored = (await db_session.execute(select(NotificationBody))).scalars().all()
+    assert len(stored) == 2
+    assert max(len(row.data) for row in stored) < 1000  # compressed
+
+    spy = mocker.spy(db_session, "execute")
+    page = await NotificationRepo.list_page(db_session, NotificationFilter(event_type="bodies"), 10)
+    assert [row["content"] for row in page].count(body) == 4
+    page = await NotificationRepo.list_page(db_session, NotificationFilter(event_type="bodies"), 10)
+    assert spy.call_count == 3  # second page served its bodies from the cache
+
+    report = await NotificationRepo.get_report(db_session, page[0]["notification_id"])
+    assert report.content == page[0]["content"]
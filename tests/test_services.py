@@ -0,0 +1,511 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import httpx
+
+from app.services.clients import FirebaseClient, SendGridClient, TwilioClient
+from app.services.rate_limit import LocalTokenBucket, RateLimited, RateLimiter
+
+
+class _StubProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real providers
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode()
+        self.server.requests.append((self.path, self.headers, body))
+        self.server.ports.add(self.client_address[1])
+
+        if self.path == "/v3/mail/send":
+            self._reply(202, b"")
+        elif self.path.endswith("/Messages.json"):
+            self._reply(201, json.dumps({"sid": "SM123"}).encode())
+        elif self.path.endswith("/messages:send"):
+            self._reply(200, json.dumps({"name": "projects/p/messages/1"}).encode())
+        else:
+            self._reply(404, b"")
+
+    def _reply(self, code, payload):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubProviderHandler)
+    server.requests = []
+    server.ports = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.mark.asyncio
+async def test_sendgrid_client_reuses_connection(stub_server):
+    client = SendGridClient("sg-key", base_url=_url(stub_server), pool_size=1)
+    for _ in range(3):
+        response = await client.send_mail({"subject": "Hi"})
+        assert response.status_code == 202
+    await client.aclose()
+
+    assert len(stub_server.requests) == 3
+    assert stub_server.requests[0][1]["Authorization"] == "Bearer sg-key"
+    assert len(stub_server.ports) == 1  # one keep-alive connection
+
+
+@pytest.mark.asyncio
+async def test_twilio_client_posts_form(stub_server):
+    client = TwilioClient("AC1", "token", base_url=_url(stub_server))
+    message = await client.create_message(to="+1555", from_="+1444", body="SMS")
+    await client.aclose()
+
+    assert message["sid"] == "SM123"
+    path, _, body = stub_server.requests[0]
+    assert path == "/2010-04-01/Accounts/AC1/Messages.json"
+    assert parse_qs(body) == {"To": ["+1555"], "From": ["+1444"], "Body": ["SMS"]}
+
+
+@pytest.mark.asyncio
+async def test_firebase_client_caches_access_token(stub_server):
+    calls = []
+
+    def token_provider():
+        calls.append(1)
+        return "fcm-token", None
+
+    client = FirebaseClient("proj", token_provider, base_url=_url(stub_server))
+    await client.send_message({"token": "device-1"})
+    await client.send_message({"token": "device-2"})
+    await client.aclose()
+
+    assert len(calls) == 1
+    path, headers, body = stub_server.requests[1]
+    assert path == "/v1/projects/proj/messages:send"
+    assert headers["Authorization"] == "Bearer fcm-token"
+    assert json.loads(body) == {"message": {"token": "device-2"}}
+
+
+# Outbound rate limiting
+class _CountingBucket(LocalTokenBucket):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.takes = 0
+
+    async def take(self, requested):
+        self.takes += 1
+        return await super().take(requested)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_leases_tokens_in_blocks():
+    bucket = _CountingBucket(1000, 100)
+    limiter = RateLimiter("twilio", bucket, lease_size=10, lease_ttl_s=60, max_wait_s=1)
+    for _ in range(25):
+        await limiter.acquire()
+    assert bucket.takes == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_raises_past_max_wait():
+    limiter = RateLimiter("twilio", LocalTokenBucket(1, 1), lease_size=1, max_wait_s=0.1)
+    await limiter.acquire()
+    with pytest.raises(RateLimited) as exc_info:
+        await limiter.acquire()
+    assert 0 < exc_info.value.retry_after <= 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_waiters_keep_their_own_deadline():
+    limiter = RateLimiter("twilio", LocalTokenBucket(4, 1), lease_size=1, max_wait_s=0.3)
+    await limiter.acquire()
+    started = time.monotonic()
+    results = await asyncio.gather(*(limiter.acquire() for _ in range(3)), return_exceptions=True)
+    assert time.monotonic() - started < 0.45  # no waiter queues behind another's sleep
+    assert results.count(None) == 1
+    assert sum(isinstance(result, RateLimited) for result in results) == 2
+
+
+@pytest.mark.asyncio
+async def test_tenant_quota_keeps_leftovers_of_concurrent_leases():
+    from app.services.tenant_quota import LocalSlidingWindow, TenantRateLimiter
+
+    class SlowWindow(LocalSlidingWindow):
+        takes = 0
+
+        async def take(self, *args):
+            self.takes += 1
+            await asyncio.sleep(0.01)
+            return await super().take(*args)
+
+    store = SlowWindow()
+    limiter = TenantRateLimiter(store, window_s=60, lease_size=10, lease_ttl_s=60)
+    assert await asyncio.gather(limiter.check("acme"), limiter.check("acme")) == [None, None]
+    for _ in range(18):  # both leftovers of 9 are still leased
+        assert await limiter.check("acme") is None
+    assert store.takes == 2
+
+
+@pytest.mark.asyncio
+async def test_provider_429_raises_rate_limited():
+    transport = httpx.MockTransport(lambda request: httpx.Response(429, headers={"Retry-After": "3"}))
+    client = SendGridClient("sg-key", base_url="http://sendgrid.test", transport=transport)
+    with pytest.raises(RateLimited) as exc_info:
+        await client.send_mail({"subject": "Hi"})
+    await client.aclose()
+    assert exc_info.value.retry_after == 3
+
+    from prometheus_client import REGISTRY
+    labels = {"provider": "sendgrid", "outcome": "throttled"}
+    assert REGISTRY.get_sample_value("provider_request_duration_seconds_count", labels) >= 1
+
+
+# Circuit breakers and failover
+@pytest.mark.asyncio
+async def test_circuit_breaker_opens_and_probes():
+    from app.services.circuit_breaker import CircuitBreaker, CircuitOpen
+
+    calls = []
+    status = {"code": 503}
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(status["code"])
+
+    now = [100.0]
+    breaker = CircuitBreaker("sendgrid", failure_threshold=2, open_s=30, half_open_calls=1, clock=lambda: now[0])
+    client = SendGridClient("sg-key", base_url="http://sendgrid.test", transport=httpx.MockTransport(handler), breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.send_mail({})
+    # Open: fails fast without calling the provider
+    with pytest.raises(CircuitOpen) as exc_info:
+        await client.send_mail({})
+    assert isinstance(exc_info.value, RateLimited)
+    assert len(calls) == 2
+
+    # Half-open after open_s: one probe, which closes the circuit on success
+    now[0] += 31
+    status["code"] = 202
+    await client.send_mail({})
+    assert breaker.state == "closed"
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_provider_call_deadline():
+    async def slow(request):
+        await asyncio.sleep(1)
+        return httpx.Response(202)
+
+    client = SendGridClient("sg-key", base_url="http://sendgrid.test", transport=httpx.MockTransport(slow), deadline=0.05)
+    with pytest.raises(httpx.TimeoutException):
+        await client.send_mail({})
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_failover_only_when_primary_unreachable():
+    from app.services.circuit_breaker import CircuitBreaker
+    from app.services.clients import FailoverClient
+
+    def refuse(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    secondary_calls = []
+
+    def accept(request):
+        secondary_calls.append(request)
+        return httpx.Response(201, json={"sid": "SM2"})
+
+    primary = TwilioClient(
+        "AC1", "token", base_url="http://primary.test", phone_number="+1000",
+        transport=httpx.MockTransport(refuse), breaker=CircuitBreaker("twilio", failure_threshold=5),
+    )
+    secondary = TwilioClient(
+        "AC2", "token", base_url="http://secondary.test", phone_number="+2000",
+        transport=httpx.MockTransport(accept), name="twilio_secondary",
+    )
+    client = FailoverClient(primary, secondary)
+    message = await client.create_message(to="+1555", body="SMS")
+    assert message["sid"] == "SM2"
+    assert parse_qs(secondary_calls[0].content.decode())["From"] == ["+2000"]
+
+    await primary.aclose()
+
+    # A 5xx may have been accepted by the primary, so it is not failed over
+    primary = TwilioClient(
+        "AC1", "token", base_url="http://primary.test", transport=httpx.MockTransport(lambda request: httpx.Response(500))
+    )
+    client = FailoverClient(primary, secondary)
+    with pytest.raises(httpx.HTTPStatusError):
+        await client.create_message(to="+1555", body="SMS")
+    assert len(secondary_calls) == 1
+    await client.aclose()
+
+
+# Push micro-batching
+class _FakeFirebaseClient:
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    async def send_multicast(self, message, tokens):
+        self.calls.append((message["notification"]["body"], list(tokens)))
+        return [
+            RuntimeError("unregistered") if token in self.failing else {"name": token}
+            for token in tokens
+        ]
+
+
+@pytest.mark.asyncio
+async def test_push_batcher_groups_identical_payloads():
+    from app.services.push import PushBatcher
+
+    fake = _FakeFirebaseClient(failing={"t3"})
+    batcher = PushBatcher(client_factory=lambda: fake, window_ms=10, max_tokens=500)
+
+    results = await asyncio.gather(
+        batcher.send("t1", "Sale"),
+        batcher.send("t2", "Sale"),
+        batcher.send("t3", "Sale"),
+        batcher.send("t4", "Other"),
+    )
+
+    assert results == [True, True, False, True]
+    assert sorted(fake.calls) == [("Other", ["t4"]), ("Sale", ["t1", "t2", "t3"])]
+
+
+@pytest.mark.asyncio
+async def test_push_batcher_flushes_at_max_tokens():
+    from app.services.push import PushBatcher
+
+    fake = _FakeFirebaseClient()
+    batcher = PushBatcher(client_factory=lambda: fake, window_ms=60_000, max_tokens=2)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(batcher.send("t1", "Hi"), batcher.send("t2", "Hi")), 1
+    )
+    assert results == [True, True]
+    assert fake.calls == [("Hi", ["t1", "t2"])]
+
+
+# Email personalization batching
+@pytest.mark.asyncio
+async def test_email_batcher_coalesces_personalizations(stub_server):
+    from app.services.email import EmailBatcher
+
+    client = SendGridClient("sg-key", base_url=_url(stub_server))
+    batcher = EmailBatcher(client_factory=lambda: client, window_ms=10, max_recipients=1000)
+
+    results = await asyncio.gather(
+        *(batcher.send(f"user{i}@example.com", "News", "<p>Hi</p>") for i in range(5)),
+        batcher.send("other@example.com", "Alert", "<p>Down</p>"),
+    )
+    await client.aclose()
+
+    assert results == [True] * 6
+    bodies = sorted((json.loads(body) for _, _, body in stub_server.requests), key=lambda b: b["subject"])
+    assert [b["subject"] for b in bodies] == ["Alert", "News"]
+    assert len(bodies[1]["personalizations"]) == 5
+    assert {p["to"][0]["email"] for p in bodies[1]["personalizations"]} == {
+        f"user{i}@example.com" for i in range(5)
+    }
+
+
+# Provider webhook ingestion
+class _RecordingBuffer:
+    def __init__(self):
+        self.updates = []
+
+    async def add(self, notification_id, status=None, attempts=0):
+        self.updates.append((notification_id, status))
+
+
+def test_parse_sendgrid_events_maps_statuses():
+    from app.services.webhooks import StatusEvent, parse_sendgrid_events
+
+    events = [
+        {"event": "processed", "notification_id": "n1", "timestamp": 1},
+        {"event": "delivered", "notification_id": "n1", "timestamp": 2},
+        {"event": "bounce", "notification_id": "n2", "timestamp": 3},
+        {"event": "delivered", "email": "no-custom-arg@example.com", "timestamp": 4},
+    ]
+    assert parse_sendgrid_events(events) == [
+        StatusEvent("n1", "delivered", 2.0),
+        StatusEvent("n2", "bounced", 3.0),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_webhook_queue_keeps_latest_event_per_notification():
+    from app.services.webhooks import StatusEvent, WebhookQueue
+
+    buffer = _RecordingBuffer()
+    queue = WebhookQueue(max_size=10, batch_size=10, buffer_factory=lambda: buffer)
+    assert queue.put_many([
+        StatusEvent("n1", "opened", 5),
+        StatusEvent("n1", "delivered", 2),
+        StatusEvent("n2", "failed", 1),
+    ])
+    await queue.close()
+
+    assert sorted(buffer.updates) == [("n1", "opened"), ("n2", "failed")]
+
+
+@pytest.mark.asyncio
+async def test_webhook_queue_close_finishes_the_batch_in_flight():
+    from app.services.webhooks import StatusEvent, WebhookQueue
+
+    class SlowBuffer(_RecordingBuffer):
+        async def add(self, notification_id, status=None, attempts=0):
+            await asyncio.sleep(0.01)
+            await super().add(notification_id, status, attempts)
+
+    buffer = SlowBuffer()
+    queue = WebhookQueue(max_size=10, batch_size=2, buffer_factory=lambda: buffer)
+    queue.put_many([StatusEvent(f"n{i}", "delivered") for i in range(5)])
+    await asyncio.sleep(0.005)  # the consumer is inside its first batch
+    await queue.close()
+    assert sorted(buffer.updates) == [(f"n{i}", "delivered") for i in range(5)]
+
+
+def test_webhook_queue_rejects_when_full():
+    from app.services.webhooks import StatusEvent, WebhookQueue
+
+    queue = WebhookQueue(max_size=1, buffer_factory=_RecordingBuffer)
+    assert not queue.put_many([StatusEvent("n1", "sent"), StatusEvent("n2", "sent")])
+    assert len(queue) == 0
+
+
+# JWT verification cache
+@pytest.mark.asyncio
+async def test_token_verifier_caches_until_exp(mocker):
+    import time
+    from jose import jwt
+    from app.core.security import TokenVerifier
+
+    verifier = TokenVerifier(secret_key="k", jwks_url="", algorithms=["HS256"], ttl_s=300)
+    decode = mocker.spy(jwt, "decode")
+    token = jwt.encode({"sub": "svc", "exp": int(time.time()) + 1}, "k", algorithm="HS256")
+    assert (await verifier.verify(token))["sub"] == "svc"
+    assert (await verifier.verify(token))["sub"] == "svc"
+    assert decode.call_count == 1
+
+    # Past exp the cached entry is dropped and the token is verified again
+    mocker.patch("app.core.security.time.time", return_value=time.time() + 5)
+    await verifier.verify(token)
+    assert decode.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_token_verifier_uses_jwks_keys():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from jose import jwk, jwt
+    from app.core.security import TokenVerifier
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public_jwk = {**jwk.construct(pem, "RS256").public_key().to_dict(), "kid": "k1"}
+    fetches = []
+
+    async def fetch(url):
+        fetches.append(url)
+        return {"keys": [public_jwk]}
+
+    verifier = TokenVerifier(jwks_url="https://idp.test/jwks", algorithms=["RS256"], jwks_fetcher=fetch)
+    for sub in ("a", "b"):
+        token = jwt.encode({"sub": sub}, pem.decode(), algorithm="RS256", headers={"kid": "k1"})
+        assert (await verifier.verify(token))["sub"] == sub
+    assert fetches == ["https://idp.test/jwks"]
+
+
+@pytest.mark.asyncio
+async def test_token_verifier_jwks_outage(mocker):
+    from jose import JWTError, jwt
+    from app.core.security import JWKSUnavailable, TokenVerifier
+
+    async def fetch(url):
+        raise httpx.ConnectError("idp down")
+
+    verifier = TokenVerifier(jwks_url="https://idp.test/jwks", algorithms=["RS256"], jwks_fetcher=fetch)
+    token = jwt.encode({"sub": "svc"}, "k", algorithm="HS256", headers={"kid": "k2"})
+    with pytest.raises(JWKSUnavailable):
+        await verifier.verify(token)
+
+    # With a stale key set the unknown key id is rejected as an invalid token
+    mocker.patch("app.core.security.settings.JWT_JWKS_REFRESH_S", 0)
+    verifier._keys = {"k1": {}}
+    with pytest.raises(JWTError):
+        await verifier.verify(token)
+
+
+# Logging pipeline
+def test_sampling_filter_keeps_warnings():
+    import logging
+    from app.core.logging import SamplingFilter
+
+    sampler = SamplingFilter(0.0)
+    info = logging.LogRecord("app", logging.INFO, __file__, 1, "sent %s", ("x",), None)
+    warning = logging.LogRecord("app", logging.WARNING, __file__, 1, "slow %s", ("x",), None)
+    assert not sampler.filter(info)
+    assert sampler.filter(warning)
+
+
+def test_queue_handler_drops_when_full():
+    import logging
+    import queue
+    from app.core.logging import JsonFormatter, NonBlockingQueueHandler
+
+    from prometheus_client import REGISTRY
+
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    recipient = {"to": "a@b.c"}
+    record = logging.LogRecord("app", logging.INFO, __file__, 1, "sent to %s", (recipient,), None)
+    dropped = REGISTRY.get_sample_value("log_records_dropped_total") or 0
+    handler.handle(record)
+    handler.handle(record)
+    assert REGISTRY.get_sample_value("log_records_dropped_total") == dropped + 1
+    # The message is frozen when logged; only JSON formatting is left to the writer
+    recipient["to"] = "changed@b.c"
+    queued = handler.queue.get_nowait()
+    assert queued.args is None
+    assert json.loads(JsonFormatter().format(queued))["message"] == "sent to {'to': 'a@b.c'}"
+
+
+# Templates
+@pytest.mark.asyncio
+async def test_template_registry_compiles_once(db_session, mocker):
+    from app.repositories.template_repo import TemplateRepo
+    from app.services.templates import TemplateError, TemplateRegistry
+
+    await TemplateRepo.create(db_session, "promo", "push", "{{ pct }}% off", "Sale")
+    registry = TemplateRegistry(max_entries=10, latest_ttl_s=60)
+    lookup = mocker.spy(TemplateRepo, "get")
+    first = await registry.get(db_session, "promo")
+    assert await registry.get(db_session, "promo") is first
+    assert await registry.get(db_session, "promo", 1) is first
+    assert lookup.call_count == 1
+
+    assert first.render({"pct": 20}) == ("Sale", "20% off")
+    with pytest.raises(TemplateError):
+        first.render({})
@@ -1,7 +1,11 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, patch
 
 from app.workers.tasks import send_notification
+from app.workers.runtime import run_coroutine
+from app.workers.outbox_relay import relay_once
+from app.schemas.notification import NotificationCreate
 from app.workers.celery_app import celery_app
 from app.models.notifications import Notification
 from app.repositories.notification_repo import NotificationRepo
@@ -19,11 +23,12 @@ async def _insert_pending(db_session, payload):
 
 # 1. Email path – success
 @pytest.mark.asyncio
-@patch("app.services.email.send_email", new_callable=AsyncMock)
-async def test_email_success(mock_send_email, db_session):
+@patch("app.workers.tasks.send_email", new_callable=AsyncMock)
+async def test_email_success(mock_send_email, db_session, status_buffer):
     mock_send_email.return_value = True
     payload = {
         "event_type": "email_test",
+        "notification_id": "email_test-id",
         "channel": "email",
         "recipient": "a@b.c",
         "content": "Hi",
@@ -31,23 +36,109 @@ async def test_email_success(mock_send_email, db_session):
 
     await _insert_pending(db_session, payload)
 
+    from prometheus_client import REGISTRY
+    sent_before = REGISTRY.get_sample_value("notification_sent_total", {"channel": "email"}) or 0
+
     # Run task (eager mode)
-    await send_notification(payload)
+    send_notification(payload)
 
-    mock_send_email.assert_awaited_once_with("a@b.c", "Hi")
-    repo = await NotificationRepo.get_by_event_id(db_session, "email_test")
+    mock_send_email.assert_awaited_once_with("a@b.c", "Hi", notification_id="email_test-id", subject=None)
+    assert REGISTRY.get_sample_value("notification_sent_total", {"channel": "email"}) == sent_before + 1
+    await status_buffer.flush()
+    repo = await NotificationRepo.get_by_notification_id(db_session, "email_test-id")
     assert repo.status == "sent"
     assert repo.attempts == 1
 
 
+# Templated email is rendered in the worker from the compiled template
+@pytest.mark.asyncio
+@patch("app.workers.tasks.send_email", new_callable=AsyncMock)
+async def test_templated_email_rendered(mock_send_email, db_session, status_buffer, mocker):
+    from app.repositories.template_repo import TemplateRepo
+    from tests.conftest import TestingSessionLocal
+
+    mocker.patch("app.workers.tasks.SessionLocal", TestingSessionLocal)
+    mock_send_email.return_value = True
+    await TemplateRepo.create(db_session, "welcome", "email", "<p>Hi {{ name }}</p>", "Welcome {{name}}")
+    payload = {
+        "event_type": "email_template_test",
+        "notification_id": "email_template-id",
+        "channel": "email",
+        "recipient": "a@b.c",
+        "template_id": "welcome",
+        "template_version": 1,
+        "variables": {"name": "<Ann>"},
+    }
+    await _insert_pending(db_session, payload)
+
+    send_notification(payload)
+
+    mock_send_email.assert_awaited_once_with(
+        "a@b.c", "<p>Hi &lt;Ann&gt;</p>", notification_id="email_template-id", subject="Welcome <Ann>"
+    )
+
+
+# Missing template variables fail the notification without retrying
+@pytest.mark.asyncio
+@patch("app.workers.tasks.send_email", new_callable=AsyncMock)
+async def test_template_error_fails_without_retry(mock_send_email, db_session, status_buffer, mocker):
+    from app.repositories.template_repo import TemplateRepo
+    from tests.conftest import TestingSessionLocal
+
+    mocker.patch("app.workers.tasks.SessionLocal", TestingSessionLocal)
+    await TemplateRepo.create(db_session, "reset", "email", "Code {{ code }}")
+    payload = {
+        "event_type": "email_template_test",
+        "notification_id": "email_template-missing",
+        "channel": "email",
+        "recipient": "a@b.c",
+        "template_id": "reset",
+        "template_version": 1,
+        "variables": {},
+    }
+    await _insert_pending(db_session, payload)
+
+    assert send_notification(payload) is False
+
+    mock_send_email.assert_not_awaited()
+    await status_buffer.flush()
+    repo = await NotificationRepo.get_by_notification_id(db_session, "email_template-missing")
+    assert repo.status == "failed"
+
+
+# Redelivered message (at-least-once outbox relay) is not sent twice
+@pytest.mark.asyncio
+@patch("app.workers.tasks.send_email", new_callable=AsyncMock)
+async def test_redelivered_notification_sent_once(mock_send_email, db_session, status_buffer):
+    mock_send_email.return_value = True
+    payloads = [
+        {"event_type": "redelivery", "notification_id": f"redelivery-{i}", "channel": "email",
+         "recipient": "a@b.c", "content": "Once"}
+        for i in range(2)
+    ]
+    for payload in payloads:
+        await _insert_pending(db_session, payload)
+
+    send_notification(payloads[0])
+    send_notification(payloads[0])  # status still buffered
+    send_notification(payloads[1])
+    await status_buffer.flush()
+    send_notification(payloads[1])  # status already flushed
+
+    assert mock_send_email.await_count == 2
+    repo = await NotificationRepo.get_by_notification_id(db_session, "redelivery-1")
+    assert (repo.status, repo.attempts) == ("sent", 1)
+
+
 # 2. Email path – failure → retry → final failure
 @pytest.mark.asyncio
-@patch("app.services.email.send_email", new_callable=AsyncMock)
+@patch("app.workers.tasks.send_email", new_callable=AsyncMock)
 async def test_email_retry_exhaust(mock_send_email, db_session, mocker):
     mock_send_email.side_effect = [False, False, False]  # always fail
 
     payload = {
         "event_type": "email_retry",
+        "notification_id": "email_retry-id",
         "channel": "email",
         "recipient": "x@y.z",
         "content": "Retry me",
@@ -57,58 +148,63 @@ async def test_email_retry_exhaust(mock_send_email, db_session, mocker):
     # Patch Celery retry to raise MaxRetriesExceededError after 3 attempts
     with patch.object(send_notification, "retry", side_effect=send_notification.MaxRetriesExceededError):
         with pytest.raises(send_notification.MaxRetriesExceededError):
-            await send_notification.bind(celery_app).apply_async(args=(payload,))
+            send_notification.bind(celery_app).apply_async(args=(payload,))
 
-    repo = await NotificationRepo.get_by_event_id(db_session, "email_retry")
+    repo = await NotificationRepo.get_by_notification_id(db_session, "email_retry-id")
     assert repo.status == "failed"
     assert repo.attempts == 3
 
 
 # 3. SMS path
 @pytest.mark.asyncio
-@patch("app.services.sms.send_sms", new_callable=AsyncMock)
-async def test_sms_success(mock_send_sms, db_session):
+@patch("app.workers.tasks.send_sms", new_callable=AsyncMock)
+async def test_sms_success(mock_send_sms, db_session, status_buffer):
     mock_send_sms.return_value = True
     payload = {
         "event_type": "sms_test",
+        "notification_id": "sms_test-id",
         "channel": "sms",
         "recipient": "+1234567890",
         "content": "SMS",
     }
     await _insert_pending(db_session, payload)
 
-    await send_notification(payload)
+    send_notification(payload)
 
     mock_send_sms.assert_awaited_once()
-    repo = await NotificationRepo.get_by_event_id(db_session, "sms_test")
+    await status_buffer.flush()
+    repo = await NotificationRepo.get_by_notification_id(db_session, "sms_test-id")
     assert repo.status == "sent"
 
 
 # 4. Push path
 @pytest.mark.asyncio
-@patch("app.services.push.send_push", new_callable=AsyncMock)
-async def test_push_success(mock_send_push, db_session):
+@patch("app.workers.tasks.send_push", new_callable=AsyncMock)
+async def test_push_success(mock_send_push, db_session, status_buffer):
     mock_send_push.return_value = True
     payload = {
         "event_type": "push_test",
+        "notification_id": "push_test-id",
         "channel": "push",
         "recipient": "device-token-123",
         "content": "Push",
     }
     await _insert_pending(db_session, payload)
 
-    await send_notification(payload)
+    send_notification(payload)
 
     mock_send_push.assert_awaited_once()
-    repo = await NotificationRepo.get_by_event_id(db_session, "push_test")
+    await status_buffer.flush()
+    repo = await NotificationRepo.get_by_notification_id(db_session, "push_test-id")
     assert repo.status == "sent"
 
 
 # 5. Invalid channel
 @pytest.mark.asyncio
-async def test_invalid_channel(db_session):
+async def test_invalid_channel(db_session, status_buffer):
     payload = {
         "event_type": "bad",
+        "notification_id": "bad-id",
         "channel": "fax",
         "recipient": "123",
         "content": "Nope",
@@ -116,7 +212,190 @@ async def test_invalid_channel(db_session):
     await _insert_pending(db_session, payload)
 
     with pytest.raises(ValueError, match="Invalid channel"):
-        await send_notification(payload)
+        send_notification(payload)
+
+    await status_buffer.flush()
+    repo = await NotificationRepo.get_by_notification_id(db_session, "bad-id")
+    await db_session.refresh(repo)
+    assert repo.status == "pending"  # task never updates status on exception
+    assert repo.attempts == 1
+
+
+@pytest.mark.asyncio
+@patch("app.workers.tasks.send_sms", new_callable=AsyncMock)
+async def test_rate_limited_send_is_rescheduled(mock_send_sms, db_session, status_buffer, mocker):
+    from app.services.rate_limit import RateLimited
+
+    payload = {
+        "event_type": "throttled",
+        "notification_id": "throttled-id",
+        "channel": "sms",
+        "recipient": "+1555",
+        "content": "Later",
+    }
+    await _insert_pending(db_session, payload)
+    mock_send_sms.side_effect = RateLimited("twilio", 1.5)
+    apply_async = mocker.patch.object(send_notification, "apply_async")
+
+    assert send_notification(payload) is False
+    assert apply_async.call_args.args == ((payload,),)
+    assert apply_async.call_args.kwargs["countdown"] == 1.5
+
+    await status_buffer.flush()
+    repo = await NotificationRepo.get_by_notification_id(db_session, "throttled-id")
+    await db_session.refresh(repo)
+    assert (repo.status, repo.attempts) == ("pending", 0)  # nothing was sent
+
+
+# 6. Worker runtime – one shared loop per process
+def test_run_coroutine_reuses_worker_loop():
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    first = run_coroutine(current_loop())
+    second = run_coroutine(current_loop())
+    assert first is second
+    assert first.is_running()
+
+
+
+# 7. Outbox relay – ordered batches, deleted once published
+@pytest.mark.asyncio
+async def test_outbox_relay_publishes_in_order(db_session):
+    from tests.conftest import TestingSessionLocal
+
+    created = await NotificationRepo.create_many(db_session, [
+        NotificationCreate(event_type="relay", channel="sms", recipient=f"+{i}", content="Relay")
+        for i in range(3)
+    ])
+    published = []
+
+    def publish(messages):
+        published.extend(message.payload["notification_id"] for message in messages)
+
+    assert await relay_once(TestingSessionLocal, publish, batch_size=2) == 2
+    assert await relay_once(TestingSessionLocal, publish, batch_size=2) == 1
+    assert await relay_once(TestingSessionLocal, publish, batch_size=2) == 0
+    assert published == [row.notification_id for row in created]
+
+
+@pytest.mark.asyncio
+async def test_outbox_relay_keeps_messages_when_publish_fails(db_session):
+    from tests.conftest import TestingSessionLocal
+
+    await NotificationRepo.create_many(db_session, [
+        NotificationCreate(event_type="relay_fail", channel="sms", recipient="+1", content="Relay")
+    ])
+
+    def publish(messages):
+        raise ConnectionError("broker down")
+
+    with pytest.raises(ConnectionError):
+        await relay_once(TestingSessionLocal, publish, batch_size=10)
+    assert await relay_once(TestingSessionLocal, lambda messages: None, batch_size=10) == 1
+
+
+# 8. Queue routing – per channel and priority
+def test_notifications_route_to_channel_priority_queue():
+    router = celery_app.amqp.router
+    task = "app.workers.tasks.send_notification"
+    route = router.route({}, task, args=({"channel": "email", "priority": "bulk"},))
+    assert route["queue"].name == "email.bulk"
+    # Messages published before priorities existed stay transactional
+    route = router.route({}, task, args=({"channel": "sms"},))
+    assert route["queue"].name == "sms.transactional"
+
+
+def test_worker_pool_uses_tier_profile():
+    from app.workers.worker import resolve_queues, worker_argv
+
+    queues = resolve_queues(["transactional"])
+    assert queues == ["email.transactional", "sms.transactional", "push.transactional"]
+    argv = worker_argv(["push.bulk"])
+    assert "--queues=push.bulk" in argv
+    assert "--prefetch-multiplier=16" in argv
+    with pytest.raises(ValueError):
+        worker_argv(["email.transactional", "email.bulk"])
+
+
+@pytest.mark.asyncio
+async def test_scheduler_releases_due_notifications(db_session):
+    from datetime import datetime, timedelta
+    from app.models.outbox import OutboxMessage
+    from app.workers.scheduler import schedule_once
+    from sqlalchemy import select, update
+    from tests.conftest import TestingSessionLocal
+
+    now = datetime.utcnow()
+    created = await NotificationRepo.create_many(db_session, [
+        NotificationCreate(
+            event_type="scheduled", channel="sms", recipient=f"+1{i}", content="Later",
+            priority="bulk", send_at=now + timedelta(hours=i + 1),
+        )
+        for i in range(3)
+    ])
+    # Nothing is staged for the broker until the rows are due
+    assert (await db_session.execute(select(OutboxMessage))).scalars().all() == []
+    for row, send_at in zip(created[:2], [now - timedelta(seconds=2), now - timedelta(seconds=1)]):
+        await db_session.execute(update(Notification).where(Notification.id == row.id).values(send_at=send_at))
+    await db_session.commit()
+
+    assert await schedule_once(TestingSessionLocal, batch_size=1) == 1
+    assert await schedule_once(TestingSessionLocal, batch_size=10) == 1
+    assert await schedule_once(TestingSessionLocal, batch_size=10) == 0
+
+    messages = (await db_session.execute(select(OutboxMessage).order_by(OutboxMessage.id))).scalars().all()
+    assert [m.payload["notification_id"] for m in messages] == [row.notification_id for row in created[:2]]
+    assert messages[0].payload["content"] == "Later"
+    assert messages[0].payload["priority"] == "bulk"
+    db_session.expire_all()
+    future = await NotificationRepo.get_by_notification_id(db_session, created[2].notification_id)
+    assert future.status == "scheduled"
+
+
+@pytest.mark.asyncio
+async def test_digest_combines_notifications_per_recipient(db_session, mocker):
+    from datetime import datetime, timedelta
+    from app.core.config import settings
+    from app.models.outbox import OutboxMessage
+    from app.workers.scheduler import schedule_once
+    from sqlalchemy import select, update
+    from tests.conftest import TestingSessionLocal
+
+    mocker.patch.dict(settings.DIGEST_POLICIES, {"comment": 3600})
+    first = await NotificationRepo.create(
+        db_session, NotificationCreate(event_type="comment", channel="push", recipient="device-1", content="Ann commented")
+    )
+    created = await NotificationRepo.create_many(db_session, [
+        NotificationCreate(event_type="comment", channel="push", recipient="device-1", content="Bob commented"),
+        NotificationCreate(event_type="comment", channel="push", recipient="device-2", content="Cy commented"),
+        NotificationCreate(event_type="like", channel="push", recipient="device-1", content="Dee liked"),
+    ])
+    # Only the event type without a policy is sent right away
+    messages = (await db_session.execute(select(OutboxMessage))).scalars().all()
+    assert [m.payload["notification_id"] for m in messages] == [created[2].notification_id]
+
+    member_ids = [first.notification_id] + [row.notification_id for row in created[:2]]
+    db_session.expire_all()
+    members = [await NotificationRepo.get_by_notification_id(db_session, member_id) for member_id in member_ids]
+    assert [member.status for member in members] == ["digested"] * 3
+    assert members[0].digest_id == members[1].digest_id != members[2].digest_id
+
+    # Reports point members at the digest by its external id
+    from app.schemas.notification import NotificationFilter, NotificationReport
+    digest = await NotificationRepo.get_by_id(db_session, members[0].digest_id)
+    report = NotificationReport.model_validate(await NotificationRepo.get_report(db_session, member_ids[0]))
+    assert report.digest_notification_id == digest.notification_id
+    page = await NotificationRepo.list_page(db_session, NotificationFilter(event_type="comment"), 10)
+    assert {row["notification_id"]: row["digest_notification_id"] for row in page}[member_ids[1]] == digest.notification_id
+
+    # Release the digests as if their window had closed
+    await db_session.execute(
+        update(Notification).where(Notification.status == "scheduled").values(send_at=datetime.utcnow() - timedelta(seconds=1))
+    )
+    await db_session.commit()
+    assert await schedule_once(TestingSessionLocal) == 2
 
-    repo = await NotificationRepo.get_by_event_id(db_session, "bad")
-    assert repo.status == "pending"  # task never updates on exception
\ No newline at end of file
+    messages = (await db_session.execute(select(OutboxMessage).order_by(OutboxMessage.id))).scalars().all()
+    contents = {m.payload["recipient"]: m.payload["content"] for m in messages[1:]}
+    assert contents == {"device-1": "Ann commented\n\nBob commented", "device-2": "Cy commented"}